@@ -1,7 +1,8 @@
 import asyncio
+import functools
 import logging
 import os
-from typing import List, Sequence, Tuple
+from typing import Any, Callable, Dict, List, Sequence, Tuple
 from uuid import uuid4
 
 from autogen_agentchat.agents import AssistantAgent
@@ -27,6 +28,7 @@ from autogen_core.tools import FunctionTool
 from dotenv import load_dotenv
 from pyexpat.errors import messages
 
+from agent_registry import AgentRegistry
 from model_client import create_model_client
 from model_context import ArchiveChatCompletionContext
 from prompts import (
@@ -35,17 +37,37 @@ from prompts import (
     NEXT_SPEAKER_INSTRUCTION,
     TERMINATE_INSTRUCTION,
 )
-from schema import AgentConfig, Message
-from storage import JsonFileStorage
+from schema import AgentConfig, ArchiveState, Message
+from storage import create_storage
+from storage_watcher import create_shared_cache
+from summary_cache import summary_cache
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
 SIMPLE_TASK_MODEL = "gpt-4.1-mini"
 REASONING_MODEL = "o4-mini"
+# fraction of the reasoning model's context window used for conversation history
+CONTEXT_TOKEN_BUDGET_RATIO = 0.25
+# whether agents stream the tokens of their replies as they are generated
+MODEL_CLIENT_STREAM = os.getenv("MODEL_CLIENT_STREAM", "true").lower() == "true"
+# how the static instructions of agents are laid out in their prompts: "prefix_stable"
+# compiles them into the system message, so every prompt of an agent starts with the
+# same prefix that the provider can cache, and "memory" adds them as a memory system
+# message on every call
+PROMPT_LAYOUT = os.getenv("PROMPT_LAYOUT", "prefix_stable")
 
 # Initialize storage for agent configurations
-agent_storage = JsonFileStorage("temp/agents")
+agent_storage = create_storage("agents")
+# the agent configurations shared by all sessions, which apply the changes since they loaded
+agent_config_cache = create_shared_cache(
+    agent_storage, "agent_id", "agent_config_cache"
+)
+agent_registry = AgentRegistry(agent_config_cache)
+# the agents a listing or search tool call returns at most
+AGENT_TOOL_MAX_PAGE_SIZE = 50
+# the characters of an agent description shown in listings
+AGENT_SUMMARY_DESCRIPTION_LENGTH = 120
 
 agent_manager_config = AgentConfig(
     agent_id="AgentManager",
@@ -56,22 +78,32 @@ agent_manager_config = AgentConfig(
 reserved_agents = [agent_manager_config]
 
 
-async def list_agent_configs() -> List[AgentConfig]:
-    """List all agents."""
-    configs = []
+def _parse_agent_config(data) -> AgentConfig | None:
+    if not data:
+        return None
+    try:
+        return AgentConfig.model_validate(data)
+    except Exception as e:
+        logger.error(f"Failed to parse agent config: {e}")
+    return None
 
-    # Get all agent data from storage
-    agents = await asyncio.to_thread(agent_storage.list)
-    for data in agents:
-        if not data:
-            continue
-        try:
-            config = AgentConfig.model_validate(data)
-            configs.append(config)
-        except Exception as e:
-            logger.error(f"Failed to parse agent config: {e}")
 
-    return configs
+async def snapshot_agent_configs() -> Tuple[int, List[AgentConfig]]:
+    """Get all agents from the shared cache, with the version to get the changes since."""
+    version, agents = await asyncio.to_thread(agent_config_cache.snapshot)
+    return version, [config for data in agents if (config := _parse_agent_config(data))]
+
+
+def get_agent_config_changes(
+    version: int,
+) -> Tuple[int, Dict[str, AgentConfig | None]] | None:
+    """Get the agents changed since a version of the shared cache, None for deleted
+    agents, or None if the snapshot must be reloaded."""
+    result = agent_config_cache.changes(version)
+    if result is None:
+        return None
+    version, changes = result
+    return version, {change.key: _parse_agent_config(change.data) for change in changes}
 
 
 async def get_agent_config(agent_id: str) -> AgentConfig | None:
@@ -90,9 +122,9 @@ async def get_agent_config(agent_id: str) -> AgentConfig | None:
 async def save_agent_config(agent_config: AgentConfig) -> None:
     """Save agent configuration."""
     try:
-        await asyncio.to_thread(
-            agent_storage.save, agent_config.agent_id, agent_config.model_dump()
-        )
+        data = agent_config.model_dump()
+        await asyncio.to_thread(agent_storage.save, agent_config.agent_id, data)
+        agent_config_cache.publish(agent_config.agent_id, data)
     except Exception as e:
         logger.error(f"Failed to save agent config {agent_config.agent_id}: {e}")
 
@@ -101,27 +133,35 @@ async def delete_agent_config(agent_id: str) -> None:
     """Delete agent configuration by ID."""
     try:
         await asyncio.to_thread(agent_storage.delete, agent_id)
+        agent_config_cache.publish(agent_id)
     except Exception as e:
         logger.error(f"Failed to delete agent config {agent_id}: {e}")
 
 
-def create_agent(
-    config: AgentConfig, initial_messages: List[Message] = []
-) -> ChatAgent:
-    if config.agent_id == agent_manager_config.agent_id:
-        return create_agent_manager()
-    return AssistantAgent(
-        name=config.name,
-        model_client=create_model_client(REASONING_MODEL),
-        model_context=ArchiveChatCompletionContext(
-            min_messages=20,
-            max_messages=50,
-            model_client=create_model_client(SIMPLE_TASK_MODEL),
-            initial_messages=[m.to_llm_message() for m in initial_messages],
-        ),
-        description=config.description,
-        system_message=config.system_prompt,
-        memory=[
+@functools.lru_cache(maxsize=1024)
+def compile_system_message(name: str, system_prompt: str) -> str:
+    """Compile the system prompt of an agent and the static instructions into one
+    system message, which must not change between calls to keep the prefix cacheable."""
+    parts = [
+        system_prompt,
+        IDENTITY_MEMORY.format(name=name),
+        NEXT_SPEAKER_INSTRUCTION,
+        TERMINATE_INSTRUCTION,
+    ]
+    return "\n\n".join(part.strip() for part in parts if part.strip())
+
+
+def create_prompt_args(config: AgentConfig) -> Dict[str, Any]:
+    """Get the system message and memory arguments of an agent for PROMPT_LAYOUT."""
+    if PROMPT_LAYOUT == "prefix_stable":
+        return {
+            "system_message": compile_system_message(config.name, config.system_prompt)
+        }
+    if PROMPT_LAYOUT != "memory":
+        raise ValueError(f"Unknown prompt layout: {PROMPT_LAYOUT}")
+    return {
+        "system_message": config.system_prompt,
+        "memory": [
             ListMemory(
                 name="memory",
                 memory_contents=[
@@ -140,20 +180,73 @@ def create_agent(
                 ],
             ),
         ],
+    }
+
+
+def create_agent(
+    config: AgentConfig,
+    initial_messages: List[Message] = [],
+    archive_state: ArchiveState | None = None,
+    on_archive: Callable[[ArchiveState], None] | None = None,
+) -> ChatAgent:
+    if config.agent_id == agent_manager_config.agent_id:
+        return create_agent_manager(archive_state, on_archive)
+    return AssistantAgent(
+        name=config.name,
+        model_client=create_model_client(REASONING_MODEL),
+        model_context=ArchiveChatCompletionContext(
+            min_messages=20,
+            max_messages=50,
+            model_client=create_model_client(SIMPLE_TASK_MODEL, cache=True),
+            initial_messages=[m.to_llm_message() for m in initial_messages],
+            archive_state=archive_state,
+            on_archive=on_archive,
+            archive_mode="background",
+            token_budget_ratio=CONTEXT_TOKEN_BUDGET_RATIO,
+            budget_model_client=create_model_client(REASONING_MODEL),
+            archive_strategy="hierarchical",
+            summary_cache=summary_cache,
+        ),
+        description=config.description,
+        model_client_stream=MODEL_CLIENT_STREAM,
+        **create_prompt_args(config),
     )
 
 
-def create_agent_manager() -> ChatAgent:
+def format_agent_summary(config: AgentConfig) -> str:
+    """Format an agent as a single line for listings."""
+    description = " ".join(config.description.split())
+    if len(description) > AGENT_SUMMARY_DESCRIPTION_LENGTH:
+        description = description[: AGENT_SUMMARY_DESCRIPTION_LENGTH - 3] + "..."
+    return f"- {config.name} (ID {config.agent_id}): {description}"
+
+
+def format_agent_page(
+    agents: List[AgentConfig], total: int, page: int, page_size: int
+) -> str:
+    """Format a page of agents as compact summaries with the pagination state."""
+    page_count = max((total + page_size - 1) // page_size, 1)
+    lines = [f"Page {page} of {page_count}, {total} agents in total."]
+    lines.extend(format_agent_summary(config) for config in agents)
+    if page < page_count:
+        lines.append(f"Call again with page={page + 1} for more.")
+    return "\n".join(lines)
+
+
+def create_agent_manager(
+    archive_state: ArchiveState | None = None,
+    on_archive: Callable[[ArchiveState], None] | None = None,
+) -> ChatAgent:
     """Create a team of agents that can create new agents."""
 
     # tools
     async def create_agent(agent_config: AgentConfig) -> str:
         """Create and save agent configuration from JSON string."""
         try:
-            existing_agent = await list_agent_configs()
-            while any(ac.agent_id == agent_config.agent_id for ac in existing_agent):
+            await agent_registry.refresh()
+            while agent_registry.get(agent_config.agent_id) is not None:
                 agent_config.agent_id = uuid4().hex
-            if any(ac.name == agent_config.name for ac in existing_agent) or any(
+            if agent_registry.get_by_name(agent_config.name) is not None or any(
                 ac.name == agent_config.name for ac in reserved_agents
             ):
                 return f"Error creating agent: Agent with name {agent_config.name} already exists."
@@ -165,10 +258,8 @@ def create_agent_manager() -> ChatAgent:
 
     async def get_agent_by_name(name: str) -> str:
         """Get agent configuration by name."""
-        agent_configs = await list_agent_configs()
-        agent_config = next(
-            (config for config in agent_configs if config.name == name), None
-        )
+        await agent_registry.refresh()
+        agent_config = agent_registry.get_by_name(name)
         if agent_config:
             return f"Successfully retrieved Agent:\n\n{agent_config.model_dump_json(indent=2)}"
         else:
@@ -176,56 +267,64 @@ def create_agent_manager() -> ChatAgent:
 
     async def get_agent_by_id(agent_id: str) -> str:
         """Get agent configuration by ID."""
-        agent_config = await get_agent_config(agent_id)
+        await agent_registry.refresh()
+        agent_config = agent_registry.get(agent_id)
         if agent_config:
             return f"Successfully retrieved Agent:\n\n{agent_config.model_dump_json(indent=2)}"
         else:
             return f"Error retrieving agent: No agent found with ID {agent_id}."
 
-    async def get_all_agent_info() -> str:
-        """Get all agent configurations."""
-        agent_configs = await list_agent_configs()
-        if not agent_configs:
+    async def list_agents(page: int = 1, page_size: int = 20) -> str:
+        """List agents sorted by name, a page at a time, as compact summaries."""
+        page, page_size = max(page, 1), min(max(page_size, 1), AGENT_TOOL_MAX_PAGE_SIZE)
+        await agent_registry.refresh()
+        total = agent_registry.count()
+        if total == 0:
             return "No agents found."
+        agents = agent_registry.list((page - 1) * page_size, page_size)
+        return format_agent_page(agents, total, page, page_size)
 
-        return "\n\n".join(
-            [config.model_dump_json(indent=2) for config in agent_configs]
-        )
+    async def search_agents(query: str, page: int = 1, page_size: int = 20) -> str:
+        """Search agents whose name or description contains all keywords of a query."""
+        page, page_size = max(page, 1), min(max(page_size, 1), AGENT_TOOL_MAX_PAGE_SIZE)
+        await agent_registry.refresh()
+        total, agents = agent_registry.search(query, (page - 1) * page_size, page_size)
+        if total == 0:
+            return f"No agents found matching {query}."
+        return format_agent_page(agents, total, page, page_size)
 
     return AssistantAgent(
         name=agent_manager_config.name,
-        model_client=create_model_client(REASONING_MODEL),
+        # tool decisions and reflections on the same inputs are reused across reruns
+        model_client=create_model_client(REASONING_MODEL, cache=True),
         tools=[
             FunctionTool(get_agent_by_id, "Get agent configuration by ID"),
             FunctionTool(get_agent_by_name, "Get agent configuration by name"),
-            FunctionTool(get_all_agent_info, "Get all agent's information"),
+            FunctionTool(
+                list_agents,
+                "List agents sorted by name as one-line summaries, a page at a time",
+            ),
+            FunctionTool(
+                search_agents,
+                "Search agents by keywords in their name or description, "
+                "as one-line summaries, a page at a time",
+            ),
             FunctionTool(create_agent, "Create agent configuration from JSON string"),
         ],
         model_context=ArchiveChatCompletionContext(
             min_messages=20,
             max_messages=50,
-            model_client=create_model_client(SIMPLE_TASK_MODEL),
+            model_client=create_model_client(SIMPLE_TASK_MODEL, cache=True),
+            archive_state=archive_state,
+            on_archive=on_archive,
+            archive_mode="background",
+            token_budget_ratio=CONTEXT_TOKEN_BUDGET_RATIO,
+            budget_model_client=create_model_client(REASONING_MODEL),
+            archive_strategy="hierarchical",
+            summary_cache=summary_cache,
         ),
         description=agent_manager_config.description,
-        system_message=agent_manager_config.system_prompt,
         reflect_on_tool_use=True,
-        memory=[
-            ListMemory(
-                name="memory",
-                memory_contents=[
-                    MemoryContent(
-                        content=IDENTITY_MEMORY.format(name=agent_manager_config.name),
-                        mime_type=MemoryMimeType.TEXT,
-                    ),
-                    MemoryContent(
-                        content=NEXT_SPEAKER_INSTRUCTION,
-                        mime_type=MemoryMimeType.TEXT,
-                    ),
-                    MemoryContent(
-                        content=TERMINATE_INSTRUCTION,
-                        mime_type=MemoryMimeType.TEXT,
-                    ),
-                ],
-            ),
-        ],
+        model_client_stream=MODEL_CLIENT_STREAM,
+        **create_prompt_args(agent_manager_config),
     )
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import threading
+from bisect import bisect_left, insort
+from typing import Dict, List, Tuple
+
+from schema import AgentConfig
+from storage_watcher import SharedStorageCache
+
+logger = logging.getLogger(__name__)
+
+
+class AgentRegistry:
+    """An in-memory registry of agent configurations indexed by ID and name, for
+    lookups, pagination and keyword search without loading every agent file.
+
+    The registry applies the changes of the shared agent config cache incrementally
+    before every read, so agents saved or deleted by this or another process are seen
+    without rescanning the storage. Async callers await refresh first, so loading the
+    snapshot from the storage doesn't block the event loop.
+
+    Args:
+        cache (SharedStorageCache): The shared cache of the agent configurations.
+    """
+
+    def __init__(self, cache: SharedStorageCache) -> None:
+        self._cache = cache
+        self._version: int | None = None
+        self._agents: Dict[str, AgentConfig] = {}
+        self._names: Dict[str, str] = {}
+        # (lowercase name, ID) of all agents, sorted for pagination
+        self._sorted: List[Tuple[str, str]] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parse(data) -> AgentConfig | None:
+        try:
+            return AgentConfig.model_validate(data)
+        except Exception as e:
+            logger.error(f"Failed to parse agent config: {e}")
+            return None
+
+    def _put(self, agent: AgentConfig) -> None:
+        self._remove(agent.agent_id)
+        self._agents[agent.agent_id] = agent
+        self._names[agent.name] = agent.agent_id
+        insort(self._sorted, (agent.name.lower(), agent.agent_id))
+
+    def _remove(self, agent_id: str) -> None:
+        agent = self._agents.pop(agent_id, None)
+        if agent is None:
+            return
+        if self._names.get(agent.name) == agent_id:
+            del self._names[agent.name]
+        del self._sorted[bisect_left(self._sorted, (agent.name.lower(), agent_id))]
+
+    def _refresh(self) -> None:
+        """Apply the changes of the shared cache since the last read."""
+        with self._lock:
+            changes = (
+                self._cache.changes(self._version)
+                if self._version is not None
+                else None
+            )
+            if changes is None:
+                version, records = self._cache.snapshot()
+                self._agents, self._names, self._sorted = {}, {}, []
+                for data in records:
+                    if agent := self._parse(data):
+                        self._put(agent)
+                self._version = version
+                return
+            self._version, changed = changes
+            for change in changed:
+                self._remove(change.key)
+                if change.data is not None and (agent := self._parse(change.data)):
+                    self._put(agent)
+
+    async def refresh(self) -> None:
+        """Apply the changes of the shared cache in a worker thread, loading its
+        snapshot if needed."""
+        await asyncio.to_thread(self._refresh)
+
+    def get(self, agent_id: str) -> AgentConfig | None:
+        self._refresh()
+        return self._agents.get(agent_id)
+
+    def get_by_name(self, name: str) -> AgentConfig | None:
+        self._refresh()
+        agent_id = self._names.get(name)
+        return self._agents.get(agent_id) if agent_id else None
+
+    def count(self) -> int:
+        self._refresh()
+        return len(self._agents)
+
+    def list(self, offset: int = 0, limit: int | None = None) -> List[AgentConfig]:
+        """List agents sorted by name."""
+        self._refresh()
+        end = None if limit is None else offset + limit
+        return [self._agents[agent_id] for _, agent_id in self._sorted[offset:end]]
+
+    def search(
+        self, query: str, offset: int = 0, limit: int | None = None
+    ) -> Tuple[int, List[AgentConfig]]:
+        """Find the agents whose name or description contains all keywords of a query,
+        those matching by name first. Returns the total number of matches and a page."""
+        self._refresh()
+        keywords = query.lower().split()
+        name_matches, description_matches = [], []
+        for name, agent_id in self._sorted:
+            agent = self._agents[agent_id]
+            description = agent.description.lower()
+            if all(keyword in name for keyword in keywords):
+                name_matches.append(agent)
+            elif all(keyword in name or keyword in description for keyword in keywords):
+                description_matches.append(agent)
+        matches = name_matches + description_matches
+        end = None if limit is None else offset + limit
+        return len(matches), matches[offset:end]
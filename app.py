@@ -1,4 +1,6 @@
 import asyncio
+import os
+import time
 from typing import List
 
 import streamlit as st
@@ -6,18 +8,23 @@ import streamlit as st
 from agent import (
     agent_manager_config,
     delete_agent_config,
-    list_agent_configs,
+    get_agent_config_changes,
     reserved_agents,
+    snapshot_agent_configs,
 )
 from chat import (
+    chat_instance_pool,
     delete_conversation,
     fork_conversation,
+    get_conversation_changes,
+    get_conversation_header,
     get_responses,
-    list_conversations,
     resume_conversation,
+    snapshot_conversations,
     start_conversation,
 )
-from schema import AgentConfig, Conversation
+from conversation_index import ConversationIndex
+from schema import AgentConfig, Conversation, ConversationHeader, MessageChunk
 
 # 设置页面配置
 st.set_page_config(
@@ -28,6 +35,14 @@ st.set_page_config(
 )
 
 
+# 聊天窗口一次显示的消息数, 更早的消息通过 "加载更早的消息" 分页显示
+CHAT_WINDOW_SIZE = int(os.getenv("CHAT_WINDOW_SIZE", "50"))
+# 侧边栏每个agent的聊天历史每页显示的会话数
+SIDEBAR_HISTORY_PAGE_SIZE = int(os.getenv("SIDEBAR_HISTORY_PAGE_SIZE", "10"))
+# 流式输出时刷新正在生成的消息的最小间隔 (秒)
+STREAMING_REFRESH_INTERVAL = 0.05
+
+
 # 格式化会话显示时间
 def format_conversation_time(iso_time: str) -> str:
     """格式化ISO时间为可读格式"""
@@ -40,46 +55,59 @@ def format_conversation_time(iso_time: str) -> str:
         return "Unknown"
 
 
-# 获取会话的简短描述
-def get_conversation_summary(conversation: Conversation) -> str:
-    """获取会话的简短描述"""
-    if not conversation.messages:
-        return "Empty conversation"
-
-    # 获取最后一条消息作为摘要
-    content = conversation.messages[-1].content.strip()
-    # 处理中英文混合情况下的摘要显示
-    display_length = 0
-    summary_limit = 12  # 设置显示字符的总宽度限制
-    result = ""
-
-    for i, char in enumerate(content):
-        # 中文字符通常占用2个字符宽度
-        char_width = 2.4 if ord(char) > 127 else 1
-        display_length += char_width
-
-        if display_length > summary_limit:
-            result = content[:i] + "..."
-            break
-    else:  # 如果内容较短，不需要截断
-        result = content
-
-    return result
-
-
 # 加载agent配置
 async def load_agents(clear_cache: bool = False) -> List[AgentConfig]:
-    """加载所有agent配置到session_state"""
-    if "agents" not in st.session_state or clear_cache:
-        st.session_state["agents"] = await list_agent_configs()
+    """加载所有agent配置到session_state, 之后每次rerun只应用共享缓存中的增量变更
+    (AgentManager创建的agent, 其他会话或进程的修改)"""
+    changes = None
+    if "agents" in st.session_state and not clear_cache:
+        changes = get_agent_config_changes(st.session_state.agents_version)
+    if changes is None:
+        (
+            st.session_state["agents_version"],
+            st.session_state["agents"],
+        ) = await snapshot_agent_configs()
+        return st.session_state["agents"]
+
+    st.session_state["agents_version"], changed_agents = changes
+    if changed_agents:
+        # 按ID更新, 已有的agent保持原来的顺序
+        agents = {agent.agent_id: agent for agent in st.session_state["agents"]}
+        for agent_id, agent in changed_agents.items():
+            if agent is None:
+                agents.pop(agent_id, None)
+            else:
+                agents[agent_id] = agent
+        st.session_state["agents"] = list(agents.values())
     return st.session_state["agents"]
 
 
-async def load_conversations(clear_cache: bool = False) -> List[Conversation]:
-    """加载所有会话到session_state"""
-    if "conversations" not in st.session_state or clear_cache:
-        st.session_state["conversations"] = await list_conversations()
-    return st.session_state["conversations"]
+async def load_conversations(clear_cache: bool = False) -> ConversationIndex:
+    """加载所有会话的索引信息到session_state, 按agent索引; 之后每次rerun只应用共享缓存
+    中的增量变更"""
+    changes = None
+    if "conversation_index" in st.session_state and not clear_cache:
+        changes = get_conversation_changes(st.session_state.conversations_version)
+    if changes is None:
+        version, headers = await snapshot_conversations()
+        st.session_state["conversations_version"] = version
+        st.session_state["conversation_index"] = ConversationIndex(headers)
+        return st.session_state["conversation_index"]
+
+    st.session_state["conversations_version"], changed_conversations = changes
+    conversation_index: ConversationIndex = st.session_state["conversation_index"]
+    for conversation_id, header in changed_conversations.items():
+        if header is None:
+            conversation_index.remove(conversation_id)
+        else:
+            conversation_index.put(header)
+    return st.session_state["conversation_index"]
+
+
+def update_conversation_index(conversation: Conversation):
+    """会话创建或同步后增量更新会话索引 (没有消息的会话不会保存, 也不显示)"""
+    if conversation.messages and "conversation_index" in st.session_state:
+        st.session_state.conversation_index.put(get_conversation_header(conversation))
 
 
 async def open_conversation(
@@ -93,20 +121,16 @@ async def open_conversation(
     )
 
 
-async def delete_conversation_and_update_list(conversation: Conversation):
+async def delete_conversation_and_update_list(conversation: ConversationHeader):
     """删除指定的会话并更新session_state"""
     await delete_conversation(conversation)
-    # 从session_state中移除该会话
-    st.session_state.conversations = [
-        conv
-        for conv in st.session_state.conversations
-        if conv.conversation_id != conversation.conversation_id
-    ]
+    # 从会话索引中移除该会话
+    st.session_state.conversation_index.remove(conversation.conversation_id)
 
 
 async def render_sidebar_agent_conversation(
     agent: AgentConfig,
-    conversation: Conversation,
+    conversation: ConversationHeader,
 ):
     """渲染侧边栏中的agent聊天历史中的对话信息"""
     col1, col2 = st.columns([3, 1])
@@ -119,7 +143,7 @@ async def render_sidebar_agent_conversation(
             == st.session_state.current_conversation.conversation_id
         )
         if st.button(
-            get_conversation_summary(conversation),
+            conversation.summary,
             key=f"conversation_{agent.agent_id}_{conversation.conversation_id}",
             help=f"Updated: {format_conversation_time(conversation.updated_at)}",
             type="primary" if is_current_conversation else "secondary",
@@ -130,7 +154,6 @@ async def render_sidebar_agent_conversation(
                 st.session_state.current_conversation = await resume_conversation(
                     conversation.conversation_id
                 )
-                st.session_state.need_insert_conversation_messages = True
                 st.rerun()
 
     # 显示删除按钮
@@ -170,11 +193,9 @@ async def render_sidebar_agent(
             help="Delete this agent and all its conversations",
         ):
             # 删除该agent的所有会话
-            agent_conversations = [
-                conversation
-                for conversation in st.session_state.get("conversations", [])
-                if any(agent.agent_id == ca.agent_id for ca in conversation.agents)
-            ]
+            agent_conversations = st.session_state.conversation_index.list(
+                agent.agent_id
+            )
             for conversation in agent_conversations:
                 await delete_conversation_and_update_list(conversation)
 
@@ -198,21 +219,43 @@ async def render_sidebar_agent(
             st.rerun()
 
         # 显示该agent的聊天历史
+        await render_sidebar_agent_history(agent)
+
+
+async def render_sidebar_agent_history(agent: AgentConfig):
+    """渲染侧边栏中agent的聊天历史: 展开后才渲染, 并分页显示"""
+    conversation_index: ConversationIndex = st.session_state.conversation_index
+    conversation_count = conversation_index.count(agent.agent_id)
+    if conversation_count == 0:
         st.text("Chat History")
+        st.caption("No chat history yet")
+        return
 
-        conversations = [
-            conversation
-            for conversation in st.session_state.get("conversations", [])
-            if any(agent.agent_id == ca.agent_id for ca in conversation.agents)
-        ]
-        if len(conversations) == 0:
-            st.caption("No chat history yet")
-            return
-
-        for conversation in sorted(
-            conversations, key=lambda x: x.updated_at, reverse=True
-        ):
-            await render_sidebar_agent_conversation(agent, conversation)
+    # 每个agent已显示的聊天历史条数, 未展开的agent不渲染聊天历史
+    history_sizes = st.session_state.setdefault("history_sizes", {})
+    history_size = history_sizes.get(agent.agent_id, 0)
+    if st.button(
+        f"{':arrow_down_small:' if history_size else ':arrow_forward:'} "
+        f"Chat History ({conversation_count})",
+        key=f"toggle_history_{agent.agent_id}",
+        type="tertiary",
+    ):
+        history_sizes[agent.agent_id] = 0 if history_size else SIDEBAR_HISTORY_PAGE_SIZE
+        st.rerun()
+    if not history_size:
+        return
+
+    for conversation in conversation_index.list(agent.agent_id, limit=history_size):
+        await render_sidebar_agent_conversation(agent, conversation)
+
+    # 加载下一页
+    if history_size < conversation_count and st.button(
+        f"Show more ({conversation_count - history_size} more)",
+        key=f"more_history_{agent.agent_id}",
+        use_container_width=True,
+    ):
+        history_sizes[agent.agent_id] = history_size + SIDEBAR_HISTORY_PAGE_SIZE
+        st.rerun()
 
 
 async def render_sidebar():
@@ -281,7 +324,7 @@ async def render_add_agent_dropdown():
                 st.session_state.current_conversation,
                 st.session_state.current_agents,
             )
-            st.session_state.need_insert_conversation_messages = True
+            update_conversation_index(st.session_state.current_conversation)
             # 重置下拉菜单状态
             if "add_agent_dropdown" in st.session_state:
                 del st.session_state.add_agent_dropdown
@@ -308,14 +351,51 @@ async def render_header():
         await render_add_agent_dropdown()
 
 
+def format_chat_message(source: str, content: str) -> str:
+    """将消息格式化为一段markdown"""
+    return f"##### {source}\n\n{content}"
+
+
+def get_chat_window_size(conversation_id: str) -> int:
+    """获取当前会话聊天窗口显示的消息数, 切换会话时重置"""
+    window = st.session_state.get("chat_window")
+    if window is None or window[0] != conversation_id:
+        window = st.session_state.chat_window = (conversation_id, CHAT_WINDOW_SIZE)
+    return window[1]
+
+
 async def render_chat_message(
     role: str,
     source: str,
     content: str,
 ):
     with st.chat_message(role):
-        st.write(f"##### {source}")
-        st.write(content)
+        st.markdown(format_chat_message(source, content))
+
+
+async def render_chat_history():
+    """只渲染当前会话最近的消息, rerun的耗时与会话长度无关"""
+    conversation = st.session_state.current_conversation
+    messages = conversation.messages
+    window_size = get_chat_window_size(conversation.conversation_id)
+    start = max(len(messages) - window_size, 0)
+
+    # 加载更早的消息
+    if start > 0 and st.button(
+        f":arrow_up: Load earlier messages ({start} more)",
+        key="load_earlier_messages",
+        use_container_width=True,
+    ):
+        st.session_state.chat_window = (
+            conversation.conversation_id,
+            window_size + CHAT_WINDOW_SIZE,
+        )
+        st.rerun()
+
+    for message in messages[start:]:
+        await render_chat_message(
+            role=message.role, source=message.source, content=message.content
+        )
 
 
 async def render_chat_window():
@@ -324,10 +404,7 @@ async def render_chat_window():
         return
 
     # 显示聊天历史
-    for message in st.session_state.current_conversation.messages:
-        await render_chat_message(
-            role=message.role, source=message.source, content=message.content
-        )
+    await render_chat_history()
 
     # 聊天输入
     if prompt := st.chat_input(
@@ -338,26 +415,62 @@ async def render_chat_window():
             # 显示用户消息
             await render_chat_message(role="user", source="user", content=prompt)
 
-        # 发送消息并获取响应
-        async for message in get_responses(
-            conversation=st.session_state.current_conversation,
-            user_input=prompt,
-            cancellation_token=st.session_state.current_conversation.cancellation_token,
-            need_insert_conversation_messages=st.session_state.get(
-                "need_insert_conversation_messages", False
-            ),
-        ):
-            st.session_state.need_insert_conversation_messages = False
-            await render_chat_message(
-                role="assistant", source=message.source, content=message.content
-            )
+        # 发送消息并获取响应, 正在生成的消息随流式输出逐步显示
+        placeholder, streaming_source, streaming_content = None, None, ""
+        refreshed_at = 0.0
+        try:
+            async for message in get_responses(
+                conversation=st.session_state.current_conversation,
+                user_input=prompt,
+                cancellation_token=st.session_state.current_conversation.cancellation_token,
+                stream=True,
+            ):
+                if isinstance(message, MessageChunk):
+                    if placeholder is None or message.source != streaming_source:
+                        # 未完成的消息不保留在页面上
+                        if placeholder is not None:
+                            placeholder.empty()
+                        placeholder, streaming_source, streaming_content = (
+                            st.empty(),
+                            message.source,
+                            "",
+                        )
+                    streaming_content += message.content
+                    if time.monotonic() - refreshed_at >= STREAMING_REFRESH_INTERVAL:
+                        refreshed_at = time.monotonic()
+                        with placeholder.container():
+                            await render_chat_message(
+                                role="assistant",
+                                source=streaming_source,
+                                content=streaming_content,
+                            )
+                    continue
+
+                # 完整的消息替换正在生成的内容
+                if placeholder is not None and message.source == streaming_source:
+                    with placeholder.container():
+                        await render_chat_message(
+                            role="assistant",
+                            source=message.source,
+                            content=message.content,
+                        )
+                    placeholder, streaming_source = None, None
+                else:
+                    await render_chat_message(
+                        role="assistant", source=message.source, content=message.content
+                    )
+        finally:
+            # 中断或出错时清除未完成的消息
+            if placeholder is not None:
+                placeholder.empty()
+        update_conversation_index(st.session_state.current_conversation)
         print("conversation pause")
 
 
 async def main():
     # 加载agent配置和所有会话
     await load_agents()
-    await load_conversations()  # 确保conversations加载到session_state
+    await load_conversations()  # 确保会话索引加载到session_state
 
     # 渲染侧边栏
     await render_sidebar()
@@ -368,6 +481,9 @@ async def main():
     # 渲染聊天窗口
     await render_chat_window()
 
+    # 等待被淘汰的聊天实例写完, 事件循环关闭时未完成的任务会被取消
+    await chat_instance_pool.join()
+
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,343 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+from uuid import uuid4
+
+# run offline: local mock model and in-memory conversation storage
+os.environ.setdefault("MODEL_CLIENT", "mock")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from autogen_core.models import AssistantMessage, LLMMessage, UserMessage
+
+from chat import get_responses, start_conversation
+from mock_client import MockChatCompletionClient
+from model_context import ArchiveChatCompletionContext
+from schema import AgentConfig, Conversation, Message
+from storage import JournalFileStorage, RedisStorage, Storage, redis
+
+SUITES = ["storage", "context", "schema", "chat"]
+STORAGE_BACKENDS = ["file", "redis"] if redis is not None else ["file"]
+
+
+def summarize_samples(samples: List[float], unit: str) -> Dict[str, float]:
+    """Summarize timing samples as mean and percentiles in the given unit suffix."""
+    samples = sorted(samples)
+    return {
+        f"mean_{unit}": statistics.fmean(samples),
+        f"p50_{unit}": samples[len(samples) // 2],
+        f"p95_{unit}": samples[int(len(samples) * 0.95)],
+        f"max_{unit}": samples[-1],
+    }
+
+
+def time_calls(func: Callable[[], Any], iterations: int) -> List[float]:
+    """Time repeated calls of a function in milliseconds."""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def create_history(size: int) -> List[LLMMessage]:
+    """Create a tool-free conversation history of alternating user and assistant messages."""
+    return [
+        (
+            UserMessage(content=f"Question {i}", source="user")
+            if i % 2 == 0
+            else AssistantMessage(content=f"Answer {i}", source="assistant")
+        )
+        for i in range(size)
+    ]
+
+
+def create_conversation(message_count: int) -> Conversation:
+    """Create a conversation with alternating user and assistant messages."""
+    return Conversation(
+        agents=[AgentConfig(name="assistant")],
+        messages=[
+            (
+                Message(role="user", source="user", content=f"Question {i} " * 20)
+                if i % 2 == 0
+                else Message(
+                    role="assistant", source="assistant", content=f"Answer {i} " * 40
+                )
+            )
+            for i in range(message_count)
+        ],
+    )
+
+
+def benchmark_storage(
+    backend: str, storage: Storage, conversation_count: int, samples: int
+) -> Dict[str, Any]:
+    """Measure save, load, list and appending a message with conversation_count conversations."""
+    conversation = create_conversation(20)
+    data = conversation.model_dump()
+    keys = [f"conversation-{i}" for i in range(conversation_count)]
+    save_samples = []
+    start = time.perf_counter()
+    for key in keys:
+        save_start = time.perf_counter()
+        storage.save(key, data)
+        save_samples.append((time.perf_counter() - save_start) * 1000)
+    save_s = time.perf_counter() - start
+    sampled_keys = random.Random(0).choices(keys, k=samples)
+    load_keys = iter(sampled_keys)
+    load_samples = time_calls(lambda: storage.load(next(load_keys)), samples)
+    # appending a message and updating the header, as a conversation write does
+    header = conversation.model_dump(exclude={"messages"})
+    message = conversation.messages[-1].model_dump()
+    append_keys = iter(sampled_keys)
+    append_samples = time_calls(
+        lambda: storage.append(next(append_keys), header, "messages", [message], 20),
+        samples,
+    )
+    start = time.perf_counter()
+    listed = storage.list("")
+    list_ms = (time.perf_counter() - start) * 1000
+    assert len(listed) == conversation_count
+    return {
+        "benchmark": f"storage.{backend}",
+        "conversations": conversation_count,
+        "save": summarize_samples(save_samples, "ms"),
+        "saves_per_second": conversation_count / save_s,
+        "load": summarize_samples(load_samples, "ms"),
+        "append": summarize_samples(append_samples, "ms"),
+        "list_ms": list_ms,
+    }
+
+
+def run_storage_benchmarks(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Run the storage benchmark on every backend and size, each in a fresh storage."""
+    results = []
+    redis_client = None
+    if "redis" in args.storage_backends:
+        from mock_redis import MockRedisServer
+
+        redis_url = (
+            args.redis_url
+            or MockRedisServer(args.redis_latency_ms / 1000).start_in_thread()
+        )
+        redis_client = redis.Redis.from_url(redis_url)
+    for backend in args.storage_backends:
+        for conversation_count in args.storage_sizes:
+            with tempfile.TemporaryDirectory() as directory:
+                storage: Storage = (
+                    JournalFileStorage(directory)
+                    if backend == "file"
+                    else RedisStorage(
+                        redis_client, f"benchmark-{uuid4().hex}", "cyberalchemy:"
+                    )
+                )
+                results.append(
+                    benchmark_storage(
+                        backend, storage, conversation_count, args.iterations
+                    )
+                )
+    return results
+
+
+async def benchmark_get_messages(history_size: int, iterations: int) -> Dict[str, Any]:
+    """Measure get_messages after each new message once the history has grown to history_size."""
+    context = ArchiveChatCompletionContext(
+        min_messages=20,
+        max_messages=50,
+        model_client=MockChatCompletionClient(),
+        initial_messages=create_history(history_size),
+    )
+    # archive the initial history before measuring
+    await context.get_messages()
+
+    samples = []
+    for i in range(iterations):
+        await context.add_message(
+            UserMessage(content=f"Question {history_size + i}", source="user")
+        )
+        start = time.perf_counter()
+        await context.get_messages()
+        samples.append((time.perf_counter() - start) * 1_000_000)
+
+    return {
+        "benchmark": "context.get_messages",
+        "history_size": history_size,
+        "iterations": iterations,
+        **summarize_samples(samples, "us"),
+    }
+
+
+async def benchmark_archive_backlog(
+    history_size: int, strategy: str, latency: float
+) -> Dict[str, Any]:
+    """Measure bringing a long imported history under the limits with an archive strategy."""
+    model_client = MockChatCompletionClient(latency=latency)
+    context = ArchiveChatCompletionContext(
+        min_messages=20,
+        max_messages=50,
+        model_client=model_client,
+        initial_messages=create_history(history_size),
+        archive_strategy=strategy,  # type: ignore[arg-type]
+    )
+    start = time.perf_counter()
+    messages = await context.get_messages()
+    return {
+        "benchmark": "context.archive_backlog",
+        "history_size": history_size,
+        "strategy": strategy,
+        "request_latency_s": latency,
+        "requests": model_client.requests,
+        "messages_after": len(messages),
+        "wall_s": time.perf_counter() - start,
+    }
+
+
+def benchmark_schema(message_count: int, iterations: int) -> Dict[str, Any]:
+    """Measure Conversation.model_validate and model_dump with message_count messages."""
+    conversation = create_conversation(message_count)
+    data = conversation.model_dump()
+    return {
+        "benchmark": "schema.conversation",
+        "messages": message_count,
+        "model_validate": summarize_samples(
+            time_calls(lambda: Conversation.model_validate(data), iterations), "ms"
+        ),
+        "model_dump": summarize_samples(
+            time_calls(conversation.model_dump, iterations), "ms"
+        ),
+    }
+
+
+async def benchmark_get_responses(turns: int) -> Dict[str, Any]:
+    """Measure the overhead of get_responses per message with an instant mock model."""
+    conversation = await start_conversation([AgentConfig(name="assistant")])
+    samples = []
+    for i in range(turns):
+        start = time.perf_counter()
+        responses = [
+            response async for response in get_responses(conversation, f"Question {i}")
+        ]
+        # the user message and the responses
+        samples.append((time.perf_counter() - start) * 1000 / (len(responses) + 1))
+    return {
+        "benchmark": "chat.get_responses",
+        "turns": turns,
+        "messages": len(conversation.messages),
+        **summarize_samples(samples, "ms_per_message"),
+    }
+
+
+async def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    if "storage" in args.suites:
+        results.extend(run_storage_benchmarks(args))
+    if "context" in args.suites:
+        for history_size in args.history_sizes:
+            results.append(await benchmark_get_messages(history_size, args.iterations))
+        for strategy in ["sequential", "hierarchical"]:
+            results.append(
+                await benchmark_archive_backlog(
+                    args.backlog_size, strategy, args.latency
+                )
+            )
+    if "schema" in args.suites:
+        for message_count in args.schema_sizes:
+            results.append(benchmark_schema(message_count, args.schema_iterations))
+    if "chat" in args.suites:
+        results.append(await benchmark_get_responses(args.turns))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CyberAlchemy microbenchmarks")
+    parser.add_argument(
+        "--suites",
+        nargs="+",
+        choices=SUITES,
+        default=SUITES,
+        help="Benchmark suites to run",
+    )
+    parser.add_argument(
+        "--iterations",
+        type=int,
+        default=1_000,
+        help="Measured calls per get_messages history size and storage loads",
+    )
+    parser.add_argument(
+        "--storage-sizes",
+        type=int,
+        nargs="+",
+        default=[10, 1_000, 50_000],
+        help="Numbers of conversations to measure the storage with",
+    )
+    parser.add_argument(
+        "--storage-backends",
+        nargs="+",
+        choices=STORAGE_BACKENDS,
+        default=STORAGE_BACKENDS,
+        help="Storage backends to measure",
+    )
+    parser.add_argument(
+        "--redis-url",
+        help="Redis server to measure, defaults to a local mock Redis server",
+    )
+    parser.add_argument(
+        "--redis-latency-ms",
+        type=float,
+        default=0,
+        help="Round trip latency added by the local mock Redis server",
+    )
+    parser.add_argument(
+        "--history-sizes",
+        type=int,
+        nargs="+",
+        default=[1_000, 10_000, 100_000],
+        help="History sizes to measure get_messages at",
+    )
+    parser.add_argument(
+        "--backlog-size",
+        type=int,
+        default=5_000,
+        help="History size imported at once to measure the archive strategies",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.05,
+        help="Seconds each simulated summarization request takes",
+    )
+    parser.add_argument(
+        "--schema-sizes",
+        type=int,
+        nargs="+",
+        default=[100, 1_000, 10_000],
+        help="Conversation sizes to measure validation and serialization at",
+    )
+    parser.add_argument(
+        "--schema-iterations",
+        type=int,
+        default=20,
+        help="Measured calls per conversation size",
+    )
+    parser.add_argument(
+        "--turns", type=int, default=50, help="Conversation turns to measure"
+    )
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
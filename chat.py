@@ -1,26 +1,63 @@
 import asyncio
 import logging
+import os
+import threading
+import time
 from collections.abc import AsyncGenerator, Sequence
-from typing import List
+from functools import partial
+from typing import Callable, Dict, List, Tuple
 
 from autogen_agentchat.base import ChatAgent, Team
 from autogen_agentchat.conditions import FunctionalTermination, TextMentionTermination
 from autogen_agentchat.messages import (
     BaseAgentEvent,
     BaseChatMessage,
+    ModelClientStreamingChunkEvent,
     TextMessage,
     ToolCallSummaryMessage,
 )
 from autogen_agentchat.teams import MagenticOneGroupChat, SelectorGroupChat
 from autogen_core import CancellationToken
+from autogen_core.model_context import BufferedChatCompletionContext
 
+import metrics
 from agent import SIMPLE_TASK_MODEL, create_agent, create_model_client
-from schema import AgentConfig, Conversation, Message
-from storage import JsonFileStorage
+from instance_pool import ChatInstancePool
+from persistence import WriteBehindQueue
+from selector import MentionSelector
+from schema import (
+    AgentConfig,
+    ArchiveState,
+    Conversation,
+    ConversationHeader,
+    Message,
+    MessageChunk,
+)
+from storage import create_storage
+from storage_watcher import create_shared_cache
 
 logger = logging.getLogger(__name__)
 
-conversation_storage = JsonFileStorage(f"temp/conversations")
+conversation_storage = create_storage("conversations", kind="journal")
+conversation_index_storage = create_storage("conversation_index", kind="index")
+# the number of forks sharing the messages of a conversation, and whether it was deleted
+conversation_ref_storage = create_storage("conversation_refs", kind="index")
+# the storage migrations that have completed, by name
+migration_storage = create_storage("migrations", kind="index")
+_conversation_refs_lock = threading.Lock()
+# the conversation headers shared by all sessions, which apply the changes since they loaded
+conversation_header_cache = create_shared_cache(
+    conversation_index_storage,
+    "conversation_id",
+    "conversation_header_cache",
+    load=lambda: _list_conversation_index(),
+)
+
+# "mention" selects the @mentioned next speaker without a model call when possible,
+# "model" always asks the selector model
+SPEAKER_SELECTION = os.getenv("SPEAKER_SELECTION", "mention")
+# the number of recent messages the selector model sees in the "mention" mode
+SELECTOR_HISTORY_SIZE = int(os.getenv("SELECTOR_HISTORY_SIZE", "10"))
 
 
 def terminate_expression(messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> bool:
@@ -32,38 +69,112 @@ def terminate_expression(messages: Sequence[BaseAgentEvent | BaseChatMessage]) -
     return last_chat_message is not None and "TERMINATE" in last_chat_message.to_text()
 
 
+def get_conversation_summary(conversation: Conversation) -> str:
+    """获取会话的简短描述"""
+    if not conversation.messages:
+        return "Empty conversation"
+
+    # 获取最后一条消息作为摘要
+    content = conversation.messages[-1].content.strip()
+    # 处理中英文混合情况下的摘要显示
+    display_length = 0
+    summary_limit = 12  # 设置显示字符的总宽度限制
+    result = ""
+
+    for i, char in enumerate(content):
+        # 中文字符通常占用2个字符宽度
+        char_width = 2.4 if ord(char) > 127 else 1
+        display_length += char_width
+
+        if display_length > summary_limit:
+            result = content[:i] + "..."
+            break
+    else:  # 如果内容较短，不需要截断
+        result = content
+
+    return result
+
+
+def get_conversation_header(conversation: Conversation) -> ConversationHeader:
+    """Get the header of a conversation used for listing."""
+    return ConversationHeader(
+        conversation_id=conversation.conversation_id,
+        created_at=conversation.created_at,
+        updated_at=conversation.updated_at,
+        agent_ids=[agent.agent_id for agent in conversation.agents],
+        summary=get_conversation_summary(conversation),
+    )
+
+
 def create_chat_instance(
-    configs: List[AgentConfig], initial_messages: List[Message] = []
+    configs: List[AgentConfig],
+    initial_messages: List[Message] = [],
+    archive_states: Dict[str, ArchiveState] = {},
+    on_archive: Callable[[str, ArchiveState], None] | None = None,
 ) -> ChatAgent | Team:
     """Create a team of agents from configurations."""
+    agents = [
+        create_agent(
+            config,
+            initial_messages,
+            archive_state=archive_states.get(config.agent_id),
+            on_archive=partial(on_archive, config.agent_id) if on_archive else None,
+        )
+        for config in configs
+    ]
     if len(configs) == 1:
-        return create_agent(configs[0], initial_messages)
+        return agents[0]
+    elif SPEAKER_SELECTION == "mention":
+        selector = MentionSelector([agent.name for agent in agents])
+        return SelectorGroupChat(
+            participants=agents,
+            model_client=create_model_client(SIMPLE_TASK_MODEL, cache=True),
+            max_turns=10,
+            termination_condition=FunctionalTermination(func=terminate_expression),
+            selector_func=selector.select,
+            candidate_func=selector.candidates,
+            model_context=BufferedChatCompletionContext(
+                buffer_size=SELECTOR_HISTORY_SIZE
+            ),
+        )
     else:
         return SelectorGroupChat(
-            participants=[create_agent(config, initial_messages) for config in configs],
-            model_client=create_model_client(SIMPLE_TASK_MODEL),
+            participants=agents,
+            model_client=create_model_client(SIMPLE_TASK_MODEL, cache=True),
             max_turns=10,
             termination_condition=FunctionalTermination(func=terminate_expression),
         )
 
 
+chat_instance_pool = ChatInstancePool(
+    lambda conversation, on_archive: create_chat_instance(
+        conversation.agents,
+        archive_states=conversation.archive_states,
+        on_archive=on_archive,
+    ),
+    storage=create_storage("chat_instances"),
+    max_instances=int(os.getenv("CHAT_INSTANCE_POOL_SIZE", "16")),
+    max_bytes=int(os.getenv("CHAT_INSTANCE_POOL_MAX_MB", "256")) * 1024 * 1024,
+)
+
+
 async def start_conversation(agents: List[AgentConfig]) -> Conversation:
     """Start a conversation with the agent."""
     conversation = Conversation(agents=agents)
-    conversation.chat_instance = create_chat_instance(agents)
+    chat_instance_pool.create(conversation)
     conversation.cancellation_token = CancellationToken()
     return conversation
 
 
 async def resume_conversation(conversation_id: str) -> Conversation:
     """Resume a conversation by its ID."""
-    if not await asyncio.to_thread(conversation_storage.exists, conversation_id):
+    await conversation_writer.flush(conversation_id)
+    conversation = await asyncio.to_thread(load_conversation, conversation_id)
+    if conversation is None:
         raise ValueError(f"Conversation with ID {conversation_id} does not exist.")
-
-    conversation = Conversation.model_validate(
-        conversation_storage.load(conversation_id)
-    )
-    conversation.chat_instance = create_chat_instance(conversation.agents)
+    conversation.synced_message_count = len(conversation.messages)
+    # a pooled chat instance has already seen the history
+    conversation.history_synced = await chat_instance_pool.acquire(conversation)
     conversation.cancellation_token = CancellationToken()
     return conversation
 
@@ -71,54 +182,244 @@ async def resume_conversation(conversation_id: str) -> Conversation:
 async def fork_conversation(
     conversation: Conversation, new_agents: List[AgentConfig]
 ) -> Conversation:
-    """Fork a conversation with new agents."""
+    """Fork a conversation with new agents.
+
+    The fork is stored as a pointer to the messages of the conversation it was forked
+    from, and only its own messages are written.
+    """
     new_conversation = Conversation(
         agents=new_agents,
         messages=conversation.messages.copy(),
+        archive_states=conversation.archive_states.copy(),
+        history_synced=False,
     )
-    new_conversation.chat_instance = create_chat_instance(new_agents)
+    await conversation_writer.flush(conversation.conversation_id)
+    if conversation.messages and await asyncio.to_thread(
+        _add_conversation_ref, conversation.conversation_id
+    ):
+        new_conversation.parent_id = conversation.conversation_id
+        new_conversation.prefix_length = len(conversation.messages)
+        new_conversation.synced_message_count = new_conversation.prefix_length
+        # persist the reference right away, so the parent isn't deleted under it
+        await asyncio.to_thread(write_conversation, new_conversation)
+    chat_instance_pool.create(new_conversation)
     new_conversation.cancellation_token = CancellationToken()
     return new_conversation
 
 
-async def delete_conversation(conversation: Conversation) -> None:
+def load_conversation(conversation_id: str) -> Conversation | None:
+    """Load a conversation, materializing the messages it shares with its ancestors."""
+    data = conversation_storage.load(conversation_id)
+    if not data:
+        return None
+    conversation = Conversation.model_validate(data)
+
+    # collect the shared messages from the nearest ancestor to the farthest
+    segments = []
+    parent_id, length = conversation.parent_id, conversation.prefix_length
+    while parent_id and length > 0:
+        parent = conversation_storage.load(parent_id)
+        if not parent:
+            logger.error(
+                f"Parent conversation {parent_id} of {conversation_id} is missing"
+            )
+            break
+        parent_prefix_length = parent.get("prefix_length", 0)
+        segments.append(
+            parent.get("messages", [])[: max(length - parent_prefix_length, 0)]
+        )
+        parent_id, length = parent.get("parent_id"), min(length, parent_prefix_length)
+    conversation.messages = [
+        Message.model_validate(message)
+        for segment in reversed(segments)
+        for message in segment
+    ] + conversation.messages
+    return conversation
+
+
+def _add_conversation_ref(conversation_id: str) -> bool:
+    """Count one more fork sharing the messages of a stored conversation.
+    Returns False if the conversation isn't stored."""
+    with _conversation_refs_lock:
+        if not conversation_storage.exists(conversation_id):
+            return False
+        refs = conversation_ref_storage.load(conversation_id) or {}
+        conversation_ref_storage.save(
+            conversation_id,
+            {**refs, "ref_count": refs.get("ref_count", 0) + 1},
+        )
+        return True
+
+
+def _delete_conversation_record(conversation_id: str) -> None:
+    """Delete a stored conversation, or only mark it deleted while forks share its
+    messages. Ancestors marked deleted are deleted with their last fork."""
+    with _conversation_refs_lock:
+        while True:
+            refs = conversation_ref_storage.load(conversation_id) or {}
+            if refs.get("ref_count", 0) > 0:
+                conversation_ref_storage.save(
+                    conversation_id, {**refs, "deleted": True}
+                )
+                return
+            data = conversation_storage.load(conversation_id)
+            conversation_storage.delete(conversation_id)
+            conversation_ref_storage.delete(conversation_id)
+
+            parent_id = data.get("parent_id") if data else None
+            if not parent_id:
+                return
+            parent_refs = conversation_ref_storage.load(parent_id) or {}
+            parent_refs = {
+                **parent_refs,
+                "ref_count": max(parent_refs.get("ref_count", 0) - 1, 0),
+            }
+            conversation_ref_storage.save(parent_id, parent_refs)
+            if parent_refs["ref_count"] > 0 or not parent_refs.get("deleted"):
+                return
+            conversation_id = parent_id
+
+
+async def delete_conversation(conversation: Conversation | ConversationHeader) -> None:
     """Delete a conversation."""
+    await conversation_writer.discard(conversation.conversation_id)
+    await chat_instance_pool.discard(conversation.conversation_id)
     await asyncio.to_thread(
-        conversation_storage.delete,
+        _delete_conversation_record,
         conversation.conversation_id,
     )
+    await asyncio.to_thread(
+        conversation_index_storage.delete,
+        conversation.conversation_id,
+    )
+    conversation_header_cache.publish(conversation.conversation_id)
 
 
-async def list_conversations() -> List[Conversation]:
-    """List all conversations."""
-    conversations = []
-    for conversation_data in await asyncio.to_thread(conversation_storage.list, ""):
-        conversation = Conversation.model_validate(conversation_data)
-        conversations.append(conversation)
-    return conversations
+def _rebuild_conversation_index() -> list:
+    """Rebuild the conversation index from the stored conversations."""
+    headers = {}
+    for conversation_data in conversation_storage.list(""):
+        if not conversation_data:
+            continue
+        conversation_id = conversation_data["conversation_id"]
+        refs = conversation_ref_storage.load(conversation_id) or {}
+        if refs.get("deleted"):
+            # only kept for the forks sharing its messages
+            continue
+        conversation = load_conversation(conversation_id)
+        if conversation is None:
+            continue
+        header = get_conversation_header(conversation).model_dump()
+        headers[header["conversation_id"]] = header
+    conversation_index_storage.save_many(headers)
+    return list(headers.values())
 
 
-async def sync_conversation(conversation: Conversation):
-    conversation.updated_at = conversation.messages[-1].timestamp
-    await asyncio.to_thread(
-        conversation_storage.save,
+def _list_conversation_index() -> list:
+    if not migration_storage.exists("conversation_index"):
+        # index the conversations stored before the index existed, once
+        _rebuild_conversation_index()
+        migration_storage.save("conversation_index", {"completed_at": time.time()})
+    return conversation_index_storage.list("")
+
+
+async def snapshot_conversations() -> Tuple[int, List[ConversationHeader]]:
+    """Get the headers of all conversations from the shared cache, with the version
+    to get the changes since."""
+    version, headers = await asyncio.to_thread(conversation_header_cache.snapshot)
+    return version, [ConversationHeader.model_validate(header) for header in headers]
+
+
+def get_conversation_changes(
+    version: int,
+) -> Tuple[int, Dict[str, ConversationHeader | None]] | None:
+    """Get the headers of the conversations changed since a version of the shared
+    cache, None for deleted conversations, or None if the snapshot must be reloaded."""
+    result = conversation_header_cache.changes(version)
+    if result is None:
+        return None
+    version, changes = result
+    return version, {
+        change.key: (
+            ConversationHeader.model_validate(change.data)
+            if change.data is not None
+            else None
+        )
+        for change in changes
+    }
+
+
+def write_conversation(conversation: Conversation) -> None:
+    """Persist the messages added since the last write and the index header."""
+    # only the messages added since the last write are appended, and the messages
+    # shared with the parent of a fork are not stored again
+    start = max(
+        min(conversation.synced_message_count, len(conversation.messages)),
+        conversation.prefix_length,
+    )
+    end = len(conversation.messages)
+    conversation_storage.append(
         conversation.conversation_id,
-        conversation.model_dump(),
+        conversation.model_dump(exclude={"messages"}),
+        "messages",
+        [m.model_dump() for m in conversation.messages[start:end]],
+        start - conversation.prefix_length,
     )
+    conversation.synced_message_count = end
+    header = get_conversation_header(conversation).model_dump()
+    conversation_index_storage.save(conversation.conversation_id, header)
+    conversation_header_cache.publish(conversation.conversation_id, header)
+
+
+def prepare_conversation_write(conversation: Conversation) -> Callable[[], None]:
+    """Snapshot a conversation on the event loop that adds its messages, and get the
+    blocking write of the snapshot for a worker thread."""
+    snapshot = conversation.model_copy(
+        update={
+            "messages": list(conversation.messages),
+            "archive_states": dict(conversation.archive_states),
+        }
+    )
+
+    def write() -> None:
+        write_conversation(snapshot)
+        conversation.synced_message_count = snapshot.synced_message_count
+
+    return write
+
+
+conversation_writer = WriteBehindQueue(
+    prepare_conversation_write,
+    durability=os.getenv("CONVERSATION_DURABILITY", "interval"),  # type: ignore[arg-type]
+    flush_interval_ms=int(os.getenv("CONVERSATION_FLUSH_INTERVAL_MS", "500")),
+)
+
+
+async def sync_conversation(conversation: Conversation):
+    conversation.updated_at = conversation.messages[-1].timestamp
+    await conversation_writer.mark_dirty(conversation)
 
 
 async def get_responses(
     conversation: Conversation,
     user_input: str | None,
     cancellation_token: CancellationToken | None = None,
-    need_insert_conversation_messages: bool = False,
-) -> AsyncGenerator[Message, None]:
-    """Send a message to the team and return the response."""
+    stream: bool = False,
+) -> AsyncGenerator[Message | MessageChunk, None]:
+    """Send a message to the team and return the response.
+
+    With stream, the tokens of every response are also yielded as MessageChunks while
+    they are generated, before the complete Message. Only complete messages are saved.
+    """
     if not conversation.chat_instance:
         return
+    start = time.perf_counter()
+    first_token = True
 
+    # the chat instance is only used by this conversation until the turn ends
+    await chat_instance_pool.checkout(conversation)
     initial_messages = (
-        list.copy(conversation.messages) if need_insert_conversation_messages else []
+        list.copy(conversation.messages) if not conversation.history_synced else []
     )
     if user_input:
         user_message = Message(role="user", source="user", content=user_input)
@@ -126,24 +427,47 @@ async def get_responses(
         initial_messages.append(user_message)
         await sync_conversation(conversation)
 
-    async for response in conversation.chat_instance.run_stream(
-        task=(
-            [m.to_chat_message() for m in initial_messages]
-            if len(initial_messages) > 0
-            else None
-        ),
-        output_task_messages=False,
-        cancellation_token=cancellation_token,
-    ):
-        if (
-            isinstance(response, TextMessage | ToolCallSummaryMessage)
-            and response.source != "user"
+    completed = False
+    try:
+        async for response in conversation.chat_instance.run_stream(
+            task=(
+                [m.to_chat_message() for m in initial_messages]
+                if len(initial_messages) > 0
+                else None
+            ),
+            output_task_messages=False,
+            cancellation_token=cancellation_token,
         ):
-            message = Message(
-                role="assistant",
-                source=response.source,
-                content=response.content,
-            )
-            conversation.add_message(message)
-            await sync_conversation(conversation)
-            yield message
+            if isinstance(response, ModelClientStreamingChunkEvent):
+                if first_token:
+                    metrics.histogram("chat.time_to_first_token_ms").observe(
+                        (time.perf_counter() - start) * 1000
+                    )
+                    first_token = False
+                if stream:
+                    yield MessageChunk(source=response.source, content=response.content)
+            elif (
+                isinstance(response, TextMessage | ToolCallSummaryMessage)
+                and response.source != "user"
+            ):
+                message = Message(
+                    role="assistant",
+                    source=response.source,
+                    content=response.content,
+                )
+                conversation.add_message(message)
+                await sync_conversation(conversation)
+                yield message
+        completed = True
+    finally:
+        # end of turn, cancellation or error: write whatever is still pending
+        await conversation_writer.flush(conversation.conversation_id)
+        if completed:
+            conversation.history_synced = True
+            await chat_instance_pool.release(conversation)
+        else:
+            # the chat instance may have seen messages the conversation didn't get, the
+            # next turn replays the stored history into a new one
+            await chat_instance_pool.discard(conversation.conversation_id)
+            chat_instance_pool.create(conversation)
+            conversation.history_synced = False
@@ -0,0 +1,76 @@
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Tuple
+
+from schema import ConversationHeader
+
+# sorts by the update time, then the ID to keep conversations updated at once apart
+SortKey = Tuple[str, str]
+
+
+class ConversationIndex:
+    """An in-memory index of conversation headers by agent, for listing the
+    conversations of an agent a page at a time without scanning all conversations.
+
+    The conversations of every agent are kept sorted by update time, and the index is
+    maintained incrementally as conversations are created, updated and deleted.
+
+    Args:
+        headers (Iterable[ConversationHeader]): The headers to index initially.
+    """
+
+    def __init__(self, headers: Iterable[ConversationHeader] = ()) -> None:
+        self._headers: Dict[str, ConversationHeader] = {}
+        # the sort keys of the conversations of every agent, least recently updated first
+        self._agent_conversations: Dict[str, List[SortKey]] = {}
+        for header in headers:
+            self.put(header)
+
+    @staticmethod
+    def _sort_key(header: ConversationHeader) -> SortKey:
+        return (header.updated_at, header.conversation_id)
+
+    def __len__(self) -> int:
+        return len(self._headers)
+
+    def __contains__(self, conversation_id: str) -> bool:
+        return conversation_id in self._headers
+
+    def get(self, conversation_id: str) -> ConversationHeader | None:
+        return self._headers.get(conversation_id)
+
+    def put(self, header: ConversationHeader) -> None:
+        """Add or update the header of a conversation."""
+        self.remove(header.conversation_id)
+        self._headers[header.conversation_id] = header
+        key = self._sort_key(header)
+        for agent_id in dict.fromkeys(header.agent_ids):
+            insort(self._agent_conversations.setdefault(agent_id, []), key)
+
+    def remove(self, conversation_id: str) -> ConversationHeader | None:
+        """Remove the header of a conversation, returning it if it was indexed."""
+        header = self._headers.pop(conversation_id, None)
+        if header is None:
+            return None
+        key = self._sort_key(header)
+        for agent_id in dict.fromkeys(header.agent_ids):
+            keys = self._agent_conversations[agent_id]
+            del keys[bisect_left(keys, key)]
+            if not keys:
+                del self._agent_conversations[agent_id]
+        return header
+
+    def count(self, agent_id: str) -> int:
+        """Count the conversations of an agent."""
+        return len(self._agent_conversations.get(agent_id, ()))
+
+    def list(
+        self, agent_id: str, offset: int = 0, limit: int | None = None
+    ) -> List[ConversationHeader]:
+        """List the conversations of an agent, the most recently updated first."""
+        keys = self._agent_conversations.get(agent_id, [])
+        end = len(keys) - offset
+        start = 0 if limit is None else max(end - limit, 0)
+        return [
+            self._headers[conversation_id]
+            for _, conversation_id in reversed(keys[start : max(end, 0)])
+        ]
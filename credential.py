@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable
+from uuid import uuid4
+
+from azure.core.credentials import AccessToken, TokenCredential
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LocalCredential:
+    """A local stand-in for DefaultAzureCredential that issues fake tokens, for testing.
+
+    Args:
+        lifetime (float): Seconds until an issued token expires.
+        latency (float): Seconds to wait before issuing a token, simulating an AAD round trip.
+    """
+
+    def __init__(self, lifetime: float = 3600, latency: float = 0) -> None:
+        self._lifetime = lifetime
+        self._latency = latency
+
+    def get_token(self, *scopes: str, **kwargs: Any) -> AccessToken:
+        if self._latency > 0:
+            time.sleep(self._latency)
+        return AccessToken(f"local-{uuid4().hex}", int(time.time() + self._lifetime))
+
+
+class BackgroundTokenProvider:
+    """A bearer token provider that creates its credential on first use and keeps
+    a token cached, renewing it in a background thread before it expires.
+
+    Callers only wait on the credential when no valid token is cached yet, which
+    prefetch avoids by acquiring the first token in the background. While a token is
+    renewed, callers get the cached token as long as it hasn't expired. Async callers
+    use get_token_async, which waits for a token in a worker thread.
+
+    Args:
+        credential_factory (Callable[[], TokenCredential]): Creates the credential.
+        scope (str): The scope of the requested tokens.
+        refresh_margin (float): Seconds before expiry at which a token is renewed.
+        retry_interval (float): Seconds to wait before retrying a failed renewal.
+    """
+
+    def __init__(
+        self,
+        credential_factory: Callable[[], TokenCredential],
+        scope: str,
+        refresh_margin: float = 300,
+        retry_interval: float = 10,
+    ) -> None:
+        self._credential_factory = credential_factory
+        self._scope = scope
+        self._refresh_margin = refresh_margin
+        self._retry_interval = retry_interval
+        self._credential: TokenCredential | None = None
+        self._token: AccessToken | None = None
+        # held while a token is fetched
+        self._lock = threading.Lock()
+        self._refresher_lock = threading.Lock()
+        self._refresher: threading.Thread | None = None
+
+    def _get_credential(self) -> TokenCredential:
+        if self._credential is None:
+            start = time.perf_counter()
+            self._credential = self._credential_factory()
+            metrics.histogram("credential.startup_ms").observe(
+                (time.perf_counter() - start) * 1000
+            )
+        return self._credential
+
+    def _is_valid(self, token: AccessToken | None, margin: float = 0) -> bool:
+        return token is not None and token.expires_on - time.time() > margin
+
+    def _fetch_token(self, force: bool = False) -> AccessToken:
+        with self._lock:
+            # another thread may have fetched a token while we waited
+            if force or not self._is_valid(self._token, 10):
+                self._token = self._get_credential().get_token(self._scope)
+            return self._token  # type: ignore[return-value]
+
+    def _refresh_forever(self) -> None:
+        force = False
+        while True:
+            try:
+                token = self._fetch_token(force)
+                lifetime = token.expires_on - time.time()
+                # renew short-lived tokens halfway through their lifetime
+                delay = lifetime - min(self._refresh_margin, lifetime / 2)
+            except Exception as e:
+                logger.error(f"Failed to refresh token: {e}")
+                delay = self._retry_interval
+            time.sleep(max(delay, 1))
+            force = True
+
+    def prefetch(self) -> None:
+        """Start acquiring and renewing tokens in a background thread."""
+        with self._refresher_lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(
+                    target=self._refresh_forever, name="token-refresher", daemon=True
+                )
+                self._refresher.start()
+
+    def _get_cached_token(self) -> str | None:
+        """Get the cached token without waiting, or None if a caller must wait."""
+        token = self._token
+        # an unexpired token is used while the refresher renews it
+        if self._is_valid(token, 10) or (self._is_valid(token) and self._lock.locked()):
+            metrics.histogram("credential.token_wait_ms").observe(0)
+            return token.token  # type: ignore[union-attr]
+        return None
+
+    def _wait_for_token(self) -> str:
+        start = time.perf_counter()
+        token = self._fetch_token()
+        metrics.histogram("credential.token_wait_ms").observe(
+            (time.perf_counter() - start) * 1000
+        )
+        self.prefetch()
+        return token.token
+
+    def __call__(self) -> str:
+        return self._get_cached_token() or self._wait_for_token()
+
+    async def get_token_async(self) -> str:
+        """Get a token without blocking the event loop."""
+        return self._get_cached_token() or await asyncio.to_thread(self._wait_for_token)
@@ -0,0 +1,262 @@
+import asyncio
+import logging
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List
+
+from autogen_agentchat.base import ChatAgent, Team
+from pydantic import BaseModel, Field
+
+import metrics
+from schema import ArchiveState, Conversation
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+ChatInstanceFactory = Callable[
+    [Conversation, Callable[[str, ArchiveState], None]], ChatAgent | Team
+]
+
+
+class PooledChatInstance(BaseModel):
+    chat_instance: ChatAgent | Team
+    agent_ids: List[str]
+    # the number of conversation messages the chat instance has seen
+    message_count: int
+    size: int
+
+    model_config = {
+        "arbitrary_types_allowed": True,
+    }
+
+
+class SpilledChatInstance(BaseModel):
+    agent_ids: List[str]
+    message_count: int
+    state: Dict[str, Any] = Field(default_factory=dict)
+
+
+class _ArchiveRoute:
+    """Routes the archive state callbacks of a chat instance to the conversation that
+    uses it."""
+
+    def __init__(self, conversation: Conversation) -> None:
+        self.set(conversation)
+
+    def set(self, conversation: Conversation) -> None:
+        self._conversation = weakref.ref(conversation)
+
+    @property
+    def conversation(self) -> Conversation | None:
+        return self._conversation()
+
+    def __call__(self, agent_id: str, archive_state: ArchiveState) -> None:
+        if conversation := self.conversation:
+            conversation.set_archive_state(agent_id, archive_state)
+
+
+class ChatInstancePool:
+    """A process-wide LRU pool of live chat instances keyed by conversation ID.
+
+    A chat instance that has seen all messages of a conversation is reused when the
+    conversation is resumed, instead of rebuilding its agents and replaying the whole
+    history into them. The least recently used instances beyond max_instances or the
+    estimated max_bytes are evicted, spilling their state through autogen save_state to
+    the storage in the background, and are restored with load_state on the next resume.
+
+    An instance belongs to the conversation that acquired it last, and is checked out of
+    the pool while it runs a turn, so sessions resuming the same conversation never
+    share one; a conversation whose instance was acquired by another one gets a new
+    instance on its next turn. Archive state callbacks are routed to the owner.
+
+    Args:
+        factory (ChatInstanceFactory): Creates the chat instance of a conversation with
+            the archive state callback to use.
+        storage (Storage | None): Where evicted instances are spilled, if set.
+        max_instances (int): The maximum number of live instances.
+        max_bytes (int): The maximum estimated size of the histories held by live instances.
+    """
+
+    def __init__(
+        self,
+        factory: ChatInstanceFactory,
+        storage: Storage | None = None,
+        max_instances: int = 16,
+        max_bytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        self._factory = factory
+        self._storage = storage
+        self._max_instances = max_instances
+        self._max_bytes = max_bytes
+        self._instances: OrderedDict[str, PooledChatInstance] = OrderedDict()
+        self._routes: weakref.WeakKeyDictionary[ChatAgent | Team, _ArchiveRoute] = (
+            weakref.WeakKeyDictionary()
+        )
+        # the spills in progress, by conversation ID
+        self._spills: Dict[str, asyncio.Task] = {}
+        self._total_bytes = 0
+
+    @staticmethod
+    def _estimate_size(conversation: Conversation) -> int:
+        # every agent keeps its own copy of the history in its model context
+        return sum(len(m.content) for m in conversation.messages) * max(
+            len(conversation.agents), 1
+        )
+
+    def _create(self, conversation: Conversation) -> ChatAgent | Team:
+        route = _ArchiveRoute(conversation)
+        chat_instance = self._factory(conversation, route)
+        self._routes[chat_instance] = route
+        return chat_instance
+
+    def _matches(
+        self, agent_ids: List[str], message_count: int, conversation: Conversation
+    ) -> bool:
+        return agent_ids == [
+            agent.agent_id for agent in conversation.agents
+        ] and message_count == len(conversation.messages)
+
+    async def acquire(self, conversation: Conversation) -> bool:
+        """Set the chat instance of a conversation, from the pool if possible.
+        Returns whether the chat instance has already seen the conversation history."""
+        conversation_id = conversation.conversation_id
+        pooled = self._instances.get(conversation_id)
+        if pooled is not None and self._matches(
+            pooled.agent_ids, pooled.message_count, conversation
+        ):
+            self._instances.move_to_end(conversation_id)
+            # a conversation that acquired the instance before gets its own on its next turn
+            self._routes[pooled.chat_instance].set(conversation)
+            conversation.chat_instance = pooled.chat_instance
+            metrics.counter("chat_instances.hits").inc()
+            return True
+        self._remove(conversation_id)
+
+        conversation.chat_instance = self._create(conversation)
+        await self._wait_for_spill(conversation_id)
+        spilled = await self._load_spilled(conversation_id)
+        if spilled is not None and self._matches(
+            spilled.agent_ids, spilled.message_count, conversation
+        ):
+            try:
+                await conversation.chat_instance.load_state(spilled.state)
+                metrics.counter("chat_instances.restores").inc()
+                return True
+            except Exception as e:
+                logger.error(f"Failed to restore chat instance {conversation_id}: {e}")
+                conversation.chat_instance = self._create(conversation)
+        metrics.counter("chat_instances.misses").inc()
+        return False
+
+    async def checkout(self, conversation: Conversation) -> None:
+        """Take the chat instance of a conversation out of the pool for a turn. If it was
+        acquired by another conversation meanwhile, e.g. a resume of the same
+        conversation in another session, the conversation gets an instance of its own.
+        """
+        conversation_id = conversation.conversation_id
+        route = self._routes.get(conversation.chat_instance)
+        if route is None or route.conversation is not conversation:
+            conversation.history_synced = await self.acquire(conversation)
+        pooled = self._instances.get(conversation_id)
+        if pooled is not None and pooled.chat_instance is conversation.chat_instance:
+            self._remove(conversation_id)
+        # an evicted instance may still be used by its conversation once it is spilled
+        await self._wait_for_spill(conversation_id)
+
+    def create(self, conversation: Conversation) -> None:
+        """Set a new chat instance of a conversation that hasn't seen its history."""
+        self._remove(conversation.conversation_id)
+        conversation.chat_instance = self._create(conversation)
+
+    async def release(self, conversation: Conversation) -> None:
+        """Return the chat instance of a conversation to the pool after a completed
+        turn, evicting the least recently used instances beyond the limits."""
+        if conversation.chat_instance is None:
+            return
+        conversation_id = conversation.conversation_id
+        self._remove(conversation_id)
+        size = self._estimate_size(conversation)
+        self._instances[conversation_id] = PooledChatInstance(
+            chat_instance=conversation.chat_instance,
+            agent_ids=[agent.agent_id for agent in conversation.agents],
+            message_count=len(conversation.messages),
+            size=size,
+        )
+        self._total_bytes += size
+
+        while len(self._instances) > 1 and (
+            len(self._instances) > self._max_instances
+            or self._total_bytes > self._max_bytes
+        ):
+            evicted_id = next(iter(self._instances))
+            evicted = self._instances[evicted_id]
+            self._remove(evicted_id)
+            self._start_spill(evicted_id, evicted)
+
+    async def discard(self, conversation_id: str) -> None:
+        """Drop the live and spilled chat instance of a conversation, e.g. when it was
+        interrupted mid-turn or deleted."""
+        self._remove(conversation_id)
+        if self._storage is not None:
+            await self._wait_for_spill(conversation_id)
+            await asyncio.to_thread(self._storage.delete, conversation_id)
+
+    async def join(self) -> None:
+        """Wait for the spills in progress in the running event loop, which would be
+        cancelled when it is closed."""
+        loop = asyncio.get_running_loop()
+        spills = [spill for spill in self._spills.values() if spill.get_loop() is loop]
+        if spills:
+            await asyncio.wait(spills)
+
+    def _remove(self, conversation_id: str) -> PooledChatInstance | None:
+        pooled = self._instances.pop(conversation_id, None)
+        if pooled is not None:
+            self._total_bytes -= pooled.size
+        return pooled
+
+    def _start_spill(self, conversation_id: str, pooled: PooledChatInstance) -> None:
+        if self._storage is None:
+            return
+        spill = asyncio.get_running_loop().create_task(
+            self._spill(conversation_id, pooled)
+        )
+        # the event loop only keeps weak references to its tasks
+        self._spills[conversation_id] = spill
+        spill.add_done_callback(lambda _: self._end_spill(conversation_id, spill))
+
+    def _end_spill(self, conversation_id: str, spill: asyncio.Task) -> None:
+        if self._spills.get(conversation_id) is spill:
+            del self._spills[conversation_id]
+
+    async def _wait_for_spill(self, conversation_id: str) -> None:
+        spill = self._spills.get(conversation_id)
+        # a spill of a closed event loop has been cancelled
+        if spill is not None and spill.get_loop() is asyncio.get_running_loop():
+            await asyncio.wait([spill])
+
+    async def _spill(self, conversation_id: str, pooled: PooledChatInstance) -> None:
+        if self._storage is None:
+            return
+        try:
+            state = await pooled.chat_instance.save_state()
+            spilled = SpilledChatInstance(
+                agent_ids=pooled.agent_ids,
+                message_count=pooled.message_count,
+                state=dict(state),
+            )
+            await asyncio.to_thread(
+                self._storage.save, conversation_id, spilled.model_dump(mode="json")
+            )
+            metrics.counter("chat_instances.spills").inc()
+        except Exception as e:
+            logger.error(f"Failed to spill chat instance {conversation_id}: {e}")
+
+    async def _load_spilled(self, conversation_id: str) -> SpilledChatInstance | None:
+        if self._storage is None:
+            return None
+        data = await asyncio.to_thread(self._storage.load, conversation_id)
+        if not data:
+            return None
+        await asyncio.to_thread(self._storage.delete, conversation_id)
+        return SpilledChatInstance.model_validate(data)
@@ -0,0 +1,183 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from typing import Any, Dict
+
+import metrics
+from mock_server import MockModelServer
+
+logger = logging.getLogger(__name__)
+
+
+async def monitor_event_loop(interval: float, stop: asyncio.Event) -> None:
+    """Record how late the event loop wakes up a task sleeping for interval."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        metrics.histogram("loadtest.event_loop_lag_ms").observe(
+            max(time.perf_counter() - start - interval, 0) * 1000
+        )
+
+
+async def simulate_user(user: int, args: argparse.Namespace) -> None:
+    """Run the turns of one simulated user, resuming the conversation periodically."""
+    from chat import get_responses, resume_conversation, start_conversation
+    from schema import AgentConfig
+
+    rng = random.Random(user)
+    # stagger the users, so they don't all start in the same instant
+    await asyncio.sleep(rng.uniform(0, args.think_time))
+    agents = [
+        AgentConfig(name=f"assistant_{i}", description="A helpful assistant.")
+        for i in range(args.agents)
+    ]
+    conversation = await start_conversation(agents)
+    for turn in range(args.turns):
+        if args.resume_every and turn > 0 and turn % args.resume_every == 0:
+            conversation = await resume_conversation(conversation.conversation_id)
+
+        start = time.perf_counter()
+        first = True
+        try:
+            async for _ in get_responses(
+                conversation, f"Message {turn} from user {user}"
+            ):
+                if first:
+                    metrics.histogram("loadtest.time_to_first_message_ms").observe(
+                        (time.perf_counter() - start) * 1000
+                    )
+                    first = False
+        except Exception:
+            logger.exception(f"Turn {turn} of user {user} failed")
+            metrics.counter("loadtest.failed_turns").inc()
+            continue
+        metrics.histogram("loadtest.turn_latency_ms").observe(
+            (time.perf_counter() - start) * 1000
+        )
+        metrics.counter("loadtest.turns").inc()
+        await asyncio.sleep(rng.uniform(0, 2 * args.think_time))
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    from model_client import model_client_pool, prompt_cache_stats
+
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_event_loop(args.lag_interval, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(simulate_user(user, args) for user in range(args.users)))
+    duration = time.perf_counter() - start
+    stop.set()
+    await monitor
+
+    from chat import chat_instance_pool, conversation_writer
+
+    await chat_instance_pool.join()
+
+    conversation_writer.flush_all_sync()
+    snapshot = metrics.snapshot()
+    return {
+        "users": args.users,
+        "turns_per_user": args.turns,
+        "agents": args.agents,
+        "duration_s": duration,
+        "turns_per_second": snapshot.get("loadtest.turns", {}).get("value", 0)
+        / duration,
+        "time_to_first_message_ms": snapshot.get("loadtest.time_to_first_message_ms"),
+        "time_to_first_token_ms": snapshot.get("chat.time_to_first_token_ms"),
+        "turn_latency_ms": snapshot.get("loadtest.turn_latency_ms"),
+        "storage_write_latency_ms": snapshot.get("conversation.flush_latency_ms"),
+        "event_loop_lag_ms": snapshot.get("loadtest.event_loop_lag_ms"),
+        "failed_turns": snapshot.get("loadtest.failed_turns", {}).get("value", 0),
+        "prompt_cache": prompt_cache_stats(),
+        "model_clients": [
+            {"key": list(key), **stats.model_dump()}
+            for key, stats in model_client_pool.stats().items()
+        ],
+        "metrics": snapshot,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Drive concurrent simulated users through chat.get_responses"
+    )
+    parser.add_argument("--users", type=int, default=200, help="Concurrent users")
+    parser.add_argument("--turns", type=int, default=10, help="Turns per user")
+    parser.add_argument("--agents", type=int, default=1, help="Agents per conversation")
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=1.0,
+        help="Mean seconds a user waits between turns",
+    )
+    parser.add_argument(
+        "--resume-every",
+        type=int,
+        default=0,
+        help="Resume the conversation from storage every N turns, 0 to never resume",
+    )
+    parser.add_argument(
+        "--endpoint",
+        help="OpenAI compatible endpoint to use instead of a local mock model server",
+    )
+    parser.add_argument(
+        "--model-latency-ms",
+        type=float,
+        default=200,
+        help="Time to first token of the local mock model server",
+    )
+    parser.add_argument(
+        "--tokens-per-second",
+        type=float,
+        default=0,
+        help="Token rate of the local mock model server, 0 for unlimited",
+    )
+    parser.add_argument(
+        "--prompt-cache-min-tokens",
+        type=int,
+        default=1024,
+        help="Minimum prompt length the local mock model server caches",
+    )
+    parser.add_argument(
+        "--storage-directory",
+        help="Storage directory, defaults to a new temporary directory",
+    )
+    parser.add_argument(
+        "--lag-interval",
+        type=float,
+        default=0.05,
+        help="Seconds between event loop lag probes",
+    )
+    parser.add_argument("--output", help="Write the report to a JSON file")
+    args = parser.parse_args()
+
+    # configure the application before it's imported
+    endpoint = (
+        args.endpoint
+        or MockModelServer(
+            latency=args.model_latency_ms / 1000,
+            tokens_per_second=args.tokens_per_second or None,
+            prompt_cache_min_tokens=args.prompt_cache_min_tokens,
+        ).start_in_thread()
+    )
+    os.environ["AZURE_OPENAI_ENDPOINT"] = endpoint
+    os.environ.setdefault("AZURE_CREDENTIAL", "local")
+    os.environ["STORAGE_DIRECTORY"] = args.storage_directory or tempfile.mkdtemp(
+        prefix="loadtest-"
+    )
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import threading
+from collections import deque
+from typing import Dict
+
+_lock = threading.Lock()
+
+
+def _percentile(samples: list[float], p: float) -> float:
+    return samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+
+
+class Counter:
+    """
+    A monotonically increasing counter.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def summary(self) -> Dict[str, float]:
+        return {"value": self._value}
+
+
+class Histogram:
+    """
+    Keeps the most recent observations of a value and reports percentiles.
+    """
+
+    def __init__(self, name: str, max_samples: int = 10000):
+        self.name = name
+        self._samples: deque[float] = deque(maxlen=max_samples)
+        self._count = 0
+        self._total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._samples.append(value)
+            self._count += 1
+            self._total += value
+
+    def percentile(self, p: float) -> float:
+        with self._lock:
+            samples = sorted(self._samples)
+        return _percentile(samples, p) if samples else 0.0
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total = self._count, self._total
+        if not samples:
+            return {"count": 0}
+        return {
+            "count": count,
+            "mean": total / count,
+            "p50": _percentile(samples, 50),
+            "p95": _percentile(samples, 95),
+            "p99": _percentile(samples, 99),
+            "max": samples[-1],
+        }
+
+
+_metrics: Dict[str, Counter | Histogram] = {}
+
+
+def counter(name: str) -> Counter:
+    """Get or create the counter with the given name."""
+    with _lock:
+        if name not in _metrics:
+            _metrics[name] = Counter(name)
+        return _metrics[name]  # type: ignore[return-value]
+
+
+def histogram(name: str) -> Histogram:
+    """Get or create the histogram with the given name."""
+    with _lock:
+        if name not in _metrics:
+            _metrics[name] = Histogram(name)
+        return _metrics[name]  # type: ignore[return-value]
+
+
+def snapshot(prefix: str = "") -> Dict[str, Dict[str, float]]:
+    """Get the summaries of all metrics whose name starts with prefix."""
+    with _lock:
+        metrics = [m for name, m in _metrics.items() if name.startswith(prefix)]
+    return {m.name: m.summary() for m in metrics}
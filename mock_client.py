@@ -0,0 +1,151 @@
+import asyncio
+import re
+from typing import Any, AsyncGenerator, Literal, Mapping, Optional, Sequence
+
+from autogen_core import CancellationToken
+from autogen_core.models import (
+    ChatCompletionClient,
+    CreateResult,
+    LLMMessage,
+    ModelCapabilities,  # type: ignore
+    ModelFamily,
+    ModelInfo,
+    RequestUsage,
+)
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel
+
+TOKEN_PATTERN = re.compile(r"\S+\s*|\s+")
+
+
+class MockChatCompletionClient(ChatCompletionClient):
+    """A deterministic local stand-in for a chat completion model, for benchmarks and
+    offline runs. It answers with scripted replies in order, cycling through them.
+
+    Tokens are estimated as one per 4 characters. Replies are streamed word by word.
+
+    Args:
+        replies (Sequence[str | CreateResult] | None): The scripted replies. Defaults to a fixed text reply.
+        latency (float): Seconds before the first token of a reply, simulating a round trip.
+        tokens_per_second (float | None): The rate at which reply tokens are generated,
+            unlimited if None.
+        context_window (int): The number of tokens the model accepts.
+    """
+
+    def __init__(
+        self,
+        replies: Sequence[str | CreateResult] | None = None,
+        latency: float = 0,
+        tokens_per_second: float | None = None,
+        context_window: int = 128000,
+    ) -> None:
+        self._replies = list(replies or ["This is a mock reply."])
+        self._latency = latency
+        self._tokens_per_second = tokens_per_second
+        self._context_window = context_window
+        self._index = 0
+        self._total_usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+        self.requests = 0
+
+    @property
+    def model(self) -> str:
+        return "mock"
+
+    @staticmethod
+    def _count_text_tokens(text: str) -> int:
+        return len(text) // 4 + 1
+
+    def _next_reply(self, messages: Sequence[LLMMessage]) -> CreateResult:
+        reply = self._replies[self._index % len(self._replies)]
+        self._index += 1
+        self.requests += 1
+        if isinstance(reply, CreateResult):
+            return reply
+        usage = RequestUsage(
+            prompt_tokens=self.count_tokens(messages),
+            completion_tokens=self._count_text_tokens(reply),
+        )
+        self._total_usage = RequestUsage(
+            prompt_tokens=self._total_usage.prompt_tokens + usage.prompt_tokens,
+            completion_tokens=self._total_usage.completion_tokens
+            + usage.completion_tokens,
+        )
+        return CreateResult(
+            finish_reason="stop", content=reply, usage=usage, cached=False
+        )
+
+    async def _generate(self, tokens: int) -> None:
+        if self._tokens_per_second:
+            await asyncio.sleep(tokens / self._tokens_per_second)
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Tool | Literal["auto", "required", "none"] = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        result = self._next_reply(messages)
+        if self._latency > 0:
+            await asyncio.sleep(self._latency)
+        await self._generate(result.usage.completion_tokens)
+        return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Tool | Literal["auto", "required", "none"] = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[str | CreateResult, None]:
+        result = self._next_reply(messages)
+        if self._latency > 0:
+            await asyncio.sleep(self._latency)
+        if isinstance(result.content, str):
+            for chunk in TOKEN_PATTERN.findall(result.content):
+                await self._generate(self._count_text_tokens(chunk))
+                yield chunk
+        yield result
+
+    async def close(self) -> None:
+        pass
+
+    def actual_usage(self) -> RequestUsage:
+        return self._total_usage
+
+    def total_usage(self) -> RequestUsage:
+        return self._total_usage
+
+    def count_tokens(
+        self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []
+    ) -> int:
+        return sum(
+            self._count_text_tokens(str(message.content)) + 4 for message in messages
+        )
+
+    def remaining_tokens(
+        self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []
+    ) -> int:
+        return self._context_window - self.count_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> ModelCapabilities:  # type: ignore
+        return ModelCapabilities(  # type: ignore
+            vision=False, function_calling=True, json_output=True
+        )
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return ModelInfo(
+            vision=False,
+            function_calling=True,
+            json_output=True,
+            family=ModelFamily.UNKNOWN,
+            structured_output=False,
+        )
@@ -0,0 +1,337 @@
+import argparse
+import asyncio
+import fnmatch
+import logging
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Set
+
+logger = logging.getLogger(__name__)
+
+# the commands that change the keys they are given, which aborts transactions watching them
+WRITE_COMMANDS = {
+    b"SET",
+    b"DEL",
+    b"HSET",
+    b"HDEL",
+    b"RPUSH",
+    b"LTRIM",
+    b"ZADD",
+    b"ZREM",
+}
+
+
+class RedisError(Exception):
+    pass
+
+
+class MockRedisServer:
+    """A local stand-in for redis-server, for tests and benchmarks without a Redis
+    deployment. It speaks RESP2 and implements the subset of strings, hashes, lists,
+    sorted sets (lexicographic ranges only), transactions with WATCH and pub/sub that
+    RedisStorage uses. Data is kept in memory and never expires.
+
+    Args:
+        latency (float): Seconds added to every round trip, simulating the network.
+    """
+
+    def __init__(self, latency: float = 0) -> None:
+        self._latency = latency
+        self._data: Dict[bytes, Any] = {}
+        # the number of writes of every key, for WATCH
+        self._versions: Dict[bytes, int] = defaultdict(int)
+        self._subscribers: Dict[bytes, Set[asyncio.StreamWriter]] = defaultdict(set)
+        self._server: asyncio.Server | None = None
+        self.commands = 0
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start serving and get the redis:// URL, which selects RESP2."""
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"redis://{host}:{port}/0?protocol=2"
+
+    def start_in_thread(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start serving in a daemon thread with its own event loop, also from inside a
+        running event loop. Returns the URL."""
+        loop = asyncio.new_event_loop()
+        threading.Thread(
+            target=loop.run_forever, name="mock-redis-server", daemon=True
+        ).start()
+        return asyncio.run_coroutine_threadsafe(self.start(host, port), loop).result()
+
+    @staticmethod
+    async def _read_command(reader: asyncio.StreamReader) -> List[bytes] | None:
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # inline command
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            size = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(size + 2))[:-2])
+        return args
+
+    @classmethod
+    def _encode(cls, value: Any) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, RedisError):
+            return f"-{value}\r\n".encode()
+        if isinstance(value, bool):
+            return b"+OK\r\n"
+        if isinstance(value, int):
+            return f":{value}\r\n".encode()
+        if isinstance(value, str):
+            return f"+{value}\r\n".encode()
+        if isinstance(value, bytes):
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        return b"*%d\r\n" % len(value) + b"".join(cls._encode(item) for item in value)
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        queued: List[List[bytes]] | None = None
+        # the watched keys and their versions when they were watched
+        watched: Dict[bytes, int] = {}
+        try:
+            while (args := await self._read_command(reader)) is not None:
+                if not args:
+                    continue
+                if self._latency > 0:
+                    await asyncio.sleep(self._latency)
+                self.commands += 1
+                name = args[0].upper()
+                if name == b"MULTI":
+                    queued = []
+                    reply: Any = True
+                elif name == b"EXEC":
+                    # a nil reply aborts the transaction if a watched key was written
+                    if any(self._versions[k] != v for k, v in watched.items()):
+                        reply = None
+                    else:
+                        reply = [self._execute(command) for command in queued or []]
+                    queued = None
+                    watched.clear()
+                elif name == b"DISCARD":
+                    queued, reply = None, True
+                    watched.clear()
+                elif queued is not None:
+                    queued.append(args)
+                    reply = "QUEUED"
+                elif name == b"WATCH":
+                    watched.update({key: self._versions[key] for key in args[1:]})
+                    reply = True
+                elif name == b"UNWATCH":
+                    watched.clear()
+                    reply = True
+                elif name == b"SUBSCRIBE":
+                    for i, channel in enumerate(args[1:]):
+                        self._subscribers[channel].add(writer)
+                        writer.write(self._encode([b"subscribe", channel, i + 1]))
+                    await writer.drain()
+                    continue
+                else:
+                    reply = self._execute(args)
+                writer.write(self._encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.error(f"Mock Redis server failed to handle a command: {e}")
+        finally:
+            for subscribers in self._subscribers.values():
+                subscribers.discard(writer)
+            writer.close()
+
+    def _get(self, key: bytes, kind: type) -> Any:
+        value = self._data.get(key)
+        if value is not None and not isinstance(value, kind):
+            raise RedisError(
+                "WRONGTYPE Operation against a key holding the wrong kind of value"
+            )
+        return value
+
+    def _execute(self, args: List[bytes]) -> Any:
+        if args[0].upper() in WRITE_COMMANDS:
+            for key in args[1:] if args[0].upper() == b"DEL" else args[1:2]:
+                self._versions[key] += 1
+        name, args = args[0].upper().decode(), args[1:]
+        try:
+            handler = getattr(self, f"_command_{name.lower()}", None)
+            if handler is None:
+                return RedisError(f"ERR unknown command '{name}'")
+            return handler(*args)
+        except RedisError as e:
+            return e
+        except (TypeError, ValueError, IndexError):
+            return RedisError(f"ERR wrong number of arguments for '{name}' command")
+
+    def _command_ping(self, message: bytes | None = None) -> Any:
+        return message if message is not None else "PONG"
+
+    def _command_hello(self, protocol: bytes = b"2", *args: bytes) -> Any:
+        if protocol != b"2":
+            return RedisError("NOPROTO this server only supports RESP2")
+        return [b"server", b"redis", b"version", b"7.0.0", b"proto", 2]
+
+    def _command_client(self, *args: bytes) -> Any:
+        return True
+
+    def _command_select(self, db: bytes) -> Any:
+        return True
+
+    def _command_flushdb(self, *args: bytes) -> Any:
+        for key in self._data:
+            self._versions[key] += 1
+        self._data.clear()
+        return True
+
+    def _command_get(self, key: bytes) -> Any:
+        return self._get(key, bytes)
+
+    def _command_set(self, key: bytes, value: bytes, *args: bytes) -> Any:
+        self._data[key] = value
+        return True
+
+    def _command_del(self, *keys: bytes) -> Any:
+        return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def _command_exists(self, *keys: bytes) -> Any:
+        return sum(key in self._data for key in keys)
+
+    def _command_keys(self, pattern: bytes) -> Any:
+        return [key for key in self._data if fnmatch.fnmatchcase(key, pattern)]
+
+    def _command_hset(self, key: bytes, *pairs: bytes) -> Any:
+        if not pairs or len(pairs) % 2:
+            raise ValueError
+        hash = self._get(key, dict)
+        if hash is None:
+            hash = self._data[key] = {}
+        added = 0
+        for field, value in zip(pairs[::2], pairs[1::2]):
+            added += field not in hash
+            hash[field] = value
+        return added
+
+    def _command_hget(self, key: bytes, field: bytes) -> Any:
+        return (self._get(key, dict) or {}).get(field)
+
+    def _command_hmget(self, key: bytes, *fields: bytes) -> Any:
+        if not fields:
+            raise ValueError
+        hash = self._get(key, dict) or {}
+        return [hash.get(field) for field in fields]
+
+    def _command_hgetall(self, key: bytes) -> Any:
+        hash = self._get(key, dict) or {}
+        return [item for pair in hash.items() for item in pair]
+
+    def _command_hkeys(self, key: bytes) -> Any:
+        return list(self._get(key, dict) or {})
+
+    def _command_hdel(self, key: bytes, *fields: bytes) -> Any:
+        hash = self._get(key, dict) or {}
+        deleted = sum(hash.pop(field, None) is not None for field in fields)
+        if key in self._data and not hash:
+            del self._data[key]
+        return deleted
+
+    def _command_rpush(self, key: bytes, *values: bytes) -> Any:
+        if not values:
+            raise ValueError
+        items = self._get(key, list)
+        if items is None:
+            items = self._data[key] = []
+        items.extend(values)
+        return len(items)
+
+    @staticmethod
+    def _range(length: int, start: bytes, stop: bytes) -> slice:
+        first, last = int(start), int(stop)
+        first = max(first + length if first < 0 else first, 0)
+        last = last + length if last < 0 else last
+        return slice(first, last + 1)
+
+    def _command_lrange(self, key: bytes, start: bytes, stop: bytes) -> Any:
+        items = self._get(key, list) or []
+        return items[self._range(len(items), start, stop)]
+
+    def _command_ltrim(self, key: bytes, start: bytes, stop: bytes) -> Any:
+        items = self._get(key, list)
+        if items is not None:
+            items[:] = items[self._range(len(items), start, stop)]
+            if not items:
+                del self._data[key]
+        return True
+
+    def _command_llen(self, key: bytes) -> Any:
+        return len(self._get(key, list) or [])
+
+    def _command_zadd(self, key: bytes, *pairs: bytes) -> Any:
+        if not pairs or len(pairs) % 2:
+            raise ValueError
+        members = self._get(key, dict)
+        if members is None:
+            members = self._data[key] = {}
+        added = 0
+        for score, member in zip(pairs[::2], pairs[1::2]):
+            added += member not in members
+            members[member] = float(score)
+        return added
+
+    def _command_zrem(self, key: bytes, *members: bytes) -> Any:
+        zset = self._get(key, dict) or {}
+        removed = sum(zset.pop(member, None) is not None for member in members)
+        if key in self._data and not zset:
+            del self._data[key]
+        return removed
+
+    @staticmethod
+    def _lex_bound(bound: bytes) -> tuple[bytes | None, bool]:
+        if bound in (b"-", b"+"):
+            return None, True
+        return bound[1:], bound[:1] == b"["
+
+    def _command_zrangebylex(self, key: bytes, min: bytes, max: bytes) -> Any:
+        low, low_inclusive = self._lex_bound(min)
+        high, high_inclusive = self._lex_bound(max)
+        if max == b"-" or min == b"+":
+            return []
+        return [
+            member
+            for member in sorted(self._get(key, dict) or {})
+            if (low is None or member > low or (low_inclusive and member == low))
+            and (high is None or member < high or (high_inclusive and member == high))
+        ]
+
+    def _command_publish(self, channel: bytes, message: bytes) -> Any:
+        subscribers = list(self._subscribers.get(channel, ()))
+        for subscriber in subscribers:
+            subscriber.write(self._encode([b"message", channel, message]))
+        return len(subscribers)
+
+
+async def serve(args: argparse.Namespace) -> None:
+    server = MockRedisServer(args.latency_ms / 1000)
+    url = await server.start(args.host, args.port)
+    print(f"Mock Redis server listening on {url}")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock Redis server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, Set
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+
+class MockModelServer:
+    """A local OpenAI compatible chat completions server answering every request with
+    the same reply, for load tests. It serves the Azure OpenAI routes over HTTP/1.1
+    with keep-alive, both as JSON and as server-sent events when streaming.
+
+    Prompt caching is simulated like the OpenAI service does it: once a prompt is at
+    least prompt_cache_min_tokens long, the longest prefix of whole messages seen in an
+    earlier request is reported as cached, in increments of 128 tokens.
+
+    Args:
+        reply (str): The content of every reply.
+        latency (float): Seconds before the first token of a reply.
+        tokens_per_second (float | None): The rate at which reply tokens are streamed,
+            unlimited if None.
+        prompt_cache_min_tokens (int): The minimum prompt length to cache.
+        prompt_cache_size (int): The number of message prefixes cached.
+    """
+
+    def __init__(
+        self,
+        reply: str = "This is a mock reply.\nTERMINATE",
+        latency: float = 0,
+        tokens_per_second: float | None = None,
+        prompt_cache_min_tokens: int = 1024,
+        prompt_cache_size: int = 100000,
+    ) -> None:
+        self._reply = reply
+        self._latency = latency
+        self._tokens_per_second = tokens_per_second
+        self._prompt_cache_min_tokens = prompt_cache_min_tokens
+        self._prompt_cache_size = prompt_cache_size
+        self._prompt_cache: Set[str] = set()
+        self._server: asyncio.Server | None = None
+        self.requests = 0
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start serving and get the endpoint URL."""
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    def start_in_thread(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start serving in a daemon thread with its own event loop, so the server
+        doesn't compete with the event loop under test. Returns the endpoint URL."""
+        loop = asyncio.new_event_loop()
+        endpoint = loop.run_until_complete(self.start(host, port))
+        threading.Thread(
+            target=loop.run_forever, name="mock-model-server", daemon=True
+        ).start()
+        return endpoint
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers: Dict[str, str] = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests += 1
+                await self._handle_request(json.loads(body or b"{}"), writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.error(f"Mock model server failed to handle a request: {e}")
+        finally:
+            writer.close()
+
+    def _cached_tokens(self, request: Dict[str, Any]) -> int:
+        """Get the cached tokens of a prompt and cache its message prefixes."""
+        fingerprint = hashlib.sha256(
+            json.dumps(request.get("tools", []), sort_keys=True).encode()
+        )
+        prompt_tokens = cached_tokens = 0
+        for message in request.get("messages", []):
+            fingerprint.update(json.dumps(message, sort_keys=True).encode())
+            prompt_tokens += len(str(message.get("content", ""))) // 4 + 4
+            key = fingerprint.hexdigest()
+            if key in self._prompt_cache:
+                cached_tokens = prompt_tokens
+            else:
+                if len(self._prompt_cache) >= self._prompt_cache_size:
+                    self._prompt_cache.clear()
+                self._prompt_cache.add(key)
+        if cached_tokens < self._prompt_cache_min_tokens:
+            return 0
+        return cached_tokens - (cached_tokens - self._prompt_cache_min_tokens) % 128
+
+    def _usage(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        prompt_tokens = sum(
+            len(str(message.get("content", ""))) // 4 + 4
+            for message in request.get("messages", [])
+        )
+        completion_tokens = len(self._reply) // 4 + 1
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": self._cached_tokens(request)},
+        }
+
+    async def _handle_request(
+        self, request: Dict[str, Any], writer: asyncio.StreamWriter
+    ) -> None:
+        if self._latency > 0:
+            await asyncio.sleep(self._latency)
+        response = {
+            "id": f"chatcmpl-{uuid4().hex}",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+        }
+
+        if not request.get("stream"):
+            if self._tokens_per_second:
+                await asyncio.sleep(
+                    (len(self._reply) // 4 + 1) / self._tokens_per_second
+                )
+            body = json.dumps(
+                {
+                    **response,
+                    "object": "chat.completion",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": self._reply},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": self._usage(request),
+                }
+            ).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+            return
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+        )
+
+        async def send(data: Dict[str, Any] | str) -> None:
+            event = f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n"
+            writer.write(f"{len(event.encode()):x}\r\n{event}\r\n".encode())
+            await writer.drain()
+
+        chunk = {**response, "object": "chat.completion.chunk"}
+        words = self._reply.split(" ")
+        for i, word in enumerate(words):
+            if self._tokens_per_second:
+                await asyncio.sleep((len(word) // 4 + 1) / self._tokens_per_second)
+            delta = {"content": word if i == len(words) - 1 else f"{word} "}
+            if i == 0:
+                delta["role"] = "assistant"
+            await send(
+                {
+                    **chunk,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+                }
+            )
+        await send(
+            {
+                **chunk,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+        )
+        if request.get("stream_options", {}).get("include_usage"):
+            await send({**chunk, "choices": [], "usage": self._usage(request)})
+        await send("[DONE]")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+async def serve(args: argparse.Namespace) -> None:
+    server = MockModelServer(
+        args.reply,
+        args.latency_ms / 1000,
+        args.tokens_per_second or None,
+        args.prompt_cache_min_tokens,
+    )
+    endpoint = await server.start(args.host, args.port)
+    print(f"Mock model server listening on {endpoint}")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock OpenAI model server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--reply", default="This is a mock reply.\nTERMINATE")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--tokens-per-second", type=float, default=0)
+    parser.add_argument("--prompt-cache-min-tokens", type=int, default=1024)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
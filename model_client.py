@@ -1,48 +1,541 @@
+import asyncio
 import logging
 import os
+import threading
+from typing import (
+    Any,
+    AsyncGenerator,
+    Callable,
+    Coroutine,
+    Dict,
+    List,
+    Literal,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
 
+import httpx
+from autogen_core import CancellationToken, Component
+from autogen_core.models import (
+    ChatCompletionClient,
+    CreateResult,
+    LLMMessage,
+    ModelCapabilities,  # type: ignore
+    ModelInfo,
+    RequestUsage,
+)
+from autogen_core.tools import Tool, ToolSchema
 from autogen_ext.models.openai import AzureOpenAIChatCompletionClient
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+from azure.core.credentials import TokenCredential
 from dotenv import load_dotenv
+from openai.types.chat import (
+    ChatCompletionChunk,
+    ChatCompletionMessageParam,
+    ChatCompletionToolParam,
+)
+from pydantic import BaseModel
+from typing_extensions import Self
+
+import metrics
+from credential import BackgroundTokenProvider, LocalCredential
+from mock_client import MockChatCompletionClient
+from response_cache import CachedChatCompletionClient, ResponseCache
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 SIMPLE_TASK_MODEL = "gpt-4.1-mini"
 REASONING_MODEL = "o4-mini"
-model_clients = {}
+# the fraction of the price of a prompt token saved when it's read from the prompt cache
+PROMPT_CACHE_DISCOUNT = float(os.getenv("PROMPT_CACHE_DISCOUNT", "0.75"))
+
 
-token_provider = get_bearer_token_provider(
-    DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default"
+def create_credential() -> TokenCredential:
+    """Create the credential selected by AZURE_CREDENTIAL ("default" or "local")."""
+    if os.getenv("AZURE_CREDENTIAL", "default") == "local":
+        return LocalCredential()
+
+    # imported lazily, azure.identity is slow to import and to initialize
+    from azure.identity import DefaultAzureCredential
+
+    return DefaultAzureCredential()
+
+
+token_provider = BackgroundTokenProvider(
+    create_credential, "https://cognitiveservices.azure.com/.default"
 )
 
 
-def create_model_client(model: str) -> AzureOpenAIChatCompletionClient:
-    """Create or retrieve a model client for the specified model."""
-    return AzureOpenAIChatCompletionClient(
-        azure_deployment=os.getenv(
-            f"AZURE_OPENAI_{''.join(c if c.isalnum() else '_' for c in model.upper())}_DEPLOYMENT",
-            model,
-        ),
-        model=model,
-        api_version=os.getenv("AZURE_OPENAI_APIVERSION", "2024-12-01-preview"),
-        azure_endpoint=os.getenv(
-            "AZURE_OPENAI_ENDPOINT", "https://your-endpoint.openai.azure.com"
-        ),
-        azure_ad_token_provider=token_provider,
-    )
-    global model_clients
-    if model not in model_clients:
-        model_clients[model] = AzureOpenAIChatCompletionClient(
-            azure_deployment=os.getenv(
-                f"AZURE_OPENAI_{''.join(c if c.isalnum() else '_' for c in model.upper())}_DEPLOYMENT",
-                model,
+def record_prompt_usage(usage: Any) -> None:
+    """Record the prompt tokens of a response and how many of them the provider read
+    from its prompt cache, from the usage of an OpenAI response as a model or a dict."""
+    if usage is None:
+        return
+    if isinstance(usage, BaseModel):
+        usage = usage.model_dump()
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    metrics.counter("llm.prompt_tokens").inc(prompt_tokens)
+    metrics.counter("llm.cached_prompt_tokens").inc(cached_tokens)
+    if prompt_tokens:
+        metrics.histogram("llm.prompt_cache_hit_ratio").observe(
+            cached_tokens / prompt_tokens
+        )
+
+
+def prompt_cache_stats() -> Dict[str, float]:
+    """Get the prompt cache hit rate over all requests, and the prompt tokens saved
+    assuming cached tokens are billed at a PROMPT_CACHE_DISCOUNT discount."""
+    prompt_tokens = metrics.counter("llm.prompt_tokens").value
+    cached_tokens = metrics.counter("llm.cached_prompt_tokens").value
+    return {
+        "prompt_tokens": prompt_tokens,
+        "cached_prompt_tokens": cached_tokens,
+        "hit_rate": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+        "saved_prompt_tokens": cached_tokens * PROMPT_CACHE_DISCOUNT,
+    }
+
+
+class UsageTrackingChatCompletionClient(AzureOpenAIChatCompletionClient):
+    """An Azure OpenAI client that records the prompt cache usage of streamed calls."""
+
+    async def _create_stream_chunks(
+        self,
+        tool_params: List[ChatCompletionToolParam],
+        oai_messages: List[ChatCompletionMessageParam],
+        create_args: Dict[str, Any],
+        cancellation_token: Optional[CancellationToken],
+    ) -> AsyncGenerator[ChatCompletionChunk, None]:
+        async for chunk in super()._create_stream_chunks(
+            tool_params, oai_messages, create_args, cancellation_token
+        ):
+            if chunk.usage is not None:
+                record_prompt_usage(chunk.usage)
+            yield chunk
+
+
+# (model, deployment, endpoint, api_version)
+ModelClientKey = Tuple[str, str, str, str]
+
+
+class DrainingByteStream(httpx.AsyncByteStream):
+    """A response stream that reads the rest of a finished event stream when closed.
+
+    The openai SDK closes a stream as soon as it sees its [DONE] event, before the end
+    of the response body is read, and httpcore drops connections closed with unread
+    bytes. Reading the remainder lets the connection go back to the pool. Streams
+    closed before [DONE], e.g. on cancellation, are closed without reading them.
+    """
+
+    def __init__(self, stream: httpx.AsyncByteStream, drain_timeout: float = 1) -> None:
+        self._stream = stream
+        self._iterator = aiter(stream)
+        self._drain_timeout = drain_timeout
+        self._tail = b""
+
+    async def __aiter__(self) -> AsyncGenerator[bytes, None]:
+        async for chunk in self._iterator:
+            # [DONE] may be split across chunks
+            self._tail = (self._tail + chunk)[-16:]
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            if self._tail.rstrip().endswith(b"[DONE]"):
+                async with asyncio.timeout(self._drain_timeout):
+                    async for _ in self._iterator:
+                        pass
+        except Exception as e:
+            logger.debug(f"Failed to read the rest of the event stream: {e}")
+        finally:
+            await self._stream.aclose()
+
+
+class DrainingTransport(httpx.AsyncBaseTransport):
+    """An httpx transport whose event stream responses are drained when closed."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport) -> None:
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self._transport.handle_async_request(request)
+        if response.headers.get("content-type", "").startswith("text/event-stream"):
+            assert isinstance(response.stream, httpx.AsyncByteStream)
+            return httpx.Response(
+                status_code=response.status_code,
+                headers=response.headers,
+                stream=DrainingByteStream(response.stream),
+                extensions=response.extensions,
+            )
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class ModelClientPoolStats(BaseModel):
+    clients_created: int = 0
+    requests: int = 0
+    connections_opened: int = 0
+
+    @property
+    def connections_reused(self) -> int:
+        return max(self.requests - self.connections_opened, 0)
+
+
+class ModelClientPool:
+    """A process-wide pool of Azure OpenAI clients sharing keep-alive connections.
+
+    Clients are keyed by (model, deployment, endpoint, api_version). httpx connection
+    pools are bound to the event loop that opened them and Streamlit runs every rerun
+    in a new event loop, so the clients live on an event loop of their own in a
+    daemon thread, and requests from any event loop are run there. Connections are
+    thus reused across reruns and sessions, streamed calls included.
+
+    Args:
+        max_connections (int): The maximum number of connections per client.
+        max_keepalive_connections (int): The maximum number of idle connections kept alive per client.
+        keepalive_expiry (float): Seconds an idle connection is kept alive.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 60,
+    ) -> None:
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._clients: Dict[ModelClientKey, UsageTrackingChatCompletionClient] = {}
+        self._stats: Dict[ModelClientKey, ModelClientPoolStats] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock = threading.Lock()
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """Get the event loop of the clients, starting its thread on first use."""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever,
+                    name="model-client-pool",
+                    daemon=True,
+                ).start()
+            return self._loop
+
+    def _create_http_client(self, key: ModelClientKey) -> httpx.AsyncClient:
+        stats = self._stats[key]
+
+        async def trace(event_name: str, info: Mapping[str, Any]) -> None:
+            if event_name == "connection.connect_tcp.complete":
+                stats.connections_opened += 1
+
+        async def on_request(request: httpx.Request) -> None:
+            stats.requests += 1
+            request.extensions["trace"] = trace
+
+        async def on_response(response: httpx.Response) -> None:
+            # the results of non-streamed calls don't carry the cached tokens, streamed
+            # calls are recorded from their last chunk
+            if (
+                response.is_success
+                and response.request.url.path.endswith("/chat/completions")
+                and response.headers.get("content-type", "").startswith(
+                    "application/json"
+                )
+            ):
+                await response.aread()
+                try:
+                    record_prompt_usage(response.json().get("usage"))
+                except (ValueError, AttributeError) as e:
+                    logger.warning(f"Failed to record the prompt usage: {e}")
+
+        return httpx.AsyncClient(
+            # limits go on the transport when one is given
+            transport=DrainingTransport(httpx.AsyncHTTPTransport(limits=self._limits)),
+            timeout=httpx.Timeout(600, connect=10),
+            event_hooks={"request": [on_request], "response": [on_response]},
+        )
+
+    def acquire(self, key: ModelClientKey) -> UsageTrackingChatCompletionClient:
+        """Get the client of a key, creating it if needed. Its requests must be run on
+        the event loop of the pool, through run and stream."""
+        with self._lock:
+            if key not in self._clients:
+                self._stats.setdefault(key, ModelClientPoolStats()).clients_created += 1
+                model, deployment, endpoint, api_version = key
+                self._clients[key] = UsageTrackingChatCompletionClient(
+                    azure_deployment=deployment,
+                    model=model,
+                    api_version=api_version,
+                    azure_endpoint=endpoint,
+                    azure_ad_token_provider=token_provider.get_token_async,
+                    http_client=self._create_http_client(key),
+                )
+            return self._clients[key]
+
+    async def run(
+        self,
+        coroutine: Coroutine[Any, Any, T],
+        cancellation_token: CancellationToken | None = None,
+    ) -> T:
+        """Run a coroutine on the event loop of the pool and wait for its result."""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._get_loop())
+        if cancellation_token is not None:
+            cancellation_token.add_callback(future.cancel)
+        try:
+            return await asyncio.wrap_future(future)
+        finally:
+            future.cancel()
+
+    async def stream(
+        self,
+        stream: Callable[[], AsyncGenerator[T, None]],
+        cancellation_token: CancellationToken | None = None,
+    ) -> AsyncGenerator[T, None]:
+        """Iterate a stream created on the event loop of the pool."""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue[Tuple[bool, Any]] = asyncio.Queue()
+
+        def deliver(done: bool, item: Any) -> None:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, (done, item))
+            except RuntimeError:
+                # the consumer's event loop is closed
+                pass
+
+        async def pump() -> None:
+            try:
+                async for item in stream():
+                    deliver(False, item)
+            except BaseException as e:
+                deliver(True, e)
+                raise
+            deliver(True, None)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self._get_loop())
+        if cancellation_token is not None:
+            cancellation_token.add_callback(future.cancel)
+        try:
+            while True:
+                done, item = await queue.get()
+                if done:
+                    if item is not None:
+                        raise item
+                    return
+                yield item
+        finally:
+            future.cancel()
+
+    async def close(self) -> None:
+        """Close all clients."""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            await self.run(client.close())
+
+    def stats(self) -> Dict[ModelClientKey, ModelClientPoolStats]:
+        """Get the client and connection reuse statistics of each key."""
+        with self._lock:
+            return {key: stats.model_copy() for key, stats in self._stats.items()}
+
+
+model_client_pool = ModelClientPool()
+
+
+class PooledChatCompletionClientConfig(BaseModel):
+    model: str
+    deployment: str
+    endpoint: str
+    api_version: str
+
+
+class PooledChatCompletionClient(
+    ChatCompletionClient, Component[PooledChatCompletionClientConfig]
+):
+    """A chat completion client that sends every request through the pooled client
+    of its key, so it can be shared by agents across Streamlit reruns.
+    Closing it is a no-op; the pool owns the underlying clients.
+
+    Args:
+        pool (ModelClientPool): The pool of the clients.
+        key (ModelClientKey): The (model, deployment, endpoint, api_version) of the client.
+    """
+
+    component_type = "model"
+    component_config_schema = PooledChatCompletionClientConfig
+    component_provider_override = "model_client.PooledChatCompletionClient"
+
+    def __init__(self, pool: ModelClientPool, key: ModelClientKey) -> None:
+        self._pool = pool
+        self._key = key
+        self._actual_usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+        self._total_usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+
+    @property
+    def model(self) -> str:
+        return self._key[0]
+
+    def _add_usage(self, usage: RequestUsage) -> None:
+        self._actual_usage = RequestUsage(
+            prompt_tokens=self._actual_usage.prompt_tokens + usage.prompt_tokens,
+            completion_tokens=self._actual_usage.completion_tokens
+            + usage.completion_tokens,
+        )
+        self._total_usage = RequestUsage(
+            prompt_tokens=self._total_usage.prompt_tokens + usage.prompt_tokens,
+            completion_tokens=self._total_usage.completion_tokens
+            + usage.completion_tokens,
+        )
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Tool | Literal["auto", "required", "none"] = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        # the cancellation token is linked here, it can't cancel the pool's futures
+        result = await self._pool.run(
+            self._pool.acquire(self._key).create(
+                messages,
+                tools=tools,
+                tool_choice=tool_choice,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
             ),
+            cancellation_token,
+        )
+        self._add_usage(result.usage)
+        return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Tool | Literal["auto", "required", "none"] = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[str | CreateResult, None]:
+        # streamed responses only report their usage when asked to
+        if "stream_options" not in extra_create_args:
+            extra_create_args = {
+                **extra_create_args,
+                "stream_options": {"include_usage": True},
+            }
+        async for chunk in self._pool.stream(
+            lambda: self._pool.acquire(self._key).create_stream(
+                messages,
+                tools=tools,
+                tool_choice=tool_choice,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+            ),
+            cancellation_token,
+        ):
+            if isinstance(chunk, CreateResult):
+                self._add_usage(chunk.usage)
+            yield chunk
+
+    async def close(self) -> None:
+        pass
+
+    def actual_usage(self) -> RequestUsage:
+        return self._actual_usage
+
+    def total_usage(self) -> RequestUsage:
+        return self._total_usage
+
+    def count_tokens(
+        self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []
+    ) -> int:
+        return self._pool.acquire(self._key).count_tokens(messages, tools=tools)
+
+    def remaining_tokens(
+        self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []
+    ) -> int:
+        return self._pool.acquire(self._key).remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> ModelCapabilities:  # type: ignore
+        return self._pool.acquire(self._key).capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._pool.acquire(self._key).model_info
+
+    def _to_config(self) -> PooledChatCompletionClientConfig:
+        model, deployment, endpoint, api_version = self._key
+        return PooledChatCompletionClientConfig(
             model=model,
-            api_version=os.getenv("AZURE_OPENAI_APIVERSION", "2024-12-01-preview"),
-            azure_endpoint=os.getenv(
-                "AZURE_OPENAI_ENDPOINT", "https://your-endpoint.openai.azure.com"
+            deployment=deployment,
+            endpoint=endpoint,
+            api_version=api_version,
+        )
+
+    @classmethod
+    def _from_config(cls, config: PooledChatCompletionClientConfig) -> Self:
+        return cls(
+            model_client_pool,
+            (config.model, config.deployment, config.endpoint, config.api_version),
+        )
+
+
+response_cache = ResponseCache(
+    os.getenv(
+        "RESPONSE_CACHE_DIRECTORY",
+        os.path.join(os.getenv("STORAGE_DIRECTORY", "temp"), "response_cache"),
+    ),
+    max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_MB", "256")) * 1024 * 1024,
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400")),
+)
+
+
+def create_model_client(model: str, cache: bool = False) -> ChatCompletionClient:
+    """Create a model client for the specified model backed by the shared client pool.
+
+    With cache set, byte-identical requests are answered from the response cache;
+    only enable it where a previous reply to the same request may be reused.
+    With MODEL_CLIENT=mock, a local mock client is used instead of Azure OpenAI.
+    """
+    client: ChatCompletionClient
+    if os.getenv("MODEL_CLIENT", "azure") == "mock":
+        client = MockChatCompletionClient(
+            latency=float(os.getenv("MOCK_LATENCY_MS", "0")) / 1000,
+            tokens_per_second=float(os.getenv("MOCK_TOKENS_PER_SECOND", "0")) or None,
+        )
+    else:
+        # acquire the first token before the client is used
+        token_provider.prefetch()
+        client = PooledChatCompletionClient(
+            model_client_pool,
+            (
+                model,
+                os.getenv(
+                    f"AZURE_OPENAI_{''.join(c if c.isalnum() else '_' for c in model.upper())}_DEPLOYMENT",
+                    model,
+                ),
+                os.getenv(
+                    "AZURE_OPENAI_ENDPOINT", "https://your-endpoint.openai.azure.com"
+                ),
+                os.getenv("AZURE_OPENAI_APIVERSION", "2024-12-01-preview"),
             ),
-            azure_ad_token_provider=token_provider,
         )
-    return model_clients[model]
+    if cache and os.getenv("RESPONSE_CACHE", "true").lower() == "true":
+        # keyed by the model of the client, so mock replies never answer real requests
+        return CachedChatCompletionClient(client, response_cache, client.model)
+    return client
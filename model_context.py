@@ -1,5 +1,8 @@
+import asyncio
+import hashlib
 import logging
-from typing import List, Tuple
+import time
+from typing import Any, Callable, Dict, List, Literal, Mapping, Tuple
 
 from autogen_core import Component, ComponentModel, FunctionCall
 from autogen_core.model_context import ChatCompletionContext
@@ -14,10 +17,20 @@ from autogen_core.models import (
 from pydantic import BaseModel
 from typing_extensions import Self
 
-from prompts import CONVERSATION_ARCHIVE_PROMPT
+import metrics
+from prompts import ARCHIVE_MERGE_PROMPT, CONVERSATION_ARCHIVE_PROMPT
+from schema import ArchiveState
+from summary_cache import SummaryCache
 
 logger = logging.getLogger(__name__)
 
+# the number of partial summaries merged by one request in the hierarchical strategy
+ARCHIVE_MERGE_FANOUT = 8
+# the context window assumed when the budget model client can't tell its own
+DEFAULT_CONTEXT_WINDOW_TOKENS = 128000
+# whether counting tokens has failed, so the failure is only warned about once
+_token_count_failed = False
+
 
 class ArchiveChatCompletionContextConfig(BaseModel):
     min_messages: int
@@ -25,6 +38,14 @@ class ArchiveChatCompletionContextConfig(BaseModel):
     model_client: ComponentModel
     archive_prompt: str
     initial_messages: List[LLMMessage] | None = None
+    archive_state: ArchiveState | None = None
+    archive_mode: Literal["inline", "background"] = "inline"
+    hard_max_messages: int | None = None
+    token_budget_ratio: float | None = None
+    budget_model_client: ComponentModel | None = None
+    archive_strategy: Literal["sequential", "hierarchical"] = "sequential"
+    max_concurrency: int = 8
+    merge_prompt: str = ARCHIVE_MERGE_PROMPT
 
 
 class ArchiveChatCompletionContext(
@@ -34,12 +55,51 @@ class ArchiveChatCompletionContext(
     When the number of messages reaches max_messages, it uses a model and archive prompt to
     summarize and archive the oldest messages (except the last min_messages).
 
+    In the "background" archive mode, archiving starts in a background task as soon as a
+    new message exceeds max_messages, and get_messages returns the current messages without
+    waiting for it, unless they exceed hard_max_messages.
+
+    With token_budget_ratio set, archiving is decided by token mass instead of message
+    counts: once the context messages exceed that fraction of the budget model's context
+    window, the oldest messages are archived until they fit in half of the budget (keeping
+    at least min_messages). In the background mode, the hard limit is twice the budget.
+
+    The "sequential" archive strategy folds old messages into the summary one block of
+    (max_messages - min_messages) messages at a time. When a long history is added at once,
+    e.g. on resume or fork, the "hierarchical" strategy instead summarizes all its blocks
+    concurrently and merges the partial summaries level by level, caching the summary of
+    every block and merge.
+
+    Summaries are cached by the rolling fingerprint of the archived message prefix, so
+    contexts sharing a summary_cache, like the participants of a group chat or forks of a
+    conversation, summarize an identical prefix only once.
+
     Args:
         min_messages (int): The minimum number of messages to keep.
         max_messages (int): The maximum number of messages before archiving.
         model_client (ChatCompletionClient): The model client to use for archiving.
         archive_prompt (str): The prompt to use for archiving messages.
         initial_messages (List[LLMMessage] | None): The initial messages.
+        archive_state (ArchiveState | None): A previously saved archive state. It is
+            restored once the same archived messages have been added to the context.
+        on_archive (Callable[[ArchiveState], None] | None): Called with the new archive
+            state whenever messages are archived.
+        archive_mode (Literal["inline", "background"]): Whether get_messages archives
+            inline or archiving runs in the background.
+        hard_max_messages (int | None): The maximum number of messages returned without
+            waiting for archiving in the background mode. Defaults to twice max_messages.
+        token_budget_ratio (float | None): The fraction of the context window the context
+            messages may use. Enables the token budget policy.
+        budget_model_client (ChatCompletionClient | None): The model client whose tokenizer
+            and context window define the token budget. Defaults to model_client.
+        archive_strategy (Literal["sequential", "hierarchical"]): How a backlog of more than
+            one block of messages is archived.
+        max_concurrency (int): The maximum number of concurrent summarization requests of
+            the hierarchical strategy.
+        merge_prompt (str): The prompt merging partial summaries in the hierarchical strategy.
+        summary_cache (SummaryCache | None): The cache of summaries keyed by the archived
+            messages, prompts and model. Share one to summarize identical prefixes once,
+            defaults to a cache of this context.
     """
 
     component_config_schema = ArchiveChatCompletionContextConfig
@@ -54,12 +114,28 @@ class ArchiveChatCompletionContext(
         model_client: ChatCompletionClient,
         archive_prompt: str = CONVERSATION_ARCHIVE_PROMPT,
         initial_messages: List[LLMMessage] | None = None,
+        archive_state: ArchiveState | None = None,
+        on_archive: Callable[[ArchiveState], None] | None = None,
+        archive_mode: Literal["inline", "background"] = "inline",
+        hard_max_messages: int | None = None,
+        token_budget_ratio: float | None = None,
+        budget_model_client: ChatCompletionClient | None = None,
+        archive_strategy: Literal["sequential", "hierarchical"] = "sequential",
+        max_concurrency: int = 8,
+        merge_prompt: str = ARCHIVE_MERGE_PROMPT,
+        summary_cache: SummaryCache | None = None,
     ) -> None:
         super().__init__(initial_messages)
         if min_messages <= 0:
             raise ValueError("min_messages must be greater than 0.")
         if max_messages <= min_messages:
             raise ValueError("max_messages must be greater than min_messages.")
+        if hard_max_messages is not None and hard_max_messages < max_messages:
+            raise ValueError("hard_max_messages must not be less than max_messages.")
+        if token_budget_ratio is not None and not 0 < token_budget_ratio <= 1:
+            raise ValueError("token_budget_ratio must be in (0, 1].")
+        if max_concurrency <= 0:
+            raise ValueError("max_concurrency must be greater than 0.")
         self._min_messages = min_messages
         self._max_messages = max_messages
         self._max_archive_size = max_messages - min_messages
@@ -67,93 +143,458 @@ class ArchiveChatCompletionContext(
         self._archive_prompt = archive_prompt
         self._archived_index = -1
         self._archived_summary: str | None = None
+        self._archived_count = 0
+        self._archived_fingerprint = ""
+        self._on_archive = on_archive
+        self._archive_mode = archive_mode
+        self._hard_max_messages = hard_max_messages or 2 * max_messages
+        self._archive_task: asyncio.Task[None] | None = None
+        self._token_budget_ratio = token_budget_ratio
+        self._budget_model_client = budget_model_client
+        self._token_budget: int | None = None
+        self._summary_tokens = 0
+        self._archive_strategy = archive_strategy
+        self._max_concurrency = max_concurrency
+        self._merge_prompt = merge_prompt
+        self._summary_cache = summary_cache or SummaryCache()
+        self._summary_cache_parts = (
+            archive_prompt,
+            merge_prompt,
+            getattr(model_client, "model", type(model_client).__name__),
+        )
+
+        self._pending_archive_state = archive_state
+        self._track_messages()
+
+    def _track_messages(self) -> None:
+        """Rebuild the bookkeeping of the context window from all messages."""
+        # context messages with their index in _messages, and their token counts
+        self._context_entries: List[Tuple[LLMMessage, int]] = []
+        self._context_tokens: List[int] = []
+        # position in _context_entries of the first message that is not archived
+        self._window_start = 0
+        self._window_tokens = 0
+        # memory and function call related messages at the end, and their token count
+        self._trailing_messages: List[LLMMessage] = []
+        self._trailing_tokens = 0
+        # fingerprint of the context messages added so far, until the saved state is restored
+        self._seen_count = 0
+        self._seen_fingerprint = ""
+        for index in range(len(self._messages)):
+            self._track_message(index)
+            if index == self._archived_index:
+                self._window_start = len(self._context_entries)
+                self._window_tokens = 0
+
+    def _track_message(self, index: int) -> None:
+        """Update the bookkeeping of the context window with the message at index."""
+        message = self._messages[index]
+        if self._is_trailing_message(message):
+            self._trailing_messages.append(message)
+            if self._token_budget_ratio is not None:
+                self._trailing_tokens += self._count_tokens(message)
+        else:
+            self._trailing_messages = []
+            self._trailing_tokens = 0
+
+        if self._is_context_message(message):
+            self._context_entries.append((message, index))
+            if self._token_budget_ratio is not None:
+                tokens = self._count_tokens(message)
+                self._context_tokens.append(tokens)
+                self._window_tokens += tokens
+            self._restore_archive_state(index)
+
+    @staticmethod
+    def _is_context_message(message: LLMMessage) -> bool:
+        return isinstance(message, (UserMessage, AssistantMessage)) and isinstance(
+            message.content, str
+        )
+
+    @staticmethod
+    def _is_trailing_message(message: LLMMessage) -> bool:
+        return (
+            isinstance(message, SystemMessage)
+            or isinstance(message, FunctionExecutionResultMessage)
+            or (
+                isinstance(message, AssistantMessage)
+                and isinstance(message.content, list)
+                and all(isinstance(item, FunctionCall) for item in message.content)
+            )
+        )
+
+    @staticmethod
+    def _chain_fingerprint(fingerprint: str, message: LLMMessage) -> str:
+        """Extend a rolling fingerprint of context messages with one more message."""
+        # the message type is left out, so the same history seen by different
+        # participants (as UserMessage or AssistantMessage) has the same fingerprint
+        return hashlib.sha256(
+            f"{fingerprint}\0{getattr(message, 'source', '')}\0{message.content}".encode()
+        ).hexdigest()
+
+    def _restore_archive_state(self, index: int) -> None:
+        """Restore the saved archive state once the message at index completes its archived prefix."""
+        state = self._pending_archive_state
+        message = self._messages[index]
+        if state is None:
+            return
+        self._seen_count += 1
+        self._seen_fingerprint = self._chain_fingerprint(
+            self._seen_fingerprint, message
+        )
+        if self._seen_count < state.archived_count:
+            return
+
+        self._pending_archive_state = None
+        if self._archived_summary is not None:
+            return
+        if self._seen_fingerprint != state.fingerprint:
+            logger.info("Archived messages changed, discarding the saved archive state")
+            return
+        self._archived_index = index
+        self._set_archived_summary(state.summary)
+        self._archived_count = state.archived_count
+        self._archived_fingerprint = state.fingerprint
+        self._window_start = len(self._context_entries)
+        self._window_tokens = 0
+        logger.info(f"Restored archive state of {state.archived_count} messages")
+
+    def _set_archived_summary(self, summary: str) -> None:
+        self._archived_summary = summary
+        if self._token_budget_ratio is not None:
+            self._summary_tokens = self._count_tokens(SystemMessage(content=summary))
+
+    async def add_message(self, message: LLMMessage) -> None:
+        """Add a message to the context."""
+        await super().add_message(message)
+        self._track_message(len(self._messages) - 1)
+        if (
+            self._archive_mode == "background"
+            and self._get_archive_task() is None
+            and self._get_archive_size() > 0
+        ):
+            self._archive_task = asyncio.create_task(self._archive_old_messages())
+
+    def _get_archive_task(self) -> asyncio.Task[None] | None:
+        """Get the running background archive task of the current event loop."""
+        task = self._archive_task
+        if (
+            task is None
+            or task.done()
+            or task.get_loop() is not asyncio.get_running_loop()
+        ):
+            return None
+        return task
+
+    def get_archive_state(self) -> ArchiveState | None:
+        """Get the current archive state, if any messages have been archived."""
+        if self._archived_summary is None:
+            return None
+        return ArchiveState(
+            summary=self._archived_summary,
+            archived_count=self._archived_count,
+            fingerprint=self._archived_fingerprint,
+        )
 
     def _get_context_messages(self) -> List[Tuple[LLMMessage, int]]:
-        start_index = self._archived_index + 1 if self._archived_index >= 0 else 0
-        return [
-            (message, index + start_index)
-            for index, message in enumerate(self._messages[start_index:])
-            if isinstance(message, (UserMessage, AssistantMessage))
-            and isinstance(message.content, str)
-        ]
+        return self._context_entries[self._window_start :]
 
     async def get_messages(self) -> List[LLMMessage]:
         """Get messages, archiving old ones if necessary."""
-        await self._archive_old_messages()
+        if self._archive_mode == "inline":
+            await self._archive_old_messages()
+        elif self._get_archive_size(hard=True) > 0:
+            if task := self._get_archive_task():
+                await task
+            await self._archive_old_messages()
 
         # keep memory and function call related messages at the end
-        function_call_messages_at_the_end = []
-        for message in reversed(self._messages):
-            if (
-                isinstance(message, SystemMessage)
-                or isinstance(message, FunctionExecutionResultMessage)
-                or (
-                    isinstance(message, AssistantMessage)
-                    and isinstance(message.content, list)
-                    and all(isinstance(item, FunctionCall) for item in message.content)
-                )
-            ):
-                function_call_messages_at_the_end.insert(0, message)
-            else:
-                break
+        function_call_messages_at_the_end = list(self._trailing_messages)
 
         archive_messages = (
             [SystemMessage(content=self._archived_summary)]
             if self._archived_summary
             else []
         )
-        return (
+        messages = (
             archive_messages
             + [t[0] for t in self._get_context_messages()]
             + function_call_messages_at_the_end
         )
-        # messages = (
-        #     archive_messages
-        #     + [t[0] for t in self._get_context_messages()]
-        #     + function_call_messages_at_the_end
-        # )
-        # print("\n".join([f">>>>{m.model_dump_json()}" for m in messages]))
-        # return messages
+        if self._token_budget_ratio is not None:
+            tokens_sent = (
+                (self._summary_tokens if self._archived_summary else 0)
+                + self._window_tokens
+                + self._trailing_tokens
+            )
+            metrics.histogram("context.tokens_sent").observe(tokens_sent)
+            logger.debug(f"Sending {tokens_sent} context tokens")
+        return messages
+
+    def _count_tokens(self, message: LLMMessage) -> int:
+        """Count the tokens of a message. The counts of tracked messages are kept with
+        their entries, so every message is counted once."""
+        global _token_count_failed
+        client = self._budget_model_client or self._model_client
+        try:
+            return client.count_tokens([message])
+        except Exception as e:
+            if _token_count_failed:
+                logger.debug(f"Failed to count tokens, estimating instead: {e}")
+            else:
+                _token_count_failed = True
+                logger.warning(f"Failed to count tokens, estimating instead: {e}")
+            return len(str(message.content)) // 4 + 4
+
+    def _get_token_budget(self) -> int:
+        if self._token_budget is None:
+            client = self._budget_model_client or self._model_client
+            try:
+                context_window = client.remaining_tokens([])
+            except Exception as e:
+                logger.warning(
+                    f"Failed to get the context window, assuming "
+                    f"{DEFAULT_CONTEXT_WINDOW_TOKENS} tokens: {e}"
+                )
+                context_window = DEFAULT_CONTEXT_WINDOW_TOKENS
+            self._token_budget = int(context_window * (self._token_budget_ratio or 1))
+        return self._token_budget
+
+    def _get_archive_size(
+        self, hard: bool = False, offset: int = 0, window_tokens: int | None = None
+    ) -> int:
+        """Get the number of oldest context messages to archive, 0 if they are within limits.
+        offset and window_tokens describe the window after archiving its first offset messages.
+        """
+        window_start = self._window_start + offset
+        window_size = len(self._context_entries) - window_start
+        max_size = window_size - self._min_messages
+        if self._token_budget_ratio is None:
+            limit = self._hard_max_messages if hard else self._max_messages
+            if window_size <= limit:
+                return 0
+            return min(max_size, self._max_archive_size)
+
+        budget = self._get_token_budget()
+        total_tokens = self._window_tokens if window_tokens is None else window_tokens
+        if total_tokens <= (2 * budget if hard else budget):
+            return 0
+        # archive by token mass until the rest fits in half of the budget
+        archive_size = 0
+        while archive_size < max_size and total_tokens > budget // 2:
+            total_tokens -= self._context_tokens[window_start + archive_size]
+            archive_size += 1
+        return archive_size
+
+    def _get_backlog_size(self) -> int:
+        """Get the number of oldest context messages archived by repeated blocks."""
+        backlog_size = 0
+        window_tokens = self._window_tokens
+        while (
+            archive_size := self._get_archive_size(
+                offset=backlog_size, window_tokens=window_tokens
+            )
+        ) > 0:
+            if self._token_budget_ratio is not None:
+                start = self._window_start + backlog_size
+                window_tokens -= sum(self._context_tokens[start : start + archive_size])
+            backlog_size += archive_size
+        return backlog_size
 
     async def _archive_old_messages(self) -> None:
         """Archive old messages using the model client and archive prompt."""
-        while True:
-            # get latest context messages
-            context_messages = self._get_context_messages()
+        if (
+            self._archive_strategy == "hierarchical"
+            and self._get_backlog_size() > self._max_archive_size
+        ):
+            await self._archive_backlog()
+        # archive the rest, e.g. messages added while archiving the backlog
+        while await self._archive_next_block():
+            pass
 
-            # If we have not reached the max_messages limit, do nothing
-            if len(context_messages) <= self._max_messages:
-                return
+    async def _summarize(self, prompt: str) -> str | None:
+        """Request a summary with the model client, None if it failed."""
+        try:
+            response = await self._model_client.create([SystemMessage(content=prompt)])
+        except Exception as e:
+            logger.error(f"Failed to archive messages: {e}")
+            return None
+        if not response.content or not isinstance(response.content, str):
+            return None
+        return response.content
 
-            # prepare archive content
-            archive_size = min(
-                len(context_messages) - self._min_messages, self._max_archive_size
-            )
+    async def _summarize_cached(
+        self, key: str, prompt: str, semaphore: asyncio.Semaphore | None = None
+    ) -> str | None:
+        """Get the summary of a content key from the summary cache, requesting it if needed."""
 
-            messages_to_archive = context_messages[:archive_size]
-            archive_index = messages_to_archive[-1][1]
+        async def summarize() -> str | None:
+            if semaphore is None:
+                return await self._summarize(prompt)
+            async with semaphore:
+                return await self._summarize(prompt)
 
-            # archive the messages and update data
-            try:
-                response = await self._model_client.create(
-                    [
-                        SystemMessage(
-                            content=self._archive_prompt.format(
-                                last_summary=self._archived_summary or "",
-                                conversation=f"# Conversation to be archived\n\n{self._convert_messages_to_text([t[0] for t in messages_to_archive])}",
-                            )
-                        )
-                    ]
+        return await self._summary_cache.get_or_create(
+            SummaryCache.make_key(key, *self._summary_cache_parts), summarize
+        )
+
+    async def _archive_backlog(self) -> bool:
+        """Archive the whole backlog at once. Returns whether it was archived."""
+        start = time.perf_counter()
+        window_start = self._window_start
+        messages_to_archive = self._context_entries[
+            window_start : window_start + self._get_backlog_size()
+        ]
+        fingerprint = self._archived_fingerprint
+        for message, _ in messages_to_archive:
+            fingerprint = self._chain_fingerprint(fingerprint, message)
+
+        # the summary of the same prefix is shared with other participants and forks
+        summary = await self._summary_cache.get_or_create(
+            SummaryCache.make_key(f"prefix:{fingerprint}", *self._summary_cache_parts),
+            lambda: self._merge_backlog([t[0] for t in messages_to_archive]),
+        )
+        if summary is None or not self._commit_archive(
+            window_start, messages_to_archive, summary
+        ):
+            return False
+        metrics.histogram("context.archive_backlog_ms").observe(
+            (time.perf_counter() - start) * 1000
+        )
+        return True
+
+    async def _merge_backlog(self, messages: List[LLMMessage]) -> str | None:
+        """Summarize the blocks of a backlog concurrently and merge the partial
+        summaries level by level. Returns None if any request failed."""
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        # level 0: summarize the blocks of messages
+        keys = []
+        requests = []
+        for i in range(0, len(messages), self._max_archive_size):
+            block = messages[i : i + self._max_archive_size]
+            fingerprint = ""
+            for message in block:
+                fingerprint = self._chain_fingerprint(fingerprint, message)
+            keys.append(f"0:{fingerprint}")
+            requests.append(
+                self._archive_prompt.format(
+                    last_summary="",
+                    conversation=f"# Conversation to be archived\n\n{self._convert_messages_to_text(block)}",
+                )
+            )
+        summaries = await asyncio.gather(
+            *(
+                self._summarize_cached(key, request, semaphore)
+                for key, request in zip(keys, requests)
+            )
+        )
+        if self._archived_summary:
+            keys.insert(0, f"archived:{self._archived_fingerprint}")
+            summaries.insert(0, self._archived_summary)
+
+        # merge the partial summaries level by level
+        level = 0
+        while len(summaries) > 1 and all(s is not None for s in summaries):
+            level += 1
+            groups = [
+                (
+                    keys[i : i + ARCHIVE_MERGE_FANOUT],
+                    summaries[i : i + ARCHIVE_MERGE_FANOUT],
                 )
+                for i in range(0, len(summaries), ARCHIVE_MERGE_FANOUT)
+            ]
+            keys = [
+                f"{level}:" + hashlib.sha256("\0".join(group_keys).encode()).hexdigest()
+                for group_keys, _ in groups
+            ]
+            summaries = await asyncio.gather(
+                *(
+                    self._summarize_cached(
+                        key,
+                        self._merge_prompt.format(
+                            summaries="\n---\n".join(group_summaries)  # type: ignore[arg-type]
+                        ),
+                        semaphore,
+                    )
+                    for key, (_, group_summaries) in zip(keys, groups)
+                    if len(group_summaries) > 1
+                )
+            )
+            # a single summary left in the last group is carried over as is
+            if len(groups[-1][1]) == 1:
+                keys[-1] = groups[-1][0][0]
+                summaries.append(groups[-1][1][0])
 
-                if response.content and isinstance(response.content, str):
-                    # Update archived summary
-                    self._archived_summary = f"# Summary of previous archived conversation\n\n{response.content}"
-                    self._archived_index = archive_index
-                    logger.info(f"Archived {len(messages_to_archive)} messages")
+        if len(summaries) != 1:
+            return None
+        return summaries[0]
 
-            except Exception as e:
-                logger.error(f"Failed to archive messages: {e}")
+    async def _archive_next_block(self) -> bool:
+        """Archive the oldest block of context messages if they exceed the limits.
+        Returns whether a block was archived."""
+        # If we have not reached the limits, do nothing
+        archive_size = self._get_archive_size()
+        if archive_size <= 0:
+            return False
+
+        window_start = self._window_start
+        messages_to_archive = self._context_entries[
+            window_start : window_start + archive_size
+        ]
+
+        # archive the messages and update data
+        fingerprint = self._archived_fingerprint
+        for message, _ in messages_to_archive:
+            fingerprint = self._chain_fingerprint(fingerprint, message)
+        summary = await self._summarize_cached(
+            f"prefix:{fingerprint}",
+            self._archive_prompt.format(
+                last_summary=self._archived_summary or "",
+                conversation=f"# Conversation to be archived\n\n{self._convert_messages_to_text([t[0] for t in messages_to_archive])}",
+            ),
+        )
+        if summary is None:
+            return False
+        return self._commit_archive(window_start, messages_to_archive, summary)
+
+    def _commit_archive(
+        self,
+        window_start: int,
+        messages_to_archive: List[Tuple[LLMMessage, int]],
+        summary: str,
+    ) -> bool:
+        """Replace the archived summary, if the window still starts with the archived messages."""
+        archive_size = len(messages_to_archive)
+        archive_index = messages_to_archive[-1][1]
+        if (
+            self._window_start != window_start
+            or len(self._context_entries) < window_start + archive_size
+            or self._context_entries[window_start + archive_size - 1]
+            is not messages_to_archive[-1]
+        ):
+            # the archive state or the messages were replaced while summarizing
+            return False
+
+        # Update archived summary, without awaiting in between
+        self._set_archived_summary(
+            f"# Summary of previous archived conversation\n\n{summary}"
+        )
+        self._archived_index = archive_index
+        self._archived_count += len(messages_to_archive)
+        self._window_start += archive_size
+        if self._token_budget_ratio is not None:
+            self._window_tokens -= sum(
+                self._context_tokens[window_start : self._window_start]
+            )
+        for message, _ in messages_to_archive:
+            self._archived_fingerprint = self._chain_fingerprint(
+                self._archived_fingerprint, message
+            )
+        logger.info(f"Archived {len(messages_to_archive)} messages")
+        if self._on_archive:
+            self._on_archive(self.get_archive_state())  # type: ignore[arg-type]
+        return True
 
     def _convert_messages_to_text(self, messages: List[LLMMessage]) -> str:
         """Convert messages to text format for archiving."""
@@ -168,6 +609,37 @@ class ArchiveChatCompletionContext(
 
         return "\n".join(text_parts)
 
+    def _reset_archive(self) -> None:
+        self._archived_index = -1
+        self._archived_summary = None
+        self._archived_count = 0
+        self._archived_fingerprint = ""
+
+    async def clear(self) -> None:
+        await super().clear()
+        self._reset_archive()
+        self._track_messages()
+
+    async def save_state(self) -> Mapping[str, Any]:
+        """Save the messages together with the archive state."""
+        state = dict(await super().save_state())
+        if archive_state := self.get_archive_state():
+            state["archive_state"] = archive_state.model_dump()
+            state["archived_index"] = self._archived_index
+        return state
+
+    async def load_state(self, state: Mapping[str, Any]) -> None:
+        await super().load_state(state)
+        self._reset_archive()
+        if "archive_state" in state:
+            archive_state = ArchiveState.model_validate(state["archive_state"])
+            self._pending_archive_state = None
+            self._archived_index = state["archived_index"]
+            self._set_archived_summary(archive_state.summary)
+            self._archived_count = archive_state.archived_count
+            self._archived_fingerprint = archive_state.fingerprint
+        self._track_messages()
+
     def _to_config(self) -> ArchiveChatCompletionContextConfig:
         return ArchiveChatCompletionContextConfig(
             min_messages=self._min_messages,
@@ -175,6 +647,18 @@ class ArchiveChatCompletionContext(
             model_client=self._model_client.dump_component(),
             archive_prompt=self._archive_prompt,
             initial_messages=self._initial_messages,
+            archive_state=self.get_archive_state(),
+            archive_mode=self._archive_mode,
+            hard_max_messages=self._hard_max_messages,
+            token_budget_ratio=self._token_budget_ratio,
+            budget_model_client=(
+                self._budget_model_client.dump_component()
+                if self._budget_model_client
+                else None
+            ),
+            archive_strategy=self._archive_strategy,
+            max_concurrency=self._max_concurrency,
+            merge_prompt=self._merge_prompt,
         )
 
     @classmethod
@@ -186,4 +670,16 @@ class ArchiveChatCompletionContext(
             model_client=ChatCompletionClient.load_component(config.model_client),
             archive_prompt=config.archive_prompt,
             initial_messages=config.initial_messages,
+            archive_state=config.archive_state,
+            archive_mode=config.archive_mode,
+            hard_max_messages=config.hard_max_messages,
+            token_budget_ratio=config.token_budget_ratio,
+            budget_model_client=(
+                ChatCompletionClient.load_component(config.budget_model_client)
+                if config.budget_model_client
+                else None
+            ),
+            archive_strategy=config.archive_strategy,
+            max_concurrency=config.max_concurrency,
+            merge_prompt=config.merge_prompt,
         )
@@ -0,0 +1,185 @@
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from typing import Callable, Dict, Literal, Set
+
+import metrics
+from schema import Conversation
+
+logger = logging.getLogger(__name__)
+
+DurabilityMode = Literal["message", "interval", "turn"]
+
+
+class _ConversationWrites:
+    """The writes of one conversation: a lock serializing them, the number of flushes
+    using it, and the sequence numbers of the last snapshot taken and written."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.users = 0
+        self.taken = 0
+        self.written = 0
+
+
+class WriteBehindQueue:
+    """Coalesces conversation writes and flushes them off the streaming path.
+
+    Conversations are marked dirty after every new message. Depending on the
+    durability mode, dirty conversations are written immediately ("message"),
+    after a debounce interval ("interval"), or only when flushed explicitly at
+    the end of a turn ("turn"). Pending writes are always flushed at interpreter
+    shutdown.
+
+    A flush takes a snapshot of the conversation on the event loop that changes it,
+    and writes the snapshot in a worker thread. Snapshots are written in the order
+    they were taken, and a newer snapshot already written supersedes older ones.
+
+    Args:
+        prepare_write (Callable[[Conversation], Callable[[], None]]): Takes a snapshot
+            of a conversation and returns the blocking function that persists it.
+        durability (DurabilityMode): When dirty conversations are written.
+        flush_interval_ms (int): The debounce interval of the "interval" mode.
+    """
+
+    def __init__(
+        self,
+        prepare_write: Callable[[Conversation], Callable[[], None]],
+        durability: DurabilityMode = "interval",
+        flush_interval_ms: int = 500,
+    ) -> None:
+        if durability not in ("message", "interval", "turn"):
+            raise ValueError(f"Unknown durability mode: {durability}")
+        self._prepare_write = prepare_write
+        self._durability = durability
+        self._flush_interval = flush_interval_ms / 1000
+        self._dirty: Dict[str, Conversation] = {}
+        self._timers: Dict[
+            str, tuple[asyncio.AbstractEventLoop, asyncio.TimerHandle]
+        ] = {}
+        # only kept while a flush of the conversation is in progress
+        self._writes: Dict[str, _ConversationWrites] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+        atexit.register(self.flush_all_sync)
+
+    async def mark_dirty(self, conversation: Conversation) -> None:
+        """Schedule a conversation to be written according to the durability mode."""
+        conversation_id = conversation.conversation_id
+        with self._lock:
+            if conversation_id in self._dirty:
+                metrics.counter("conversation.coalesced_writes").inc()
+            self._dirty[conversation_id] = conversation
+
+        if self._durability == "message":
+            await self.flush(conversation_id)
+        elif self._durability == "interval":
+            loop = asyncio.get_running_loop()
+            timer = self._timers.get(conversation_id)
+            # a timer left behind by a closed event loop never fires
+            if timer is None or timer[0] is not loop:
+                self._timers[conversation_id] = (
+                    loop,
+                    loop.call_later(
+                        self._flush_interval,
+                        lambda: self._start_task(
+                            loop, self._flush_on_timer(conversation_id)
+                        ),
+                    ),
+                )
+
+    def _start_task(self, loop: asyncio.AbstractEventLoop, coroutine) -> None:
+        # the event loop only keeps weak references to its tasks
+        task = loop.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_on_timer(self, conversation_id: str) -> None:
+        self._timers.pop(conversation_id, None)
+        await self.flush(conversation_id)
+
+    def _cancel_timer(self, conversation_id: str) -> None:
+        timer = self._timers.pop(conversation_id, None)
+        if timer:
+            timer[1].cancel()
+
+    async def flush(self, conversation_id: str) -> None:
+        """Write a conversation now if it has pending changes, and wait for the writes
+        of it already in progress."""
+        self._cancel_timer(conversation_id)
+        writes, pending = self._take(conversation_id)
+        await asyncio.to_thread(self._flush_sync, conversation_id, writes, pending)
+
+    async def discard(self, conversation_id: str) -> None:
+        """Drop the pending changes of a conversation, e.g. before deleting it, and wait
+        for a write of it in progress, so it can't store the conversation again."""
+        self._cancel_timer(conversation_id)
+        with self._lock:
+            self._dirty.pop(conversation_id, None)
+            writes = self._use_writes(conversation_id)
+            # snapshots taken but not written yet are dropped
+            writes.written = writes.taken
+        await asyncio.to_thread(self._flush_sync, conversation_id, writes, None)
+
+    def _use_writes(self, conversation_id: str) -> _ConversationWrites:
+        writes = self._writes.setdefault(conversation_id, _ConversationWrites())
+        writes.users += 1
+        return writes
+
+    def _take(self, conversation_id: str) -> tuple[
+        _ConversationWrites,
+        tuple[int, Conversation, Callable[[], None]] | None,
+    ]:
+        """Take the pending changes of a conversation with a sequence number."""
+        with self._lock:
+            writes = self._use_writes(conversation_id)
+            conversation = self._dirty.pop(conversation_id, None)
+            if conversation is None:
+                return writes, None
+            writes.taken += 1
+            sequence = writes.taken
+        return writes, (sequence, conversation, self._prepare_write(conversation))
+
+    def _flush_sync(
+        self,
+        conversation_id: str,
+        writes: _ConversationWrites,
+        pending: tuple[int, Conversation, Callable[[], None]] | None,
+    ) -> None:
+        try:
+            # serialize writes of the same conversation, so the journal stays ordered
+            with writes.lock:
+                if pending is None or pending[0] <= writes.written:
+                    return
+                sequence, conversation, write = pending
+                start = time.perf_counter()
+                try:
+                    write()
+                except Exception as e:
+                    logger.error(f"Failed to write conversation {conversation_id}: {e}")
+                    with self._lock:
+                        self._dirty.setdefault(conversation_id, conversation)
+                    return
+                writes.written = sequence
+                metrics.histogram("conversation.flush_latency_ms").observe(
+                    (time.perf_counter() - start) * 1000
+                )
+                metrics.counter("conversation.flushes").inc()
+        finally:
+            with self._lock:
+                writes.users -= 1
+                if writes.users == 0 and self._writes.get(conversation_id) is writes:
+                    del self._writes[conversation_id]
+
+    def flush_all_sync(self) -> None:
+        """Write all pending conversations, blocking the calling thread."""
+        with self._lock:
+            conversation_ids = list(self._dirty)
+        for conversation_id in conversation_ids:
+            self._flush_sync(conversation_id, *self._take(conversation_id))
+
+    def get_metrics(self) -> Dict[str, Dict[str, float]]:
+        """Get the flush metrics of the conversation writes."""
+        return metrics.snapshot("conversation.")
@@ -17,6 +17,23 @@ After the summary, please provide 1-2 **follow-up questions or discussion points
 ---
 """
 
+ARCHIVE_MERGE_PROMPT = """
+The following are summaries of consecutive segments of a long conversation, from the oldest to the newest.
+
+Please merge them into a single summary of the whole conversation according to the following criteria:
+
+1.  **Core Points & Current State**: Keep the **main topics discussed, key information, conclusions and decisions**, and make sure the **current state or intermediate results of ongoing tasks** reflect the newest segments.
+2.  **Unresolved Matters/Future Directions**: Keep the **open questions and pending tasks** that are not resolved by later segments.
+3.  **Concise Format**: The summary should be **brief and to the point**, maintaining information density while avoiding redundancy.
+
+After the summary, please provide 1-2 **follow-up questions or discussion points** so we can continue the conversation based on the current state.
+
+
+---
+{summaries}
+---
+"""
+
 IDENTITY_MEMORY = """You are {name}.
 **You must only speak for yourself and never impersonate or respond on behalf of other agents or users.**
 Do not simulate, guess, or fabricate responses from others.
@@ -33,7 +50,8 @@ The stop reason can be:
 
 AGENT_MANAGER_PROMPT = """
 "You are an agent manager that can manage agent configs.
-You have multiple tools to get, create, and list agent configurations.
+You have multiple tools to get, create, list, and search agent configurations.
+Listing and search return one-line summaries a page at a time: prefer searching by keywords over listing every page, and get an agent by name or ID for its full configuration.
 When you receive a creation request, you will guide others to provide the necessary information. After all information is collected and confirmed, you should call tools to create the agent configuration, don't output the json format.
 
 A valid agent configuration for creation includes the following fields:
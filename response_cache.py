@@ -0,0 +1,282 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Dict, List, Literal, Mapping, Optional, Sequence
+
+from autogen_core import CancellationToken
+from autogen_core.models import (
+    ChatCompletionClient,
+    CreateResult,
+    LLMMessage,
+    ModelCapabilities,  # type: ignore
+    ModelInfo,
+    RequestUsage,
+)
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """A size-bounded, least recently used cache of model responses on disk.
+
+    Every response is a JSON file named by its key. The modification time of a file
+    is its last use, so the LRU order survives restarts; entries older than the TTL
+    (by creation time) are treated as misses and removed.
+
+    Args:
+        directory (str): The directory of the cache files.
+        max_bytes (int): The maximum total size of the cache files.
+        ttl (float): Seconds a response stays valid after it was cached.
+    """
+
+    def __init__(
+        self, directory: str, max_bytes: int = 256 * 1024 * 1024, ttl: float = 86400
+    ) -> None:
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # key -> file size, from the least to the most recently used
+        self._sizes: OrderedDict[str, int] = OrderedDict()
+        self._total_bytes = 0
+        if os.path.exists(directory):
+            entries = sorted(
+                (
+                    entry
+                    for entry in os.scandir(directory)
+                    if entry.name.endswith(".json")
+                ),
+                key=lambda entry: entry.stat().st_mtime,
+            )
+            for entry in entries:
+                size = entry.stat().st_size
+                self._sizes[entry.name[: -len(".json")]] = size
+                self._total_bytes += size
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self._directory, f"{key}.json")
+
+    def get(self, key: str) -> Dict[str, Any] | None:
+        """Get a cached entry, None if it is missing or expired."""
+        with self._lock:
+            if key not in self._sizes:
+                return None
+            filepath = self._get_path(key)
+            try:
+                with open(filepath, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except Exception as e:
+                logger.error(
+                    f"Failed to load cached response from {filepath}: {e}\n{traceback.format_exc()}"
+                )
+                self._remove(key)
+                return None
+            if time.time() - entry["created_at"] > self._ttl:
+                self._remove(key)
+                return None
+            self._sizes.move_to_end(key)
+            os.utime(filepath)
+            return entry
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        """Cache an entry, evicting the least recently used ones beyond max_bytes."""
+        data = json.dumps({**entry, "created_at": time.time()})
+        filepath = self._get_path(key)
+        with self._lock:
+            try:
+                os.makedirs(self._directory, exist_ok=True)
+                with open(filepath, "w", encoding="utf-8") as f:
+                    f.write(data)
+            except Exception as e:
+                logger.error(
+                    f"Failed to save cached response to {filepath}: {e}\n{traceback.format_exc()}"
+                )
+                return
+            self._total_bytes += len(data.encode()) - self._sizes.pop(key, 0)
+            self._sizes[key] = len(data.encode())
+            while self._total_bytes > self._max_bytes and len(self._sizes) > 1:
+                self._remove(next(iter(self._sizes)))
+
+    def _remove(self, key: str) -> None:
+        self._total_bytes -= self._sizes.pop(key, 0)
+        filepath = self._get_path(key)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+
+class CachedChatCompletionClient(ChatCompletionClient):
+    """A chat completion client that answers byte-identical requests from a response cache.
+
+    Requests are keyed by the model, the normalized messages and all request parameters.
+    Both create and create_stream are cached; a cached stream replays its chunks.
+    Only wrap clients of call sites whose replies may be reused, e.g. summaries.
+    The cache files are read and written in a worker thread.
+
+    Args:
+        client (ChatCompletionClient): The client sending the requests that miss the cache.
+        cache (ResponseCache): The cache of the responses.
+        model (str): The model name, part of the cache key.
+    """
+
+    def __init__(
+        self, client: ChatCompletionClient, cache: ResponseCache, model: str
+    ) -> None:
+        self._client = client
+        self._cache = cache
+        self._model = model
+
+    @property
+    def model(self) -> str:
+        return self._model
+
+    def _get_key(
+        self,
+        messages: Sequence[LLMMessage],
+        tools: Sequence[Tool | ToolSchema],
+        tool_choice: Tool | Literal["auto", "required", "none"],
+        json_output: Optional[bool | type[BaseModel]],
+        extra_create_args: Mapping[str, Any],
+    ) -> str:
+        data = {
+            "model": self._model,
+            "messages": [message.model_dump(mode="json") for message in messages],
+            "tools": [
+                tool.schema if isinstance(tool, Tool) else tool for tool in tools
+            ],
+            "tool_choice": (
+                tool_choice.name if isinstance(tool_choice, Tool) else tool_choice
+            ),
+            "json_output": (
+                json_output.model_json_schema()
+                if isinstance(json_output, type)
+                else json_output
+            ),
+            "extra_create_args": extra_create_args,
+        }
+        return hashlib.sha256(
+            json.dumps(data, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def _record_hit(self, entry: Dict[str, Any], result: CreateResult) -> None:
+        metrics.counter("response_cache.hits").inc()
+        metrics.counter("response_cache.bytes_saved").inc(len(json.dumps(entry)))
+        metrics.counter("response_cache.tokens_saved").inc(
+            result.usage.prompt_tokens + result.usage.completion_tokens
+        )
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Tool | Literal["auto", "required", "none"] = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        key = self._get_key(
+            messages, tools, tool_choice, json_output, extra_create_args
+        )
+        entry = await asyncio.to_thread(self._cache.get, key)
+        if entry is not None:
+            result = CreateResult.model_validate({**entry["result"], "cached": True})
+            self._record_hit(entry, result)
+            return result
+
+        metrics.counter("response_cache.misses").inc()
+        result = await self._client.create(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        )
+        await asyncio.to_thread(
+            self._cache.put, key, {"result": result.model_dump(mode="json")}
+        )
+        return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Tool | Literal["auto", "required", "none"] = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[str | CreateResult, None]:
+        key = self._get_key(
+            messages, tools, tool_choice, json_output, extra_create_args
+        )
+        entry = await asyncio.to_thread(self._cache.get, key)
+        if entry is not None:
+            result = CreateResult.model_validate({**entry["result"], "cached": True})
+            self._record_hit(entry, result)
+            for chunk in entry.get("chunks", []):
+                yield chunk
+            yield result
+            return
+
+        metrics.counter("response_cache.misses").inc()
+        chunks: List[str] = []
+        async for chunk in self._client.create_stream(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        ):
+            if isinstance(chunk, CreateResult):
+                # only complete streams are cached
+                await asyncio.to_thread(
+                    self._cache.put,
+                    key,
+                    {"chunks": chunks, "result": chunk.model_dump(mode="json")},
+                )
+            else:
+                chunks.append(chunk)
+            yield chunk
+
+    async def close(self) -> None:
+        await self._client.close()
+
+    def actual_usage(self) -> RequestUsage:
+        return self._client.actual_usage()
+
+    def total_usage(self) -> RequestUsage:
+        return self._client.total_usage()
+
+    def count_tokens(
+        self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []
+    ) -> int:
+        return self._client.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(
+        self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []
+    ) -> int:
+        return self._client.remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> ModelCapabilities:  # type: ignore
+        return self._client.capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._client.model_info
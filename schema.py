@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Literal, Self
+from typing import Dict, List, Literal, Self
 from uuid import uuid4
 
 from autogen_agentchat.base import ChatAgent, Team
@@ -70,15 +70,35 @@ class Message(BaseModel):
         )
 
 
+class MessageChunk(BaseModel):
+    """A piece of a message still being generated, streamed before the message."""
+
+    source: str
+    content: str
+
+
+class ArchiveState(BaseModel):
+    summary: str
+    archived_count: int
+    fingerprint: str
+
+
 class Conversation(BaseModel):
     conversation_id: str = Field(default_factory=lambda: uuid4().hex)
     created_at: str = Field(default_factory=lambda: datetime.now().isoformat())
     updated_at: str = Field(default_factory=lambda: datetime.now().isoformat())
     agents: List[AgentConfig]
     messages: List[Message] = []
+    archive_states: Dict[str, ArchiveState] = {}
+    # a fork shares the first prefix_length messages of its parent, and only stores the rest
+    parent_id: str | None = None
+    prefix_length: int = 0
 
     chat_instance: ChatAgent | Team | None = Field(default=None, exclude=True)
     cancellation_token: CancellationToken | None = Field(default=None, exclude=True)
+    synced_message_count: int = Field(default=0, exclude=True)
+    # whether the chat instance has seen the messages, or they must be sent with the next task
+    history_synced: bool = Field(default=True, exclude=True)
 
     model_config = {
         "arbitrary_types_allowed": True,
@@ -89,3 +109,15 @@ class Conversation(BaseModel):
 
     def clear_messages(self):
         self.messages = []
+        self.archive_states = {}
+
+    def set_archive_state(self, agent_id: str, archive_state: ArchiveState):
+        self.archive_states[agent_id] = archive_state
+
+
+class ConversationHeader(BaseModel):
+    conversation_id: str
+    created_at: str
+    updated_at: str
+    agent_ids: List[str] = []
+    summary: str = ""
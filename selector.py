@@ -0,0 +1,81 @@
+import logging
+import re
+from typing import List, Sequence
+
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MENTION_PATTERN = re.compile(r"@([A-Za-z_][A-Za-z0-9_]*)")
+TERMINATE_PATTERN = re.compile(r"\bTERMINATE\b")
+
+
+def get_last_chat_message(
+    thread: Sequence[BaseAgentEvent | BaseChatMessage],
+) -> BaseChatMessage | None:
+    for message in reversed(thread):
+        if isinstance(message, BaseChatMessage):
+            return message
+    return None
+
+
+def parse_trailing_mentions(text: str) -> List[str]:
+    """Get the distinct names @mentioned on the last line of a message, ignoring TERMINATE."""
+    lines = [
+        line.strip()
+        for line in TERMINATE_PATTERN.sub("", text).splitlines()
+        if line.strip()
+    ]
+    if not lines:
+        return []
+    return list(dict.fromkeys(MENTION_PATTERN.findall(lines[-1])))
+
+
+class MentionSelector:
+    """Selects the next speaker of a group chat from the @mention that ends the last
+    message, as NEXT_SPEAKER_INSTRUCTION asks every agent to do.
+
+    select is the selector_func of a SelectorGroupChat: it returns None when the last
+    message mentions no participant, several participants or its own speaker, so the
+    model selector decides. candidates is the candidate_func pruning the participants
+    the model selector chooses from to those mentioned in the last message.
+
+    Args:
+        participant_names (List[str]): The names of the participants.
+    """
+
+    def __init__(self, participant_names: List[str]) -> None:
+        self._names = {name.lower(): name for name in participant_names}
+
+    def _resolve(self, mentions: List[str], speaker: str) -> List[str]:
+        names = [self._names[m.lower()] for m in mentions if m.lower() in self._names]
+        return [name for name in dict.fromkeys(names) if name != speaker]
+
+    def select(self, thread: Sequence[BaseAgentEvent | BaseChatMessage]) -> str | None:
+        message = get_last_chat_message(thread)
+        if message is not None:
+            names = self._resolve(
+                parse_trailing_mentions(message.to_text()), message.source
+            )
+            if len(names) == 1:
+                metrics.counter("selector.mention_hits").inc()
+                return names[0]
+        metrics.counter("selector.fallbacks").inc()
+        return None
+
+    def candidates(
+        self, thread: Sequence[BaseAgentEvent | BaseChatMessage]
+    ) -> List[str]:
+        message = get_last_chat_message(thread)
+        speaker = message.source if message is not None else ""
+        if message is not None:
+            mentioned = self._resolve(
+                MENTION_PATTERN.findall(message.to_text()), speaker
+            )
+            if mentioned:
+                return mentioned
+        # like the default selector, don't select the previous speaker again
+        others = [name for name in self._names.values() if name != speaker]
+        return others or list(self._names.values())
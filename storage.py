@@ -1,9 +1,17 @@
 import json
 import logging
 import os
+import sqlite3
+import threading
 import traceback
 from abc import ABC, abstractmethod
-from typing import Any
+from typing import Any, Callable, Literal
+from uuid import uuid4
+
+try:
+    import redis
+except ImportError:
+    redis = None
 
 logger = logging.getLogger(__name__)
 
@@ -48,6 +56,22 @@ class Storage(ABC):
         """
         ...
 
+    def append(self, key: str, data: dict, field: str, items: list, start: int) -> None:
+        """
+        Update the fields of data and replace the list field from start with items.
+        """
+        current = self.load(key) or {}
+        current.update(data)
+        current[field] = current.get(field, [])[:start] + items
+        self.save(key, current)
+
+    def save_many(self, items: dict[str, Any]) -> None:
+        """
+        Save multiple key-data pairs to the storage system.
+        """
+        for key, data in items.items():
+            self.save(key, data)
+
 
 class InMemoryStorage(Storage):
     """
@@ -86,6 +110,10 @@ class JsonFileStorage(Storage):
     def __init__(self, directory: str):
         self._directory = directory
 
+    @property
+    def directory(self) -> str:
+        return self._directory
+
     def _get_path(self, key: str) -> str:
         return os.path.join(self._directory, f"{key}.json")
 
@@ -93,8 +121,11 @@ class JsonFileStorage(Storage):
         filepath = self._get_path(key)
         try:
             os.makedirs(os.path.dirname(filepath), exist_ok=True)
-            with open(filepath, "w", encoding="utf-8") as f:
+            # replace the file at once, so readers never see a partial write
+            temp_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
                 json.dump(data, f)
+            os.replace(temp_path, filepath)
         except Exception as e:
             logger.error(
                 f"Failed to save data to {filepath}: {e}\n{traceback.format_exc()}"
@@ -130,3 +161,714 @@ class JsonFileStorage(Storage):
             for f in os.listdir(self._directory)
             if f.endswith(".json") and (filter is None or f.startswith(filter))
         ]
+
+
+class JournalFileStorage(JsonFileStorage):
+    """
+    File-based storage that appends list items to a JSON Lines journal next to
+    the snapshot file, and compacts the journal into the snapshot once it grows
+    as large as the snapshot itself.
+    """
+
+    def __init__(self, directory: str, min_compact_size: int = 1024 * 1024):
+        super().__init__(directory)
+        self._min_compact_size = min_compact_size
+        self._headers: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _get_journal_path(self, key: str) -> str:
+        return os.path.join(self._directory, f"{key}.jsonl")
+
+    def _write_snapshot(self, key: str, data) -> None:
+        filepath = self._get_path(key)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(f"{filepath}.tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(f"{filepath}.tmp", filepath)
+        journal_path = self._get_journal_path(key)
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
+
+    def _load_journal(self, key: str, data: dict) -> dict:
+        journal_path = self._get_journal_path(key)
+        if not os.path.exists(journal_path):
+            return data
+        with open(journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # a torn write, the records after it start on a new line
+                    logger.warning(f"Skipping corrupted record in {journal_path}")
+                    continue
+                data.update(record["data"])
+                items = data.setdefault(record["field"], [])
+                del items[record["start"] :]
+                items.extend(record["items"])
+        return data
+
+    def save(self, key: str, data) -> None:
+        with self._lock:
+            try:
+                self._write_snapshot(key, data)
+                self._headers.pop(key, None)
+            except Exception as e:
+                logger.error(
+                    f"Failed to save data for {key}: {e}\n{traceback.format_exc()}"
+                )
+
+    def load(self, key: str):
+        with self._lock:
+            if not self.exists(key):
+                return None
+            try:
+                return self._load_journal(key, super().load(key) or {})
+            except Exception as e:
+                logger.error(
+                    f"Failed to load data for {key}: {e}\n{traceback.format_exc()}"
+                )
+                return None
+
+    def append(self, key: str, data: dict, field: str, items: list, start: int) -> None:
+        with self._lock:
+            journal_path = self._get_journal_path(key)
+            try:
+                # only write the header fields that changed since the last record
+                header = self._headers.get(key, {})
+                record = {
+                    "data": {k: v for k, v in data.items() if header.get(k) != v},
+                    "field": field,
+                    "start": start,
+                    "items": items,
+                }
+                os.makedirs(self._directory, exist_ok=True)
+                # a torn last line must not swallow the record written after it
+                separator = "" if self._ends_with_newline(journal_path) else "\n"
+                with open(journal_path, "a", encoding="utf-8") as f:
+                    f.write(separator + json.dumps(record) + "\n")
+                self._headers[key] = {**header, **data}
+
+                snapshot_path = self._get_path(key)
+                snapshot_size = (
+                    os.path.getsize(snapshot_path)
+                    if os.path.exists(snapshot_path)
+                    else 0
+                )
+                if os.path.getsize(journal_path) >= max(
+                    snapshot_size, self._min_compact_size
+                ):
+                    self._compact(key)
+            except Exception as e:
+                logger.error(
+                    f"Failed to append data to {journal_path}: {e}\n{traceback.format_exc()}"
+                )
+
+    @staticmethod
+    def _ends_with_newline(path: str) -> bool:
+        """Check that a file is missing, empty or ends with a complete line."""
+        try:
+            with open(path, "rb") as f:
+                if f.seek(0, os.SEEK_END) == 0:
+                    return True
+                f.seek(-1, os.SEEK_END)
+                return f.read(1) == b"\n"
+        except FileNotFoundError:
+            return True
+
+    def _compact(self, key: str) -> None:
+        """Fold the journal into a new snapshot."""
+        data = self._load_journal(key, JsonFileStorage.load(self, key) or {})
+        self._write_snapshot(key, data)
+        logger.info(f"Compacted journal of {key}")
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            super().delete(key)
+            journal_path = self._get_journal_path(key)
+            if os.path.exists(journal_path):
+                os.remove(journal_path)
+            self._headers.pop(key, None)
+
+    def exists(self, key: str) -> bool:
+        return super().exists(key) or os.path.exists(self._get_journal_path(key))
+
+    def list(self, filter: str | None = None) -> list:
+        if not os.path.exists(self._directory):
+            return []
+        keys = {
+            f.rsplit(".", 1)[0]
+            for f in os.listdir(self._directory)
+            if (f.endswith(".json") or f.endswith(".jsonl"))
+            and (filter is None or f.startswith(filter))
+        }
+        return [self.load(key) for key in keys]
+
+
+class JsonLinesStorage(Storage):
+    """
+    Single-file storage that keeps all records in memory and persists them to
+    an append-only JSON Lines file. The file is compacted once it holds more
+    stale records than live ones, and reloaded when another process changes it.
+    """
+
+    def __init__(self, filepath: str, min_compact_lines: int = 64):
+        self._filepath = filepath
+        self._min_compact_lines = min_compact_lines
+        self._records: dict[str, Any] = {}
+        self._line_count = 0
+        # the size and modification time of the file when it was last read or written
+        self._file_stat: tuple[int, int] | None = None
+        # the number of times the file was reloaded after it was changed elsewhere
+        self._reload_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def filepath(self) -> str:
+        return self._filepath
+
+    def get_reload_count(self) -> int:
+        """Get the number of times the records were reloaded because the file was
+        changed outside this storage, checking the file first. It stays the same
+        while the file only changes through this storage."""
+        with self._lock:
+            self._refresh()
+            return self._reload_count
+
+    def _get_file_stat(self) -> tuple[int, int]:
+        try:
+            stat = os.stat(self._filepath)
+        except FileNotFoundError:
+            return (0, 0)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def _refresh(self) -> None:
+        # a compaction by another process can leave the file at the same size
+        file_stat = self._get_file_stat()
+        if file_stat == self._file_stat:
+            return
+        records: dict[str, Any] = {}
+        line_count = 0
+        if file_stat[0] > 0:
+            with open(self._filepath, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f"Skipping corrupted record in {self._filepath}")
+                        continue
+                    line_count += 1
+                    if record.get("deleted"):
+                        records.pop(record["key"], None)
+                    else:
+                        records[record["key"]] = record["data"]
+        self._records = records
+        self._line_count = line_count
+        self._file_stat = file_stat
+        self._reload_count += 1
+
+    def _write_lines(self, records: list[dict]) -> None:
+        os.makedirs(os.path.dirname(self._filepath) or ".", exist_ok=True)
+        with open(self._filepath, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+        self._line_count += len(records)
+        self._file_stat = self._get_file_stat()
+        if self._line_count > max(2 * len(self._records), self._min_compact_lines):
+            self._compact()
+
+    def _compact(self) -> None:
+        with open(f"{self._filepath}.tmp", "w", encoding="utf-8") as f:
+            for key, data in self._records.items():
+                f.write(json.dumps({"key": key, "data": data}) + "\n")
+        os.replace(f"{self._filepath}.tmp", self._filepath)
+        self._line_count = len(self._records)
+        self._file_stat = self._get_file_stat()
+
+    def save(self, key: str, data) -> None:
+        self.save_many({key: data})
+
+    def save_many(self, items: dict[str, Any]) -> None:
+        with self._lock:
+            try:
+                self._refresh()
+                self._records.update(items)
+                self._write_lines(
+                    [{"key": key, "data": data} for key, data in items.items()]
+                )
+            except Exception as e:
+                logger.error(
+                    f"Failed to save data to {self._filepath}: {e}\n{traceback.format_exc()}"
+                )
+
+    def load(self, key: str):
+        with self._lock:
+            self._refresh()
+            return self._records.get(key)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._refresh()
+            if key in self._records:
+                del self._records[key]
+                self._write_lines([{"key": key, "deleted": True}])
+
+    def exists(self, key: str) -> bool:
+        with self._lock:
+            self._refresh()
+            return key in self._records
+
+    def list(self, filter: str | None = None) -> list:
+        with self._lock:
+            self._refresh()
+            return [
+                value
+                for key, value in self._records.items()
+                if (filter is None or key.startswith(filter))
+            ]
+
+
+class SqliteStorage(Storage):
+    """
+    SQLite storage in WAL mode. Each namespace gets a table of records keyed by
+    primary key, so prefix listing is an indexed range scan. List items written
+    through append are stored as separate rows in a companion items table.
+    """
+
+    # the record field naming the list fields stored in the items table
+    LIST_FIELDS = "__lists__"
+
+    def __init__(self, filepath: str, namespace: str):
+        if not namespace.isidentifier():
+            raise ValueError(f"Invalid SQLite storage namespace: {namespace}")
+        self._filepath = filepath
+        self._table = namespace
+        self._items_table = f"{namespace}_items"
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._table} "
+                "(key TEXT PRIMARY KEY, data TEXT NOT NULL) WITHOUT ROWID"
+            )
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._items_table} "
+                "(key TEXT NOT NULL, field TEXT NOT NULL, position INTEGER NOT NULL, "
+                "data TEXT NOT NULL, PRIMARY KEY (key, field, position)) WITHOUT ROWID"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between the to_thread workers
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self._filepath) or ".", exist_ok=True)
+            conn = sqlite3.connect(self._filepath, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _key_range(self, filter: str | None) -> tuple[str, tuple]:
+        if not filter:
+            return "", ()
+        return "WHERE key >= ? AND key < ?", (filter, filter + "\U0010ffff")
+
+    def _load_items(
+        self, conn: sqlite3.Connection, where: str, params: tuple
+    ) -> dict[str, dict[str, list]]:
+        items: dict[str, dict[str, list]] = {}
+        for key, field, data in conn.execute(
+            f"SELECT key, field, data FROM {self._items_table} {where} "
+            "ORDER BY key, field, position",
+            params,
+        ):
+            items.setdefault(key, {}).setdefault(field, []).append(json.loads(data))
+        return items
+
+    def _merge_items(self, data: dict, items: dict[str, list]) -> dict:
+        """Put the items of a record back into its list fields, empty ones included."""
+        for field in data.pop(self.LIST_FIELDS, []):
+            data.setdefault(field, [])
+        data.update(items)
+        return data
+
+    def save(self, key: str, data) -> None:
+        self.save_many({key: data})
+
+    def save_many(self, items: dict[str, Any]) -> None:
+        try:
+            with self._connect() as conn:
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO {self._table} (key, data) VALUES (?, ?)",
+                    [(key, json.dumps(data)) for key, data in items.items()],
+                )
+                conn.executemany(
+                    f"DELETE FROM {self._items_table} WHERE key = ?",
+                    [(key,) for key in items],
+                )
+        except Exception as e:
+            logger.error(
+                f"Failed to save data to {self._filepath}: {e}\n{traceback.format_exc()}"
+            )
+
+    def append(self, key: str, data: dict, field: str, items: list, start: int) -> None:
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    f"SELECT data FROM {self._table} WHERE key = ?", (key,)
+                ).fetchone()
+                header = json.loads(row[0]) if row else {}
+                header.update({k: v for k, v in data.items() if k != field})
+                fields = header.setdefault(self.LIST_FIELDS, [])
+                if field not in fields:
+                    fields.append(field)
+                if field in header:
+                    # the list was saved inside the record: move it to the items table
+                    embedded = header.pop(field) or []
+                    conn.execute(
+                        f"DELETE FROM {self._items_table} WHERE key = ? AND field = ?",
+                        (key, field),
+                    )
+                    conn.executemany(
+                        f"INSERT INTO {self._items_table} (key, field, position, data) "
+                        "VALUES (?, ?, ?, ?)",
+                        [
+                            (key, field, i, json.dumps(item))
+                            for i, item in enumerate(embedded[:start])
+                        ],
+                    )
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {self._table} (key, data) VALUES (?, ?)",
+                    (key, json.dumps(header)),
+                )
+                conn.execute(
+                    f"DELETE FROM {self._items_table} "
+                    "WHERE key = ? AND field = ? AND position >= ?",
+                    (key, field, start),
+                )
+                conn.executemany(
+                    f"INSERT INTO {self._items_table} (key, field, position, data) "
+                    "VALUES (?, ?, ?, ?)",
+                    [
+                        (key, field, start + i, json.dumps(item))
+                        for i, item in enumerate(items)
+                    ],
+                )
+        except Exception as e:
+            logger.error(
+                f"Failed to append data to {self._filepath}: {e}\n{traceback.format_exc()}"
+            )
+
+    def load(self, key: str):
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                f"SELECT data FROM {self._table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            return self._merge_items(
+                json.loads(row[0]),
+                self._load_items(conn, "WHERE key = ?", (key,)).get(key, {}),
+            )
+        except Exception as e:
+            logger.error(
+                f"Failed to load data from {self._filepath}: {e}\n{traceback.format_exc()}"
+            )
+            return None
+
+    def delete(self, key: str) -> None:
+        try:
+            with self._connect() as conn:
+                conn.execute(f"DELETE FROM {self._table} WHERE key = ?", (key,))
+                conn.execute(f"DELETE FROM {self._items_table} WHERE key = ?", (key,))
+        except Exception as e:
+            logger.error(
+                f"Failed to delete data from {self._filepath}: {e}\n{traceback.format_exc()}"
+            )
+
+    def exists(self, key: str) -> bool:
+        try:
+            return (
+                self._connect()
+                .execute(f"SELECT 1 FROM {self._table} WHERE key = ?", (key,))
+                .fetchone()
+                is not None
+            )
+        except Exception as e:
+            logger.error(
+                f"Failed to check data in {self._filepath}: {e}\n{traceback.format_exc()}"
+            )
+            return False
+
+    def list(self, filter: str | None = None) -> list:
+        try:
+            conn = self._connect()
+            where, params = self._key_range(filter)
+            items = self._load_items(conn, where, params)
+            return [
+                self._merge_items(json.loads(data), items.get(key, {}))
+                for key, data in conn.execute(
+                    f"SELECT key, data FROM {self._table} {where} ORDER BY key", params
+                )
+            ]
+        except Exception as e:
+            logger.error(
+                f"Failed to list data from {self._filepath}: {e}\n{traceback.format_exc()}"
+            )
+            return []
+
+
+class RedisStorage(Storage):
+    """
+    Redis storage shared by several application nodes. Each record is a hash of
+    JSON-encoded fields, and list fields written through append are Redis lists
+    next to it, so a new message is pushed instead of rewriting the record. Keys
+    are kept in a sorted set for prefix listing. Every write is a single
+    pipelined transaction, and publishes the changed key so the other nodes can
+    invalidate their caches. Writes that read the record first WATCH it and are
+    retried when another node changes it in between.
+    """
+
+    # the hash field naming the list fields stored as Redis lists
+    LIST_FIELDS = "__lists__"
+
+    def __init__(self, client, namespace: str, key_prefix: str = "cyberalchemy:"):
+        self._client = client
+        self._prefix = f"{key_prefix}{namespace}:"
+        self._keys_key = f"{self._prefix}keys"
+        self._channel = f"{self._prefix}changes"
+        # tells the changes of this instance apart from those of other nodes
+        self._node_id = uuid4().hex
+
+    def _record_key(self, key: str) -> str:
+        return f"{self._prefix}r:{key}"
+
+    def _list_key(self, key: str, field: str) -> str:
+        return f"{self._prefix}l:{key}:{field}"
+
+    def _publish(self, pipe, key: str) -> None:
+        pipe.publish(self._channel, json.dumps({"node": self._node_id, "key": key}))
+
+    def _get_list_fields(self, keys: list[str]) -> list[list[str]]:
+        pipe = self._client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hget(self._record_key(key), self.LIST_FIELDS)
+        return [json.loads(fields) if fields else [] for fields in pipe.execute()]
+
+    def save(self, key: str, data) -> None:
+        self.save_many({key: data})
+
+    def save_many(self, items: dict[str, Any]) -> None:
+        keys = list(items)
+
+        def write(pipe) -> None:
+            # read after WATCH, so a concurrent change of the list fields aborts the write
+            list_fields = self._get_list_fields(keys)
+            pipe.multi()
+            for (key, data), fields in zip(items.items(), list_fields):
+                record_key = self._record_key(key)
+                pipe.delete(record_key, *(self._list_key(key, f) for f in fields))
+                if data:
+                    pipe.hset(
+                        record_key,
+                        mapping={
+                            name: json.dumps(value) for name, value in data.items()
+                        },
+                    )
+                pipe.zadd(self._keys_key, {key: 0})
+                self._publish(pipe, key)
+
+        try:
+            self._client.transaction(write, *(self._record_key(key) for key in keys))
+        except Exception as e:
+            logger.error(
+                f"Failed to save data to {self._prefix}: {e}\n{traceback.format_exc()}"
+            )
+
+    def append(self, key: str, data: dict, field: str, items: list, start: int) -> None:
+        record_key = self._record_key(key)
+        list_key = self._list_key(key, field)
+
+        def write(pipe) -> None:
+            fields_json, current = pipe.hmget(record_key, [self.LIST_FIELDS, field])
+            fields = json.loads(fields_json) if fields_json else []
+            list_items = items
+
+            pipe.multi()
+            if field in fields:
+                if start > 0:
+                    pipe.ltrim(list_key, 0, start - 1)
+                else:
+                    pipe.delete(list_key)
+            else:
+                # the list was saved inside the record: move it to a Redis list
+                list_items = (json.loads(current) if current else [])[:start] + items
+                fields.append(field)
+                pipe.delete(list_key)
+                pipe.hdel(record_key, field)
+            pipe.hset(
+                record_key,
+                mapping={
+                    **{
+                        name: json.dumps(value)
+                        for name, value in data.items()
+                        if name != field
+                    },
+                    self.LIST_FIELDS: json.dumps(fields),
+                },
+            )
+            if list_items:
+                pipe.rpush(list_key, *(json.dumps(item) for item in list_items))
+            pipe.zadd(self._keys_key, {key: 0})
+            self._publish(pipe, key)
+
+        try:
+            # retried when the record changes between the read and the write
+            self._client.transaction(write, record_key)
+        except Exception as e:
+            logger.error(
+                f"Failed to append data to {self._prefix}{key}: {e}\n{traceback.format_exc()}"
+            )
+
+    def _load_many(self, keys: list[str]) -> list:
+        pipe = self._client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(self._record_key(key))
+        records = []
+        list_fields = []
+        for key, hash in zip(keys, pipe.execute()):
+            if not hash:
+                records.append(None)
+                continue
+            data = {
+                (name.decode() if isinstance(name, bytes) else name): json.loads(value)
+                for name, value in hash.items()
+            }
+            list_fields.extend(
+                (len(records), f) for f in data.pop(self.LIST_FIELDS, [])
+            )
+            records.append(data)
+
+        # the lists of all records in one round trip
+        pipe = self._client.pipeline(transaction=False)
+        for index, field in list_fields:
+            pipe.lrange(self._list_key(keys[index], field), 0, -1)
+        for (index, field), items in zip(list_fields, pipe.execute()):
+            records[index][field] = [json.loads(item) for item in items]
+        return records
+
+    def load(self, key: str):
+        try:
+            return self._load_many([key])[0]
+        except Exception as e:
+            logger.error(
+                f"Failed to load data from {self._prefix}{key}: {e}\n{traceback.format_exc()}"
+            )
+            return None
+
+    def delete(self, key: str) -> None:
+        def write(pipe) -> None:
+            fields = self._get_list_fields([key])[0]
+            pipe.multi()
+            pipe.delete(
+                self._record_key(key),
+                *(self._list_key(key, field) for field in fields),
+            )
+            pipe.zrem(self._keys_key, key)
+            self._publish(pipe, key)
+
+        try:
+            self._client.transaction(write, self._record_key(key))
+        except Exception as e:
+            logger.error(
+                f"Failed to delete data from {self._prefix}{key}: {e}\n{traceback.format_exc()}"
+            )
+
+    def exists(self, key: str) -> bool:
+        try:
+            return bool(self._client.exists(self._record_key(key)))
+        except Exception as e:
+            logger.error(
+                f"Failed to check data in {self._prefix}{key}: {e}\n{traceback.format_exc()}"
+            )
+            return False
+
+    def list(self, filter: str | None = None) -> list:
+        try:
+            keys = [
+                key.decode() if isinstance(key, bytes) else key
+                for key in self._client.zrangebylex(
+                    self._keys_key,
+                    f"[{filter}" if filter else "-",
+                    f"[{filter}\U0010ffff" if filter else "+",
+                )
+            ]
+            return [data for data in self._load_many(keys) if data is not None]
+        except Exception as e:
+            logger.error(
+                f"Failed to list data from {self._prefix}: {e}\n{traceback.format_exc()}"
+            )
+            return []
+
+    def subscribe(self, on_change: Callable[[str], None]) -> None:
+        """
+        Call on_change from a daemon thread with the key of every record changed
+        by another node.
+        """
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+
+        def handle_message(message: dict) -> None:
+            try:
+                change = json.loads(message["data"])
+                if change["node"] != self._node_id:
+                    on_change(change["key"])
+            except Exception as e:
+                logger.error(f"Failed to handle a change of {self._prefix}: {e}")
+
+        pubsub.subscribe(**{self._channel: handle_message})
+        pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+
+
+_redis_clients: dict[str, Any] = {}
+
+
+def create_storage(
+    namespace: str, kind: Literal["record", "journal", "index"] = "record"
+) -> Storage:
+    """
+    Create the storage for a namespace from the environment configuration.
+
+    STORAGE_BACKEND selects the backend ("file", "sqlite", "redis" or "memory") and
+    {NAMESPACE}_STORAGE_BACKEND overrides it for one namespace. For the file
+    backend, kind selects the layout: one JSON file per record, JSON files with
+    append journals, or a single JSON Lines index file.
+    """
+    backend = os.getenv(
+        f"{namespace.upper()}_STORAGE_BACKEND", os.getenv("STORAGE_BACKEND", "file")
+    )
+    directory = os.getenv("STORAGE_DIRECTORY", "temp")
+    if backend == "file":
+        if kind == "journal":
+            return JournalFileStorage(os.path.join(directory, namespace))
+        if kind == "index":
+            return JsonLinesStorage(os.path.join(directory, f"{namespace}.jsonl"))
+        return JsonFileStorage(os.path.join(directory, namespace))
+    elif backend == "sqlite":
+        return SqliteStorage(
+            os.getenv("SQLITE_STORAGE_PATH", os.path.join(directory, "storage.db")),
+            namespace,
+        )
+    elif backend == "redis":
+        if redis is None:
+            raise ValueError("The redis storage backend requires the redis package")
+        url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        # all namespaces share the connection pool of a client
+        if url not in _redis_clients:
+            _redis_clients[url] = redis.Redis.from_url(url)
+        return RedisStorage(
+            _redis_clients[url],
+            namespace,
+            os.getenv("REDIS_KEY_PREFIX", "cyberalchemy:"),
+        )
+    elif backend == "memory":
+        return InMemoryStorage()
+    else:
+        raise ValueError(f"Unknown storage backend: {backend}")
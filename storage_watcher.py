@@ -0,0 +1,316 @@
+import logging
+import os
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Literal, Tuple
+
+from pydantic import BaseModel
+
+import metrics
+from storage import JsonFileStorage, JsonLinesStorage, RedisStorage, Storage
+
+try:
+    from watchdog.events import FileSystemEvent, FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+logger = logging.getLogger(__name__)
+
+WatchMode = Literal["auto", "watchdog", "polling", "off"]
+
+
+class StorageChange(BaseModel):
+    key: str
+    kind: Literal["added", "updated", "deleted"]
+    # the new data, None when deleted
+    data: Any = None
+
+
+class StorageWatcher:
+    """Watches a storage directory for changed files, with inotify-style filesystem
+    events from watchdog when it is installed, or by polling file modification times.
+
+    Without filename, changes of the "{key}.json" files in the directory are reported
+    with their key. With filename, only that file is watched and its changes are
+    reported with the key None.
+
+    Args:
+        directory (str): The directory to watch.
+        on_change (Callable[[str | None], None]): Called from the watcher thread.
+        filename (str | None): The only file to watch in the directory.
+        mode (WatchMode): How changes are detected; "auto" prefers watchdog.
+        poll_interval (float): Seconds between scans when polling.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        on_change: Callable[[str | None], None],
+        filename: str | None = None,
+        mode: WatchMode = "auto",
+        poll_interval: float = 1.0,
+    ) -> None:
+        if mode not in ("auto", "watchdog", "polling", "off"):
+            raise ValueError(f"Unknown watch mode: {mode}")
+        if mode == "watchdog" and Observer is None:
+            raise ValueError("The watchdog watch mode requires the watchdog package")
+        self._directory = directory
+        self._on_change = on_change
+        self._filename = filename
+        self._mode = mode
+        self._poll_interval = poll_interval
+        self._observer = None
+        self._stop = threading.Event()
+
+    def _get_key(self, path: str) -> str | None:
+        """Get the key of a changed file, or None if the file isn't watched."""
+        name = os.path.basename(path)
+        if self._filename is not None:
+            return name if name == self._filename else None
+        if name.endswith(".json"):
+            return name[: -len(".json")]
+        return None
+
+    def _notify(self, path: str) -> None:
+        if self._get_key(path) is None:
+            return
+        try:
+            self._on_change(None if self._filename else self._get_key(path))
+        except Exception as e:
+            logger.error(f"Failed to handle the change of {path}: {e}")
+
+    def start(self) -> None:
+        if self._mode == "off":
+            return
+        os.makedirs(self._directory, exist_ok=True)
+        if self._mode != "polling" and Observer is not None:
+            watcher = self
+
+            class Handler(FileSystemEventHandler):
+                def on_any_event(self, event: FileSystemEvent) -> None:
+                    # reading a file raises events too, which must not reload it again
+                    if event.is_directory or event.event_type not in (
+                        "created",
+                        "modified",
+                        "deleted",
+                        "moved",
+                    ):
+                        return
+                    watcher._notify(os.fsdecode(event.src_path))
+                    # files written to a temporary file and renamed into place
+                    if dest_path := getattr(event, "dest_path", None):
+                        watcher._notify(os.fsdecode(dest_path))
+
+            self._observer = Observer()
+            self._observer.schedule(Handler(), self._directory, recursive=False)
+            self._observer.daemon = True
+            self._observer.start()
+            return
+        # the baseline is scanned before start returns, so changes made after it are seen
+        threading.Thread(
+            target=self._poll,
+            args=(self._scan(),),
+            name=f"storage-watcher-{self._directory}",
+            daemon=True,
+        ).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        """Get the modification time and size of the watched files."""
+        try:
+            with os.scandir(self._directory) as entries:
+                return {
+                    entry.path: (stat.st_mtime_ns, stat.st_size)
+                    for entry in entries
+                    if self._get_key(entry.path) is not None
+                    and entry.is_file()
+                    and (stat := entry.stat())
+                }
+        except FileNotFoundError:
+            return {}
+
+    def _poll(self, files: Dict[str, Tuple[int, int]]) -> None:
+        while not self._stop.wait(self._poll_interval):
+            current = self._scan()
+            for path in current.keys() | files.keys():
+                if current.get(path) != files.get(path):
+                    self._notify(path)
+            files = current
+
+
+class SharedStorageCache:
+    """A process-wide cache of the records of a storage namespace, shared by all
+    sessions, that keeps a log of fine-grained changes. Sessions load a snapshot once
+    and then apply the changes since the version they have seen, instead of
+    rescanning the storage.
+
+    Changes made in this process are published directly. Changes made by other
+    processes are picked up by a StorageWatcher on file storages, and through pub/sub
+    on Redis storages.
+
+    Args:
+        storage (Storage): The storage of the records.
+        key_field (str): The field of a record holding its key.
+        name (str): The name of the cache in metrics.
+        load (Callable[[], List[Any]] | None): Loads all records initially, instead of
+            listing the storage.
+        max_changes (int): The number of changes kept; sessions further behind
+            reload the snapshot.
+        watch_mode (WatchMode): How the storage files are watched.
+        poll_interval (float): Seconds between scans when polling.
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        key_field: str,
+        name: str,
+        load: Callable[[], List[Any]] | None = None,
+        max_changes: int = 1024,
+        watch_mode: WatchMode = "auto",
+        poll_interval: float = 1.0,
+    ) -> None:
+        self._storage = storage
+        self._key_field = key_field
+        self._name = name
+        self._load_records = load or (lambda: self._storage.list(""))
+        self._records: Dict[str, Any] | None = None
+        # the reload count of a single-file storage when its records were last compared
+        self._reload_count = 0
+        self._changes: deque[Tuple[int, StorageChange]] = deque(maxlen=max_changes)
+        self._version = 0
+        self._lock = threading.RLock()
+        self._watcher: StorageWatcher | None = None
+        if isinstance(storage, JsonLinesStorage):
+            self._watcher = StorageWatcher(
+                os.path.dirname(storage.filepath) or ".",
+                self._on_storage_change,
+                filename=os.path.basename(storage.filepath),
+                mode=watch_mode,
+                poll_interval=poll_interval,
+            )
+        elif isinstance(storage, JsonFileStorage):
+            self._watcher = StorageWatcher(
+                storage.directory,
+                self._on_storage_change,
+                mode=watch_mode,
+                poll_interval=poll_interval,
+            )
+
+    def _load(self) -> Dict[str, Any]:
+        """Load all records and start watching the storage, on first use."""
+        if self._records is None:
+            # watch before loading, so no change made after the load is missed; changes
+            # reported meanwhile wait for the lock held by the caller
+            if self._watcher is not None:
+                self._watcher.start()
+            elif isinstance(self._storage, RedisStorage):
+                self._storage.subscribe(self._on_storage_change)
+            if isinstance(self._storage, JsonLinesStorage):
+                self._reload_count = self._storage.get_reload_count()
+            self._records = {
+                data[self._key_field]: data
+                for data in self._load_records()
+                if data and self._key_field in data
+            }
+        return self._records
+
+    def snapshot(self) -> Tuple[int, List[Any]]:
+        """Get the current version and all records."""
+        with self._lock:
+            return self._version, list(self._load().values())
+
+    def changes(self, version: int) -> Tuple[int, List[StorageChange]] | None:
+        """Get the current version and the latest change of every record changed after
+        a version, or None if the changes are no longer kept and the snapshot must be
+        reloaded."""
+        with self._lock:
+            if version == self._version:
+                return version, []
+            if not self._changes or version < self._changes[0][0] - 1:
+                return None
+            changes: Dict[str, StorageChange] = {}
+            for change_version, change in reversed(self._changes):
+                if change_version <= version:
+                    break
+                changes.setdefault(change.key, change)
+            metrics.counter(f"{self._name}.deltas").inc(len(changes))
+            return self._version, list(reversed(changes.values()))
+
+    def publish(self, key: str, data: Any = None) -> None:
+        """Record a new version of a record, or its deletion if data is None."""
+        with self._lock:
+            if self._records is None:
+                # nobody has loaded the records yet
+                return
+            current = self._records.get(key)
+            if data is None:
+                if current is None:
+                    return
+                del self._records[key]
+                change = StorageChange(key=key, kind="deleted")
+            else:
+                if current is data or current == data:
+                    return
+                self._records[key] = data
+                change = StorageChange(
+                    key=key,
+                    kind="updated" if current is not None else "added",
+                    data=data,
+                )
+            self._version += 1
+            self._changes.append((self._version, change))
+
+    def _on_storage_change(self, key: str | None) -> None:
+        metrics.counter(f"{self._name}.change_events").inc()
+        if key is not None:
+            data = self._storage.load(key)
+            # a file that can't be read yet is reported again once it's written
+            if data is not None or not self._storage.exists(key):
+                self.publish(key, data)
+            return
+        # changes written through this process's storage have been published already
+        reload_count = self._storage.get_reload_count()  # type: ignore[attr-defined]
+        if reload_count == self._reload_count:
+            metrics.counter(f"{self._name}.skipped_change_events").inc()
+            return
+        # a single-file storage changed elsewhere: compare all records, mostly by identity
+        records = {
+            data[self._key_field]: data
+            for data in self._storage.list("")
+            if data and self._key_field in data
+        }
+        with self._lock:
+            self._reload_count = reload_count
+            for key in list(self._load().keys() - records.keys()):
+                self.publish(key)
+            for key, data in records.items():
+                self.publish(key, data)
+
+
+def create_shared_cache(
+    storage: Storage,
+    key_field: str,
+    name: str,
+    load: Callable[[], List[Any]] | None = None,
+) -> SharedStorageCache:
+    """
+    Create the shared cache of a storage from the environment configuration.
+
+    STORAGE_WATCH selects how changes of other processes are detected ("auto",
+    "watchdog", "polling" or "off") and STORAGE_WATCH_POLL_INTERVAL the seconds
+    between scans when polling.
+    """
+    return SharedStorageCache(
+        storage,
+        key_field,
+        name,
+        load=load,
+        watch_mode=os.getenv("STORAGE_WATCH", "auto"),  # type: ignore[arg-type]
+        poll_interval=float(os.getenv("STORAGE_WATCH_POLL_INTERVAL", "1.0")),
+    )
@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Tuple
+
+from dotenv import load_dotenv
+
+import metrics
+from storage import Storage, create_storage
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+
+class SummaryCache:
+    """A process-wide LRU cache of archive summaries, keyed by content.
+
+    Keys are derived from a rolling fingerprint of the summarized messages plus the
+    prompts and the model, so participants of a group chat and forks that archive an
+    identical message prefix share one summary. Concurrent requests for the same key
+    wait for the first one instead of summarizing again.
+
+    Args:
+        max_entries (int): The maximum number of cached summaries.
+        storage (Storage | None): Persists the cached summaries across restarts, if set.
+    """
+
+    def __init__(self, max_entries: int = 1024, storage: Storage | None = None) -> None:
+        if max_entries <= 0:
+            raise ValueError("max_entries must be greater than 0.")
+        self._max_entries = max_entries
+        self._storage = storage
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._pending: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(fingerprint: str, *parts: str) -> str:
+        """Make a cache key from a content fingerprint and the prompts and model used."""
+        return hashlib.sha256("\0".join((fingerprint, *parts)).encode()).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """Get a cached summary, None if it is not cached."""
+        summary = self._get_entry(key)
+        if summary is None:
+            summary = self._load(key)
+        return summary
+
+    def _get_entry(self, key: str) -> str | None:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        return None
+
+    def _load(self, key: str) -> str | None:
+        if self._storage is None:
+            return None
+        try:
+            data = self._storage.load(key)
+        except Exception as e:
+            logger.error(f"Failed to load summary {key}: {e}")
+            return None
+        if not data:
+            return None
+        self._put(key, data["summary"], persist=False)
+        return data["summary"]
+
+    def put(self, key: str, summary: str) -> None:
+        """Cache a summary, evicting the least recently used ones beyond max_entries."""
+        self._put(key, summary, persist=True)
+
+    def _put(self, key: str, summary: str, persist: bool) -> None:
+        with self._lock:
+            self._entries[key] = summary
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self._max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+        if self._storage is None:
+            return
+        try:
+            if persist:
+                self._storage.save(key, {"summary": summary})
+            for evicted_key in evicted:
+                self._storage.delete(evicted_key)
+        except Exception as e:
+            logger.error(f"Failed to persist summary {key}: {e}")
+
+    async def get_or_create(
+        self, key: str, create: Callable[[], Awaitable[str | None]]
+    ) -> str | None:
+        """Get a cached summary, or create and cache it. Returns None if creating it failed."""
+        summary = self._get_entry(key)
+        # keep the storage IO off the event loop
+        if summary is None and self._storage is not None:
+            summary = await asyncio.to_thread(self._load, key)
+        if summary is not None:
+            metrics.counter("summary_cache.hits").inc()
+            return summary
+
+        loop = asyncio.get_running_loop()
+        pending = self._pending.get(key)
+        # futures can only be awaited in the event loop that created them
+        if pending is not None and pending[0] is loop:
+            metrics.counter("summary_cache.hits").inc()
+            return await asyncio.shield(pending[1])
+
+        metrics.counter("summary_cache.misses").inc()
+        future = loop.create_future()
+        self._pending[key] = (loop, future)
+        try:
+            summary = await create()
+            if summary is not None:
+                if self._storage is None:
+                    self.put(key, summary)
+                else:
+                    await asyncio.to_thread(self.put, key, summary)
+            future.set_result(summary)
+        except BaseException:
+            future.set_result(None)
+            raise
+        finally:
+            if self._pending.get(key, (None, None))[1] is future:
+                del self._pending[key]
+        return summary
+
+    def clear(self) -> None:
+        """Drop the cached summaries kept in memory."""
+        with self._lock:
+            self._entries.clear()
+
+
+summary_cache = SummaryCache(
+    max_entries=int(os.getenv("SUMMARY_CACHE_SIZE", "1024")),
+    storage=(
+        create_storage("summaries", kind="index")
+        if os.getenv("SUMMARY_CACHE_PERSISTENT", "false").lower() == "true"
+        else None
+    ),
+)